@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+⏱️ Benchmark del camino crítico del detector de verdad
+Mide la latencia p50/p99 de `predict`, el rendimiento de `predict_batch`, el
+tiempo de `train()` y de `load_model()` y la memoria máxima sobre datasets
+sintéticos de 10k, 100k y 1M filas generados con MassiveDataGenerator.
+Guarda los resultados en JSON y los compara con una línea base guardada,
+fallando si alguna métrica empeora más que su umbral
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from typing import Dict, List
+
+from data_generator import MassiveDataGenerator
+
+# Métricas y si un valor mayor es mejor (rendimiento) o peor (tiempos, memoria)
+METRICS = {
+    "train_s": False,
+    "load_model_s": False,
+    "predict_p50_ms": False,
+    "predict_p99_ms": False,
+    "batch_statements_per_s": True,
+    "peak_rss_mb": False,
+}
+DEFAULT_THRESHOLD = 0.10
+
+
+def build_dataset(rows: int, seed: int, data_dir: str) -> str:
+    """CSV con `rows` afirmaciones de MassiveDataGenerator (reutiliza el de
+    una ejecución anterior con los mismos parámetros). Las categorías de
+    tamaño fijo se incluyen completas y el resto se reparte entre hechos
+    matemáticos y científicos, que admiten cualquier cantidad; con muchas
+    filas hay afirmaciones repetidas, como en un corpus real"""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"synthetic_{rows}_{seed}.csv")
+    if os.path.exists(path):
+        return path
+
+    random.seed(seed)
+    generator = MassiveDataGenerator()
+    with contextlib.redirect_stdout(io.StringIO()):
+        generator.generate_geography_facts()
+        generator.generate_history_facts()
+        generator.generate_technology_facts()
+        remaining = max(0, rows - len(generator.dataset))
+        # Cada hecho matemático añade dos filas y cada científico, una
+        generator.generate_math_facts(math.ceil(remaining * 0.6 / 2))
+        generator.generate_science_facts(math.ceil(remaining * 0.4))
+        random.shuffle(generator.dataset)
+        del generator.dataset[rows:]
+        generator.save_to_csv(path)
+    return path
+
+
+def percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    """Memoria residente máxima del proceso (ru_maxrss: KB en Linux, bytes en macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_size(rows: int, dataset_path: str, options: Dict) -> Dict:
+    """Ejecuta las mediciones de un tamaño en un proceso nuevo, para que la
+    memoria máxima sea la de este tamaño. El modelo se guarda en un
+    directorio temporal y no sustituye al del proyecto"""
+    import logging
+
+    from truth_detector_server import TruthDetector
+
+    logging.getLogger("truth_detector_server").setLevel(logging.WARNING)
+    os.chdir(tempfile.mkdtemp(prefix="truth_detector_bench_"))
+    model_path = "truth_detector_model.pkl"
+
+    detector = TruthDetector()
+    detector.dataset_path = dataset_path
+    started = time.perf_counter()
+    # train() incluye guardar el modelo, como en el servidor
+    detector.train()
+    train_s = time.perf_counter() - started
+
+    load_times = []
+    for _ in range(options["repeat"]):
+        loaded = TruthDetector()
+        started = time.perf_counter()
+        if not loaded.load_model(model_path):
+            raise RuntimeError(f"No se pudo cargar el modelo de {rows} filas")
+        load_times.append(time.perf_counter() - started)
+    detector = loaded
+
+    # Afirmaciones vistas en el entrenamiento y variaciones no vistas
+    rng = random.Random(options["seed"])
+    base = detector.truth_statements + detector.false_statements
+    samples = [rng.choice(base) for _ in range(options["predict_samples"])]
+    samples = [statement if i % 2 else f"{statement} aproximadamente" for i, statement in enumerate(samples)]
+
+    for statement in samples[:10]:
+        detector.predict(statement)
+    latencies = []
+    for statement in samples:
+        started = time.perf_counter()
+        detector.predict(statement)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    batch = [rng.choice(base) for _ in range(options["batch_statements"])]
+    chunk = options["batch_size"]
+    best_batch = float("inf")
+    for _ in range(options["repeat"]):
+        started = time.perf_counter()
+        for start in range(0, len(batch), chunk):
+            detector.predict_batch(batch[start : start + chunk])
+        best_batch = min(best_batch, time.perf_counter() - started)
+
+    return {
+        "rows": rows,
+        "train_s": train_s,
+        "model_bytes": os.path.getsize(model_path),
+        "load_model_s": min(load_times),
+        "predict_p50_ms": percentile(latencies, 50),
+        "predict_p99_ms": percentile(latencies, 99),
+        "predict_mean_ms": statistics.fmean(latencies),
+        "batch_statements_per_s": len(batch) / best_batch,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def environment() -> Dict:
+    import numpy
+    import sklearn
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "sklearn": sklearn.__version__,
+    }
+
+
+def run(sizes: List[int], options: Dict) -> Dict:
+    results = {}
+    context = get_context("spawn")
+    for rows in sizes:
+        print(f"🧪 {rows:,} filas: generando dataset...", file=sys.stderr)
+        dataset_path = build_dataset(rows, options["seed"], options["data_dir"])
+        print(f"🧪 {rows:,} filas: midiendo...", file=sys.stderr)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results[str(rows)] = pool.submit(run_size, rows, dataset_path, options).result()
+    return {"environment": environment(), "options": options, "results": results}
+
+
+def compare(current: Dict, baseline: Dict, thresholds: Dict[str, float]) -> List[Dict]:
+    """Variación relativa de cada métrica respecto a la línea base; una
+    métrica es una regresión si empeora más que su umbral"""
+    rows = []
+    for size, result in current["results"].items():
+        reference = baseline["results"].get(size)
+        if reference is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if metric not in result or not reference.get(metric):
+                continue
+            change = (result[metric] - reference[metric]) / reference[metric]
+            worse = -change if higher_is_better else change
+            threshold = thresholds.get(metric, thresholds["default"])
+            rows.append(
+                {
+                    "rows": size,
+                    "metric": metric,
+                    "baseline": reference[metric],
+                    "current": result[metric],
+                    "change": change,
+                    "threshold": threshold,
+                    "regression": worse > threshold,
+                }
+            )
+    return rows
+
+
+def parse_thresholds(default: float, overrides: List[str]) -> Dict[str, float]:
+    thresholds = {"default": default}
+    for override in overrides:
+        metric, _, value = override.partition("=")
+        if metric not in METRICS or not value:
+            raise SystemExit(
+                f"❌ Umbral no válido: {override}. Usa métrica=fracción con: {', '.join(METRICS)}"
+            )
+        thresholds[metric] = float(value)
+    return thresholds
+
+
+def print_results(results: Dict):
+    print(
+        f"{'filas':>9} {'train s':>9} {'load s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'lote/s':>10} {'RSS MB':>8} {'modelo MB':>10}"
+    )
+    for result in results["results"].values():
+        print(
+            f"{result['rows']:>9,} {result['train_s']:>9.2f} {result['load_model_s']:>8.3f} "
+            f"{result['predict_p50_ms']:>8.2f} {result['predict_p99_ms']:>8.2f} "
+            f"{result['batch_statements_per_s']:>10,.0f} {result['peak_rss_mb']:>8.0f} "
+            f"{result['model_bytes'] / 1024 / 1024:>10.1f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del camino crítico del detector de verdad")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones de carga y de lote (se toma la mejor)")
+    parser.add_argument("--predict-samples", type=int, default=500, help="Llamadas a predict para los percentiles")
+    parser.add_argument("--batch-statements", type=int, default=2048, help="Afirmaciones del lote")
+    parser.add_argument("--batch-size", type=int, default=32, help="Afirmaciones por llamada a predict_batch")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "truth_detector_bench"))
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="Resultados en JSON")
+    parser.add_argument("--baseline", help="Línea base con la que comparar (JSON de una ejecución anterior)")
+    parser.add_argument("--save-baseline", help="Guarda también los resultados como línea base en este fichero")
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD,
+        help="Empeoramiento relativo máximo de cualquier métrica (0.10 = 10%%)",
+    )
+    parser.add_argument(
+        "--metric-threshold", action="append", default=[], metavar="MÉTRICA=FRACCIÓN",
+        help="Umbral de una métrica concreta, p. ej. predict_p99_ms=0.25",
+    )
+    args = parser.parse_args(argv)
+    thresholds = parse_thresholds(args.threshold, args.metric_threshold)
+    if args.baseline and not os.path.exists(args.baseline):
+        raise SystemExit(f"❌ No existe la línea base: {args.baseline}")
+
+    options = {
+        "repeat": args.repeat,
+        "predict_samples": args.predict_samples,
+        "batch_statements": args.batch_statements,
+        "batch_size": args.batch_size,
+        "seed": args.seed,
+        "data_dir": args.data_dir,
+    }
+    results = run(args.sizes, options)
+    print_results(results)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Resultados guardados en {path}", file=sys.stderr)
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    comparison = compare(results, baseline, thresholds)
+    print()
+    print(f"{'filas':>9} {'métrica':>24} {'base':>12} {'actual':>12} {'cambio':>8} {'umbral':>7}")
+    for row in comparison:
+        mark = "❌" if row["regression"] else "✅"
+        print(
+            f"{int(row['rows']):>9,} {row['metric']:>24} {row['baseline']:>12.3f} {row['current']:>12.3f} "
+            f"{row['change']:>+8.1%} {row['threshold']:>7.0%} {mark}"
+        )
+    regressions = [row for row in comparison if row["regression"]]
+    if regressions:
+        print(f"\n❌ {len(regressions)} métricas empeoraron por encima de su umbral", file=sys.stderr)
+        return 1
+    print("\n✅ Sin regresiones respecto a la línea base", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
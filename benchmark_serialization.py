@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+⏱️ Benchmark de serialización de respuestas
+Compara json.dumps, orjson y msgpack sobre respuestas de lotes grandes del
+detector: tiempo de codificación y tamaño en bytes de cada formato. También
+mide el coste de CPU de comprimirlas (gzip en HTTP, deflate en WebSocket)
+frente a los bytes ahorrados
+"""
+
+import argparse
+import gzip
+import json
+import time
+import zlib
+from typing import Callable, Dict, List
+
+from truth_detector_server import TruthDetector, batch_results_payload, dumps_json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependencia opcional
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - dependencia opcional
+    msgpack = None
+
+
+def build_payload(detector: TruthDetector, size: int) -> Dict:
+    """Respuesta de /predict/batch con `size` afirmaciones del dataset"""
+    base = detector.truth_statements + detector.false_statements
+    statements = [base[i % len(base)] for i in range(size)]
+    predictions = detector.predict_batch(statements)
+    payload = batch_results_payload(statements, predictions)
+    return {
+        "success": True,
+        "total_statements": size,
+        "results": payload["results"],
+    }
+
+
+def get_encoders() -> Dict[str, Callable]:
+    encoders = {
+        "json": lambda payload: json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+        "dumps_json": dumps_json,
+    }
+    if orjson is not None:
+        encoders["orjson"] = orjson.dumps
+    if msgpack is not None:
+        encoders["msgpack"] = lambda payload: msgpack.packb(payload, use_bin_type=True)
+    return encoders
+
+
+def decode(name: str, data: bytes):
+    if name == "msgpack":
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+def measure(encoder: Callable, payload: Dict, repeat: int) -> float:
+    """Mejor tiempo de codificación en segundos sobre `repeat` ejecuciones"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        encoder(payload)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def deflate_message(data: bytes, level: int) -> bytes:
+    """Compresión de un mensaje con permessage-deflate (deflate sin cabecera)"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)[:-4]
+
+
+def get_compressors(levels: List[int]) -> Dict[str, Callable]:
+    compressors = {}
+    for level in levels:
+        compressors[f"gzip-{level}"] = lambda data, level=level: gzip.compress(data, compresslevel=level)
+        compressors[f"deflate-{level}"] = lambda data, level=level: deflate_message(data, level)
+    return compressors
+
+
+def run_compression(sizes: List[int], levels: List[int], repeat: int, model_path: str) -> List[Dict]:
+    """Coste de comprimir la respuesta JSON de un lote frente al ahorro"""
+    detector = load_detector(model_path)
+    rows = []
+    for size in sizes:
+        data = dumps_json(build_payload(detector, size))
+        for name, compressor in get_compressors(levels).items():
+            compressed = compressor(data)
+            seconds = measure(compressor, data, repeat)
+            rows.append(
+                {
+                    "size": size,
+                    "compressor": name,
+                    "ms": seconds * 1000,
+                    "bytes": len(data),
+                    "compressed_bytes": len(compressed),
+                    "ratio": len(data) / len(compressed),
+                    # Bytes ahorrados por milisegundo de CPU
+                    "saved_per_ms": (len(data) - len(compressed)) / (seconds * 1000),
+                }
+            )
+    return rows
+
+
+def load_detector(model_path: str) -> TruthDetector:
+    detector = TruthDetector()
+    if not detector.load_model(model_path):
+        raise SystemExit(f"❌ No se pudo cargar el modelo: {model_path}")
+    return detector
+
+
+def run(sizes: List[int], repeat: int, model_path: str) -> List[Dict]:
+    detector = load_detector(model_path)
+
+    rows = []
+    for size in sizes:
+        payload = build_payload(detector, size)
+        reference = None
+        for name, encoder in get_encoders().items():
+            data = encoder(payload)
+            # Todos los formatos deben reconstruir exactamente la misma respuesta
+            decoded = decode(name, data)
+            if reference is None:
+                reference = decoded
+            assert decoded == reference, f"{name} no reproduce la respuesta"
+            rows.append(
+                {
+                    "size": size,
+                    "encoder": name,
+                    "ms": measure(encoder, payload, repeat) * 1000,
+                    "bytes": len(data),
+                }
+            )
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de serialización de respuestas")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--model", default="truth_detector_model.pkl")
+    parser.add_argument(
+        "--compression-levels", type=int, nargs="*", default=[1, 5, 9],
+        help="Niveles de compresión a medir (vacío = no medir compresión)",
+    )
+    args = parser.parse_args(argv)
+
+    rows = run(args.sizes, args.repeat, args.model)
+    print(f"{'lote':>8} {'codificador':>12} {'ms':>10} {'bytes':>12}")
+    for row in rows:
+        print(f"{row['size']:>8} {row['encoder']:>12} {row['ms']:>10.2f} {row['bytes']:>12,}")
+
+    if args.compression_levels:
+        rows = run_compression(args.sizes, args.compression_levels, args.repeat, args.model)
+        print()
+        print(
+            f"{'lote':>8} {'compresor':>12} {'ms':>10} {'bytes':>12} "
+            f"{'comprimido':>12} {'ratio':>7} {'ahorro/ms':>12}"
+        )
+        for row in rows:
+            print(
+                f"{row['size']:>8} {row['compressor']:>12} {row['ms']:>10.2f} {row['bytes']:>12,} "
+                f"{row['compressed_bytes']:>12,} {row['ratio']:>7.1f} {row['saved_per_ms']:>12,.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
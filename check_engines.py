@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+⚖️ Comprobación de equivalencia de los motores de puntuación
+Ejecuta cada motor registrado (por lotes, con campos reducidos, por
+fragmentos del índice, con deduplicación por clave canónica, tras guardar y
+recargar el modelo...) sobre todo el dataset más afirmaciones aleatorias y
+adversarias, y compara la predicción, la confianza, la afirmación más
+similar y los agregados de similaridad con los de la referencia,
+`TruthDetector.predict`, dentro de las tolerancias de cada motor.
+
+Los motores nuevos se registran con `@register_engine` en este fichero o en
+un módulo que se carga con `--import`, y quedan cubiertos automáticamente
+"""
+
+import argparse
+import importlib
+import json
+import math
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+# Campos que se comparan: los de texto exactos y los numéricos con tolerancia
+EXACT_FIELDS = ("prediction", "most_similar_statement")
+NUMERIC_FIELDS = (
+    "confidence",
+    "similarity_score",
+    "max_true_similarity",
+    "max_false_similarity",
+    "avg_true_similarity",
+    "avg_false_similarity",
+)
+COMPARED_FIELDS = EXACT_FIELDS + NUMERIC_FIELDS
+DEFAULT_TOLERANCE = 1e-9
+BATCH_SIZE = 64
+
+
+class Engine:
+    """Camino de puntuación alternativo: recibe el detector y una lista de
+    afirmaciones y devuelve un resultado por afirmación. `fields` son los
+    campos que devuelve (None = todos) y `tolerances`, el error absoluto
+    admitido en cada campo numérico"""
+
+    def __init__(
+        self,
+        name: str,
+        predict: Callable,
+        fields: Optional[frozenset] = None,
+        tolerances: Optional[Dict[str, float]] = None,
+    ):
+        self.name = name
+        self.predict = predict
+        self.fields = fields
+        self.tolerances = {field: DEFAULT_TOLERANCE for field in NUMERIC_FIELDS}
+        self.tolerances.update(tolerances or {})
+
+    def compared_fields(self) -> List[str]:
+        return [field for field in COMPARED_FIELDS if self.fields is None or field in self.fields]
+
+
+ENGINES: Dict[str, Engine] = {}
+
+
+def register_engine(
+    name: str,
+    fields: Optional[frozenset] = None,
+    tolerances: Optional[Dict[str, float]] = None,
+):
+    """Decorador que registra un motor con su nombre, sus campos y sus tolerancias"""
+
+    def decorator(predict: Callable) -> Callable:
+        if name in ENGINES:
+            raise ValueError(f"Ya hay un motor registrado como {name}")
+        ENGINES[name] = Engine(name, predict, fields, tolerances)
+        return predict
+
+    return decorator
+
+
+# ============================================================================
+# MOTORES
+# ============================================================================
+
+
+def reference_engine(detector, statements: List[str]) -> List[Dict]:
+    """Referencia: una llamada a `predict` por afirmación"""
+    return [detector.predict(statement) for statement in statements]
+
+
+@register_engine("batch")
+def batch_engine(detector, statements: List[str]) -> List[Dict]:
+    """`predict_batch` en bloques, como /predict/batch"""
+    results = []
+    for start in range(0, len(statements), BATCH_SIZE):
+        results.extend(detector.predict_batch(statements[start : start + BATCH_SIZE]))
+    return results
+
+
+@register_engine("fields", fields=frozenset(COMPARED_FIELDS))
+def fields_engine(detector, statements: List[str]) -> List[Dict]:
+    """`predict_batch` calculando solo los campos que se comparan"""
+    fields = frozenset(COMPARED_FIELDS)
+    results = []
+    for start in range(0, len(statements), BATCH_SIZE):
+        results.extend(detector.predict_batch(statements[start : start + BATCH_SIZE], fields=fields))
+    return results
+
+
+@register_engine("lean", fields=frozenset(["prediction", "confidence"]))
+def lean_engine(detector, statements: List[str]) -> List[Dict]:
+    """Respuestas reducidas (verbose=false) de la API"""
+    from truth_detector_server import LEAN_FIELDS
+
+    fields = frozenset(LEAN_FIELDS)
+    results = []
+    for start in range(0, len(statements), BATCH_SIZE):
+        results.extend(detector.predict_batch(statements[start : start + BATCH_SIZE], fields=fields))
+    return results
+
+
+@register_engine("sharded")
+def sharded_engine(detector, statements: List[str]) -> List[Dict]:
+    """Recorrido del índice por fragmentos de categoría (peticiones con
+    deadline_ms) con un plazo que nunca vence: debe puntuar todo el índice"""
+    results = []
+    for start in range(0, len(statements), BATCH_SIZE):
+        results.extend(detector.predict_batch(statements[start : start + BATCH_SIZE], deadline=math.inf))
+    return results
+
+
+@register_engine("canonical_dedup")
+def canonical_dedup_engine(detector, statements: List[str]) -> List[Dict]:
+    """Deduplicación del servidor: cada clave canónica se puntúa una vez y
+    su resultado se reutiliza para todas las afirmaciones con esa clave"""
+    unique: Dict[str, str] = {}
+    for statement in statements:
+        unique.setdefault(detector.canonical_key(statement), statement)
+    keys = list(unique)
+    by_key = dict(zip(keys, batch_engine(detector, [unique[key] for key in keys])))
+    return [by_key[detector.canonical_key(statement)] for statement in statements]
+
+
+@register_engine("reloaded")
+def reloaded_engine(detector, statements: List[str]) -> List[Dict]:
+    """Modelo guardado con `save_model` y cargado en un detector nuevo"""
+    from truth_detector_server import TruthDetector
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "model.pkl")
+        detector.save_model(path)
+        loaded = TruthDetector()
+        if not loaded.load_model(path):
+            raise RuntimeError("No se pudo recargar el modelo")
+    return batch_engine(loaded, statements)
+
+
+# ============================================================================
+# AFIRMACIONES DE PRUEBA
+# ============================================================================
+
+
+def randomized_statements(base: List[str], vocabulary: List[str], count: int, rng: random.Random) -> List[str]:
+    """Variaciones aleatorias de afirmaciones del dataset: números cambiados,
+    palabras quitadas, desordenadas o añadidas y frases de palabras sueltas"""
+
+    def change_numbers(statement: str) -> str:
+        return re.sub(r"\d+", lambda _match: str(rng.randint(0, 10000)), statement)
+
+    def drop_word(statement: str) -> str:
+        words = statement.split()
+        if len(words) > 1:
+            del words[rng.randrange(len(words))]
+        return " ".join(words)
+
+    def shuffle_words(statement: str) -> str:
+        words = statement.split()
+        rng.shuffle(words)
+        return " ".join(words)
+
+    def add_words(statement: str) -> str:
+        return f"{statement} {' '.join(rng.choices(vocabulary, k=rng.randint(1, 4)))}"
+
+    def word_soup(_statement: str) -> str:
+        return " ".join(rng.choices(vocabulary, k=rng.randint(1, 12)))
+
+    mutations = (change_numbers, drop_word, shuffle_words, add_words, word_soup)
+    return [rng.choice(mutations)(rng.choice(base)) for _ in range(count)]
+
+
+def adversarial_statements(base: List[str], rng: random.Random) -> List[str]:
+    """Casos límite: vacías, solo stop words o signos, fuera del vocabulario,
+    muy largas, Unicode, empates exactos y variantes de mayúsculas y espacios
+    de una misma afirmación (misma clave canónica)"""
+    sample = rng.sample(base, min(20, len(base)))
+    statements = [
+        "",
+        " ",
+        "\n\t",
+        "el la de que y",
+        "?!¿¡...,;:",
+        "0",
+        "= = = =",
+        "xyzzy plugh qwertyuiop",
+        "🤖🌍🔥 ✅",
+        "Ünïcödé ñandú ÇÀÉÎÕÜ",
+        "\x00 nulo",
+        "<script>alert(1)</script>",
+        '{"statement": "inyección"}',
+        "2 + 2 = 4" * 200,
+        " ".join(base[:50]),
+        "agua " * 1000,
+    ]
+    for statement in sample:
+        statements.extend(
+            [
+                statement.upper(),
+                f"  {statement.lower()}\n",
+                statement.replace(" ", "  "),
+                statement + statement,
+                "".join(character for character in statement if not character.isdigit()),
+            ]
+        )
+    return statements
+
+
+# ============================================================================
+# COMPARACIÓN
+# ============================================================================
+
+
+def near_tie(result: Dict, max_weight: float, tolerance: float) -> bool:
+    """La referencia está en un empate: las puntuaciones combinadas de ambas
+    clases difieren menos que la tolerancia y cualquier predicción es válida"""
+    try:
+        mean_weight = 1.0 - max_weight
+        true_score = result["max_true_similarity"] * max_weight + result["avg_true_similarity"] * mean_weight
+        false_score = result["max_false_similarity"] * max_weight + result["avg_false_similarity"] * mean_weight
+    except KeyError:
+        return False
+    return abs(true_score - false_score) <= tolerance
+
+
+def compare_results(
+    engine: Engine,
+    statements: List[str],
+    reference: List[Dict],
+    candidate: List[Dict],
+    max_weight: float,
+) -> Dict:
+    """Diferencias de un motor con la referencia, por campo"""
+    if len(candidate) != len(reference):
+        return {
+            "error": f"{len(candidate)} resultados para {len(reference)} afirmaciones",
+            "mismatches": {},
+            "max_abs_diff": {},
+            "examples": [],
+        }
+
+    fields = engine.compared_fields()
+    mismatches: Dict[str, int] = defaultdict(int)
+    max_abs_diff: Dict[str, float] = defaultdict(float)
+    examples = []
+    tie_tolerance = max(engine.tolerances.values())
+
+    for statement, expected, actual in zip(statements, reference, candidate):
+        for field in fields:
+            if field not in actual:
+                mismatches[field] += 1
+                examples.append({"statement": statement, "field": field, "reference": expected.get(field), "engine": None})
+                continue
+            old, new = expected.get(field), actual[field]
+            if field in NUMERIC_FIELDS:
+                difference = abs(old - new)
+                max_abs_diff[field] = max(max_abs_diff[field], difference)
+                if difference <= engine.tolerances[field]:
+                    continue
+            elif old == new:
+                continue
+            elif field == "prediction" and near_tie(expected, max_weight, tie_tolerance):
+                continue
+            elif field == "most_similar_statement" and (
+                abs(expected["similarity_score"] - actual.get("similarity_score", math.nan))
+                <= engine.tolerances["similarity_score"]
+            ):
+                # Empate en la similaridad máxima: cualquier fila empatada es válida
+                continue
+            mismatches[field] += 1
+            examples.append({"statement": statement, "field": field, "reference": old, "engine": new})
+
+    return {
+        "error": None,
+        "mismatches": dict(mismatches),
+        "max_abs_diff": dict(max_abs_diff),
+        "examples": examples,
+    }
+
+
+def load_detector(model_path: str, dataset_path: str):
+    import logging
+
+    from truth_detector_server import TruthDetector
+
+    logging.getLogger("truth_detector_server").setLevel(logging.WARNING)
+    detector = TruthDetector()
+    detector.dataset_path = dataset_path
+    if not detector.load_model(model_path):
+        print(f"⚠️ No se pudo cargar {model_path}: se entrena con {dataset_path} sin guardar", file=sys.stderr)
+        detector.train(save=False)
+    return detector
+
+
+def build_statement_sets(detector, dataset_path: str, options: Dict) -> Dict[str, List[str]]:
+    import pandas as pd
+
+    rng = random.Random(options["seed"])
+    dataset = pd.read_csv(dataset_path)["statement"].astype(str).tolist()
+    if options["limit"]:
+        dataset = dataset[: options["limit"]]
+    vocabulary = sorted(
+        {term for term in detector.vectorizer.vocabulary_ if " " not in term}
+    ) or ["agua"]
+    return {
+        "dataset": dataset,
+        "randomized": randomized_statements(dataset, vocabulary, options["random_count"], rng),
+        "adversarial": adversarial_statements(dataset, rng),
+    }
+
+
+def check(detector, statement_sets: Dict[str, List[str]], engines: List[Engine]) -> Dict:
+    report = {"sets": {name: len(statements) for name, statements in statement_sets.items()}, "engines": {}}
+    statements = [statement for group in statement_sets.values() for statement in group]
+    origin = [name for name, group in statement_sets.items() for _ in group]
+
+    started = time.perf_counter()
+    reference = reference_engine(detector, statements)
+    report["reference_s"] = time.perf_counter() - started
+
+    for engine in engines:
+        print(f"⚖️ {engine.name}...", file=sys.stderr)
+        started = time.perf_counter()
+        try:
+            candidate = engine.predict(detector, statements)
+        except Exception as e:
+            report["engines"][engine.name] = {
+                "error": f"{type(e).__name__}: {e}",
+                "mismatches": {},
+                "max_abs_diff": {},
+                "examples": [],
+                "elapsed_s": time.perf_counter() - started,
+            }
+            continue
+        elapsed = time.perf_counter() - started
+        result = compare_results(engine, statements, reference, candidate, detector.max_weight)
+        sources = {example["statement"]: None for example in result["examples"]}
+        for statement, name in zip(statements, origin):
+            if statement in sources and sources[statement] is None:
+                sources[statement] = name
+        for example in result["examples"]:
+            example["set"] = sources[example["statement"]]
+        result["elapsed_s"] = elapsed
+        result["fields"] = engine.compared_fields()
+        result["tolerances"] = engine.tolerances
+        report["engines"][engine.name] = result
+    return report
+
+
+def print_report(report: Dict, show: int):
+    sets = ", ".join(f"{count:,} {name}" for name, count in report["sets"].items())
+    print(f"📋 Afirmaciones: {sets} (referencia en {report['reference_s']:.2f} s)")
+    print(f"{'motor':>16} {'tiempo s':>9} {'diferencias':>11}  campos")
+    for name, result in report["engines"].items():
+        total = sum(result["mismatches"].values())
+        mark = "❌" if total or result["error"] else "✅"
+        detail = result["error"] or ", ".join(f"{field}={count}" for field, count in result["mismatches"].items())
+        print(f"{name:>16} {result['elapsed_s']:>9.2f} {total:>11,}  {mark} {detail}")
+        worst = {field: diff for field, diff in result["max_abs_diff"].items() if diff}
+        if worst:
+            print(f"{'':>16} error máx.: " + ", ".join(f"{field}={diff:.2e}" for field, diff in worst.items()))
+        for example in result["examples"][:show]:
+            statement = example["statement"]
+            shown = statement if len(statement) <= 60 else statement[:57] + "..."
+            print(
+                f"{'':>16} ↳ [{example['set']}] {example['field']}: «{shown}» "
+                f"{example['reference']!r} → {example['engine']!r}"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Comprueba que los motores de puntuación coinciden con predict")
+    parser.add_argument("--model", default="truth_detector_model.pkl", help="Modelo a comprobar")
+    parser.add_argument("--dataset", default="super_dataset.csv", help="Afirmaciones del dataset (y entrenamiento si no hay modelo)")
+    parser.add_argument("--engines", nargs="+", help="Motores a comprobar (por defecto, todos los registrados)")
+    parser.add_argument("--import", dest="modules", action="append", default=[], metavar="MÓDULO", help="Módulo que registra motores adicionales")
+    parser.add_argument("--limit", type=int, help="Usa solo las primeras N afirmaciones del dataset")
+    parser.add_argument("--random-count", type=int, default=2000, help="Afirmaciones aleatorias")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--show", type=int, default=5, help="Ejemplos de diferencias por motor")
+    parser.add_argument("-o", "--output", help="Guarda el informe completo en JSON")
+    args = parser.parse_args(argv)
+
+    # Ejecutado como script este módulo es __main__: los módulos de --import
+    # que hacen `from check_engines import register_engine` deben registrar
+    # en este mismo ENGINES y no en una segunda copia del módulo
+    sys.modules.setdefault("check_engines", sys.modules[__name__])
+    for module in args.modules:
+        importlib.import_module(module)
+    unknown = set(args.engines or ()) - set(ENGINES)
+    if unknown:
+        raise SystemExit(f"❌ Motores desconocidos: {', '.join(sorted(unknown))}. Disponibles: {', '.join(ENGINES)}")
+    engines = [ENGINES[name] for name in (args.engines or ENGINES)]
+
+    detector = load_detector(args.model, args.dataset)
+    options = {"seed": args.seed, "limit": args.limit, "random_count": args.random_count}
+    statement_sets = build_statement_sets(detector, args.dataset, options)
+    report = check(detector, statement_sets, engines)
+    report["model_version"] = detector.model_version
+    print_report(report, args.show)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+        print(f"💾 Informe guardado en {args.output}", file=sys.stderr)
+
+    failed = [name for name, result in report["engines"].items() if result["error"] or result["mismatches"]]
+    if failed:
+        print(f"\n❌ Motores con diferencias: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    print("\n✅ Todos los motores coinciden con la referencia", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+🎯 Evaluación del detector de verdad con validación cruzada
+Ejecuta validación cruzada estratificada de k particiones sobre
+super_dataset.csv (cada partición en un proceso del pool) e informa de la
+exactitud, precisión y exhaustividad global, por categoría y por fuente,
+tanto para las afirmaciones verdaderas como para las falsas, junto con la
+latencia de predicción y la memoria. El informe JSON incluye la huella del
+dataset y la configuración del modelo para comparar versiones entre sí
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+from sklearn.model_selection import StratifiedKFold
+
+LABELS = ("verdadero", "falso")
+# Métricas que se comparan con la línea base (todas: mayor es mejor)
+COMPARED_METRICS = ("accuracy", "f1", "false_recall", "false_precision")
+DEFAULT_MAX_DROP = 0.01
+
+
+def load_dataset(path: str, dedupe: bool = True) -> pd.DataFrame:
+    """Dataset con índice 0..n-1. Con `dedupe` se quitan las afirmaciones
+    repetidas: si no, la misma frase puede caer en entrenamiento y prueba y
+    la exactitud sale inflada"""
+    df = pd.read_csv(path)
+    df = df[df["truth_value"].isin(LABELS)]
+    if dedupe:
+        df = df.drop_duplicates(subset="statement")
+    return df.reset_index(drop=True)
+
+
+def dataset_digest(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    """Memoria residente máxima del proceso (ru_maxrss: KB en Linux, bytes en macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_fold(fold: int, dataset_path: str, dedupe: bool, train_index, test_index, options: Dict) -> Dict:
+    """Entrena con `train_index` y predice `test_index` en un proceso nuevo.
+    Devuelve las predicciones y los tiempos y la memoria de la partición"""
+    import logging
+
+    from truth_detector_server import TruthDetector
+
+    logging.getLogger("truth_detector_server").setLevel(logging.WARNING)
+    df = load_dataset(dataset_path, dedupe)
+    train = df.iloc[train_index]
+    test = df.iloc[test_index]
+
+    detector = TruthDetector()
+    truth = train[train["truth_value"] == "verdadero"]
+    false = train[train["truth_value"] == "falso"]
+    detector.truth_statements = truth["statement"].tolist()
+    detector.false_statements = false["statement"].tolist()
+    detector.truth_categories = truth["category"].tolist()
+    detector.false_categories = false["category"].tolist()
+    started = time.perf_counter()
+    detector.train(save=False)
+    train_s = time.perf_counter() - started
+
+    statements = test["statement"].tolist()
+    chunk = options["batch_size"]
+    fields = frozenset(["prediction", "confidence"])
+    predictions = []
+    started = time.perf_counter()
+    for start in range(0, len(statements), chunk):
+        predictions.extend(detector.predict_batch(statements[start : start + chunk], fields=fields))
+    batch_s = time.perf_counter() - started
+
+    # Latencia de predict completo (como /predict) sobre una muestra fija
+    latencies = []
+    for statement in statements[: options["latency_samples"]]:
+        started = time.perf_counter()
+        detector.predict(statement)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "fold": fold,
+        "test_index": list(map(int, test_index)),
+        "predicted": [prediction["prediction"] for prediction in predictions],
+        "confidence": [prediction["confidence"] for prediction in predictions],
+        "train_rows": len(train),
+        "test_rows": len(test),
+        "train_s": train_s,
+        "batch_statements_per_s": len(statements) / batch_s if batch_s else 0.0,
+        "latencies_ms": latencies,
+        "index_bytes": detector.get_size()["index_bytes"],
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+class Confusion:
+    """Matriz de confusión con «verdadero» como clase positiva"""
+
+    def __init__(self):
+        self.tp = self.fp = self.tn = self.fn = 0
+
+    def add(self, expected: str, predicted: str):
+        if expected == "verdadero":
+            if predicted == "verdadero":
+                self.tp += 1
+            else:
+                self.fn += 1
+        elif predicted == "falso":
+            self.tn += 1
+        else:
+            self.fp += 1
+
+    def metrics(self) -> Dict:
+        def ratio(numerator: int, denominator: int) -> Optional[float]:
+            return numerator / denominator if denominator else None
+
+        total = self.tp + self.fp + self.tn + self.fn
+        precision = ratio(self.tp, self.tp + self.fp)
+        recall = ratio(self.tp, self.tp + self.fn)
+        f1 = 2 * precision * recall / (precision + recall) if precision and recall else None
+        return {
+            "support": total,
+            "true_support": self.tp + self.fn,
+            "false_support": self.tn + self.fp,
+            "accuracy": ratio(self.tp + self.tn, total),
+            "precision": precision,
+            "recall": recall,
+            "f1": f1,
+            # Las mismas métricas con «falso» como clase positiva
+            "false_precision": ratio(self.tn, self.tn + self.fn),
+            "false_recall": ratio(self.tn, self.tn + self.fp),
+            "confusion": {"tp": self.tp, "fp": self.fp, "tn": self.tn, "fn": self.fn},
+        }
+
+
+def detector_config() -> Dict:
+    """Parámetros del detector que cambian sus resultados"""
+    from truth_detector_server import TruthDetector
+
+    detector = TruthDetector()
+    params = detector.vectorizer.get_params()
+    params.pop("stop_words", None)
+    params.pop("dtype", None)
+    return {
+        "vectorizer": {key: value for key, value in params.items() if isinstance(value, (int, float, str, bool, tuple, type(None)))},
+        "category_weights": detector.category_weights,
+        "max_weight": detector.max_weight,
+        "weight_threshold": detector.weight_threshold,
+    }
+
+
+def environment() -> Dict:
+    import numpy
+    import sklearn
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "sklearn": sklearn.__version__,
+    }
+
+
+def stratified_folds(df: pd.DataFrame, folds: int, seed: int) -> List[Tuple]:
+    """Índices (entrenamiento, prueba) de cada partición, estratificando por
+    etiqueta y categoría: cada partición mantiene la proporción de
+    verdaderas y falsas de cada categoría (las combinaciones con menos filas
+    que particiones solo se estratifican por etiqueta)"""
+    strata = df["truth_value"] + "/" + df["category"]
+    counts = strata.value_counts()
+    strata = strata.where(strata.map(counts) >= folds, df["truth_value"])
+    splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+    return list(splitter.split(df, strata))
+
+
+def evaluate(dataset_path: str, options: Dict) -> Dict:
+    df = load_dataset(dataset_path, options["dedupe"])
+
+    context = get_context("spawn")
+    # Un proceso por partición, para que la memoria máxima sea la suya
+    with ProcessPoolExecutor(
+        max_workers=options["workers"], mp_context=context, max_tasks_per_child=1
+    ) as pool:
+        futures = [
+            pool.submit(run_fold, fold, dataset_path, options["dedupe"], train_index, test_index, options)
+            for fold, (train_index, test_index) in enumerate(
+                stratified_folds(df, options["folds"], options["seed"])
+            )
+        ]
+        folds = [future.result() for future in futures]
+
+    overall = Confusion()
+    by_category: Dict[str, Confusion] = defaultdict(Confusion)
+    by_source: Dict[str, Confusion] = defaultdict(Confusion)
+    fold_rows = []
+    for result in folds:
+        fold_confusion = Confusion()
+        for row, predicted in zip(result["test_index"], result["predicted"]):
+            expected = df.at[row, "truth_value"]
+            for confusion in (
+                overall,
+                fold_confusion,
+                by_category[df.at[row, "category"]],
+                by_source[df.at[row, "source"]],
+            ):
+                confusion.add(expected, predicted)
+        fold_rows.append(
+            {
+                "fold": result["fold"],
+                "train_rows": result["train_rows"],
+                "test_rows": result["test_rows"],
+                "accuracy": fold_confusion.metrics()["accuracy"],
+                "train_s": result["train_s"],
+                "predict_p50_ms": percentile(result["latencies_ms"], 50),
+                "predict_p99_ms": percentile(result["latencies_ms"], 99),
+                "batch_statements_per_s": result["batch_statements_per_s"],
+                "index_bytes": result["index_bytes"],
+                "peak_rss_mb": result["peak_rss_mb"],
+            }
+        )
+
+    latencies = [latency for result in folds for latency in result["latencies_ms"]]
+    accuracies = [row["accuracy"] for row in fold_rows]
+    return {
+        "environment": environment(),
+        "options": options,
+        "dataset": {
+            "path": dataset_path,
+            "sha1": dataset_digest(dataset_path),
+            "rows": len(df),
+            "true": int((df["truth_value"] == "verdadero").sum()),
+            "false": int((df["truth_value"] == "falso").sum()),
+        },
+        "detector_config": detector_config(),
+        "overall": {
+            **overall.metrics(),
+            "accuracy_std": statistics.stdev(accuracies) if len(accuracies) > 1 else 0.0,
+        },
+        "by_category": {name: confusion.metrics() for name, confusion in sorted(by_category.items())},
+        "by_source": {name: confusion.metrics() for name, confusion in sorted(by_source.items())},
+        "performance": {
+            "train_s": statistics.fmean(row["train_s"] for row in fold_rows),
+            "predict_p50_ms": percentile(latencies, 50),
+            "predict_p99_ms": percentile(latencies, 99),
+            "batch_statements_per_s": statistics.fmean(row["batch_statements_per_s"] for row in fold_rows),
+            "index_bytes": max(row["index_bytes"] for row in fold_rows),
+            "peak_rss_mb": max(row["peak_rss_mb"] for row in fold_rows),
+        },
+        "folds": fold_rows,
+    }
+
+
+def compare(current: Dict, baseline: Dict, max_drop: float) -> List[Dict]:
+    """Diferencias absolutas de las métricas global y por categoría; una
+    bajada mayor que `max_drop` es una regresión"""
+    scopes = [("global", current["overall"], baseline.get("overall", {}))]
+    for name, metrics in current["by_category"].items():
+        scopes.append((name, metrics, baseline.get("by_category", {}).get(name, {})))
+    rows = []
+    for scope, metrics, reference in scopes:
+        for metric in COMPARED_METRICS:
+            if metrics.get(metric) is None or reference.get(metric) is None:
+                continue
+            change = metrics[metric] - reference[metric]
+            rows.append(
+                {
+                    "scope": scope,
+                    "metric": metric,
+                    "baseline": reference[metric],
+                    "current": metrics[metric],
+                    "change": change,
+                    "regression": -change > max_drop,
+                }
+            )
+    return rows
+
+
+def print_report(report: Dict):
+    def show(value: Optional[float]) -> str:
+        return f"{value:>8.1%}" if value is not None else f"{'-':>8}"
+
+    dataset = report["dataset"]
+    print(
+        f"📊 {dataset['rows']:,} afirmaciones ({dataset['true']:,} verdaderas, {dataset['false']:,} falsas), "
+        f"{report['options']['folds']} particiones"
+    )
+    print(
+        f"{'':>24} {'n':>6} {'exact.':>8} {'prec. V':>8} {'exh. V':>8} {'prec. F':>8} {'exh. F':>8} {'F1':>8}"
+    )
+
+    def row(name: str, metrics: Dict):
+        print(
+            f"{name:>24} {metrics['support']:>6,} {show(metrics['accuracy'])} {show(metrics['precision'])} "
+            f"{show(metrics['recall'])} {show(metrics['false_precision'])} {show(metrics['false_recall'])} "
+            f"{show(metrics['f1'])}"
+        )
+
+    row("global", report["overall"])
+    print("🏷️ Por categoría:")
+    for name, metrics in report["by_category"].items():
+        row(name, metrics)
+    print("📚 Por fuente:")
+    for name, metrics in report["by_source"].items():
+        row(name, metrics)
+
+    performance = report["performance"]
+    print()
+    print(
+        f"⏱️ Exactitud por partición: {report['overall']['accuracy']:.1%} ± {report['overall']['accuracy_std']:.1%}; "
+        f"entrenamiento medio {performance['train_s']:.2f} s; predict p50 {performance['predict_p50_ms']:.2f} ms, "
+        f"p99 {performance['predict_p99_ms']:.2f} ms; lote {performance['batch_statements_per_s']:,.0f} afirm/s"
+    )
+    print(
+        f"💾 Índice {performance['index_bytes'] / 1024 / 1024:.1f} MB; memoria máxima {performance['peak_rss_mb']:.0f} MB"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validación cruzada del detector de verdad")
+    parser.add_argument("--dataset", default="super_dataset.csv")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=min(5, os.cpu_count() or 1), help="Particiones en paralelo")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=32, help="Afirmaciones por llamada a predict_batch")
+    parser.add_argument("--latency-samples", type=int, default=200, help="Llamadas a predict por partición para la latencia")
+    parser.add_argument("--keep-duplicates", action="store_true", help="No quita las afirmaciones repetidas")
+    parser.add_argument("-o", "--output", default="evaluation_report.json", help="Informe en JSON")
+    parser.add_argument("--baseline", help="Informe anterior con el que comparar")
+    parser.add_argument(
+        "--max-drop", type=float, default=DEFAULT_MAX_DROP,
+        help="Bajada absoluta máxima de exactitud, F1 o métricas de falsas (0.01 = 1 punto)",
+    )
+    args = parser.parse_args(argv)
+    if args.baseline and not os.path.exists(args.baseline):
+        raise SystemExit(f"❌ No existe la línea base: {args.baseline}")
+
+    options = {
+        "folds": args.folds,
+        "workers": args.workers,
+        "seed": args.seed,
+        "batch_size": args.batch_size,
+        "latency_samples": args.latency_samples,
+        "dedupe": not args.keep_duplicates,
+    }
+    print(f"🧪 Validación cruzada de {args.folds} particiones sobre {args.dataset}...", file=sys.stderr)
+    report = evaluate(args.dataset, options)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 Informe guardado en {args.output}", file=sys.stderr)
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("dataset", {}).get("sha1") != report["dataset"]["sha1"]:
+        print("⚠️ La línea base se evaluó con otro dataset", file=sys.stderr)
+    comparison = compare(report, baseline, args.max_drop)
+    print()
+    print(f"{'ámbito':>12} {'métrica':>16} {'base':>8} {'actual':>8} {'cambio':>8}")
+    for row in comparison:
+        mark = "❌" if row["regression"] else "✅"
+        print(
+            f"{row['scope']:>12} {row['metric']:>16} {row['baseline']:>8.1%} {row['current']:>8.1%} "
+            f"{row['change'] * 100:>+7.1f}p {mark}"
+        )
+    regressions = [row for row in comparison if row["regression"]]
+    if regressions:
+        print(f"\n❌ {len(regressions)} métricas bajaron más de {args.max_drop:.1%}", file=sys.stderr)
+        return 1
+    print("\n✅ Sin regresiones respecto a la línea base", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""
+🔥 Pruebas de carga del servidor del detector de verdad
+Genera carga asíncrona contra /predict, /predict/batch y /ws (predict y
+predict_batch) de un servidor local, en bucle cerrado (N clientes que envían
+una petición tras otra) o abierto (llegadas a un ritmo fijo, midiendo la
+latencia desde la llegada programada). Informa del rendimiento, percentiles
+de latencia, tasas de error y de sobrecarga y de las métricas del propio
+servidor, para dimensionar el hardware antes de cada versión
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import websockets
+
+OPERATIONS = ("http_predict", "http_batch", "ws_predict", "ws_batch")
+DEFAULT_MIX = "http_predict=6,http_batch=1,ws_predict=2,ws_batch=1"
+
+
+class HTTPClient:
+    """Cliente HTTP/1.1 mínimo con conexión persistente: peticiones con
+    cuerpo JSON y respuestas con Content-Length o chunked"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: bytes = b"") -> Tuple[int, bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            head = (
+                f"{method} {path} HTTP/1.1\r\n"
+                f"Host: {self.host}:{self.port}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n"
+            )
+            self.writer.write(head.encode("latin-1") + body)
+            await self.writer.drain()
+
+            status_line = await self.reader.readline()
+            if not status_line:
+                raise ConnectionError("El servidor cerró la conexión")
+            status = int(status_line.split()[1])
+            headers = {}
+            while True:
+                line = await self.reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            if headers.get("transfer-encoding") == "chunked":
+                chunks = []
+                while True:
+                    size = int((await self.reader.readline()).split(b";")[0], 16)
+                    if size == 0:
+                        await self.reader.readline()
+                        break
+                    chunks.append(await self.reader.readexactly(size))
+                    await self.reader.readline()
+                payload = b"".join(chunks)
+            else:
+                payload = await self.reader.readexactly(int(headers.get("content-length", 0)))
+
+            if headers.get("connection") == "close":
+                self.close()
+            return status, payload
+        except BaseException:
+            # Estado de la conexión desconocido: se abre otra en la siguiente petición
+            self.close()
+            raise
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class WSClient:
+    """Conexión WebSocket que empareja cada respuesta con su petición por `id`"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.connection = None
+        self.next_id = 0
+
+    async def request(self, message: Dict) -> Dict:
+        if self.connection is None:
+            self.connection = await websockets.connect(self.url, max_size=None)
+            await self.connection.recv()  # bienvenida
+        self.next_id += 1
+        message = {**message, "id": self.next_id, "processing": False}
+        try:
+            await self.connection.send(json.dumps(message))
+            while True:
+                response = json.loads(await self.connection.recv())
+                if response.get("id") == self.next_id:
+                    return response
+        except BaseException:
+            await self.close()
+            raise
+
+    async def close(self):
+        if self.connection is not None:
+            connection, self.connection = self.connection, None
+            await connection.close()
+
+
+class Stats:
+    """Resultados de un tipo de operación"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.ok = 0
+        self.errors = 0
+        self.overloaded = 0
+        self.statements = 0
+        self.error_samples: List[str] = []
+
+    def record(self, outcome: str, latency: float, statements: int, detail: str = ""):
+        self.latencies.append(latency)
+        if outcome == "ok":
+            self.ok += 1
+            self.statements += statements
+        elif outcome == "overloaded":
+            self.overloaded += 1
+        else:
+            self.errors += 1
+            if len(self.error_samples) < 5:
+                self.error_samples.append(detail[:200])
+
+    def summary(self, duration: float) -> Dict:
+        total = self.ok + self.errors + self.overloaded
+        ordered = sorted(self.latencies)
+
+        def percentile(percent: float) -> float:
+            if not ordered:
+                return 0.0
+            index = min(len(ordered) - 1, max(0, math.ceil(percent / 100 * len(ordered)) - 1))
+            return ordered[index] * 1000
+
+        return {
+            "requests": total,
+            "ok": self.ok,
+            "errors": self.errors,
+            "overloaded": self.overloaded,
+            "error_rate": self.errors / total if total else 0.0,
+            "overload_rate": self.overloaded / total if total else 0.0,
+            "requests_per_s": total / duration if duration else 0.0,
+            "statements_per_s": self.statements / duration if duration else 0.0,
+            "p50_ms": percentile(50),
+            "p90_ms": percentile(90),
+            "p99_ms": percentile(99),
+            "max_ms": ordered[-1] * 1000 if ordered else 0.0,
+            "error_samples": self.error_samples,
+        }
+
+
+class LoadGenerator:
+    """Ejecuta la mezcla de operaciones con un pool de `concurrency`
+    conexiones HTTP y otras tantas WebSocket"""
+
+    def __init__(self, base_url: str, statements: List[str], options: Dict):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 80
+        self.ws_url = f"ws://{self.host}:{self.port}/ws"
+        self.statements = statements
+        self.options = options
+        self.rng = random.Random(options["seed"])
+        operations, weights = zip(*options["mix"].items())
+        self.operations = list(operations)
+        self.weights = list(weights)
+        self.stats: Dict[str, Stats] = defaultdict(Stats)
+        self.recording = False
+        self._unique = 0
+        self.http_pool: asyncio.Queue = asyncio.Queue()
+        self.ws_pool: asyncio.Queue = asyncio.Queue()
+        for _ in range(options["concurrency"]):
+            self.http_pool.put_nowait(HTTPClient(self.host, self.port))
+            self.ws_pool.put_nowait(WSClient(self.ws_url))
+
+    def statement(self) -> str:
+        """Afirmación del dataset; una fracción `unique_ratio` se altera para
+        que no coincida con ninguna anterior (sin coalescencia posible)"""
+        statement = self.rng.choice(self.statements)
+        if self.rng.random() < self.options["unique_ratio"]:
+            self._unique += 1
+            statement = f"{statement} #{self._unique}"
+        return statement
+
+    async def execute(self, operation: str, scheduled: float):
+        """Ejecuta una operación y registra su latencia desde `scheduled`"""
+        lean = self.options["lean"]
+        batch_size = self.options["batch_size"]
+        if operation in ("http_predict", "ws_predict"):
+            statements = [self.statement()]
+        else:
+            statements = [self.statement() for _ in range(batch_size)]
+
+        outcome, detail = "ok", ""
+        try:
+            if operation.startswith("http"):
+                client = await self.http_pool.get()
+                try:
+                    if operation == "http_predict":
+                        body = {"statement": statements[0], "verbose": not lean}
+                        path = "/predict"
+                    else:
+                        body = {"statements": statements, "verbose": not lean}
+                        path = "/predict/batch"
+                    status, payload = await client.request("POST", path, json.dumps(body).encode("utf-8"))
+                finally:
+                    self.http_pool.put_nowait(client)
+                if status == 503:
+                    outcome = "overloaded"
+                elif status != 200 or not payload.startswith(b'{"success":true'):
+                    outcome, detail = "error", f"HTTP {status}: {payload[:200]!r}"
+            else:
+                client = await self.ws_pool.get()
+                try:
+                    if operation == "ws_predict":
+                        message = {"type": "predict", "statement": statements[0], "verbose": not lean}
+                    else:
+                        message = {"type": "predict_batch", "statements": statements, "verbose": not lean}
+                    response = await client.request(message)
+                finally:
+                    self.ws_pool.put_nowait(client)
+                if response.get("type") == "error":
+                    outcome = "overloaded" if response.get("code") == "overloaded" else "error"
+                    detail = response.get("message", "")
+        except Exception as e:
+            outcome, detail = "error", f"{type(e).__name__}: {e}"
+
+        if self.recording:
+            self.stats[operation].record(outcome, time.perf_counter() - scheduled, len(statements), detail)
+
+    def pick(self) -> str:
+        return self.rng.choices(self.operations, self.weights)[0]
+
+    async def closed_loop(self, deadline: float):
+        async def worker():
+            while time.perf_counter() < deadline:
+                await self.execute(self.pick(), time.perf_counter())
+
+        await asyncio.gather(*(worker() for _ in range(self.options["concurrency"])))
+
+    async def open_loop(self, deadline: float, rate: float):
+        """Llegadas de Poisson a `rate` por segundo. Si todas las conexiones
+        están ocupadas, la espera cuenta en la latencia de la petición"""
+        tasks = set()
+        scheduled = time.perf_counter()
+        while True:
+            scheduled += self.rng.expovariate(rate)
+            if scheduled >= deadline:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(self.execute(self.pick(), scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+    async def run(self, duration: float, warmup: float, rate: Optional[float]) -> float:
+        async def phase(seconds: float):
+            deadline = time.perf_counter() + seconds
+            if rate:
+                await self.open_loop(deadline, rate)
+            else:
+                await self.closed_loop(deadline)
+
+        if warmup > 0:
+            await phase(warmup)
+        self.recording = True
+        started = time.perf_counter()
+        await phase(duration)
+        elapsed = time.perf_counter() - started
+        self.recording = False
+        await self.close()
+        return elapsed
+
+    async def close(self):
+        while not self.http_pool.empty():
+            self.http_pool.get_nowait().close()
+        while not self.ws_pool.empty():
+            await self.ws_pool.get_nowait().close()
+
+
+def load_statements(path: str) -> List[str]:
+    with open(path, encoding="utf-8", newline="") as f:
+        return [row["statement"] for row in csv.DictReader(f) if row.get("statement")]
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        operation, _, weight = part.partition("=")
+        operation = operation.strip()
+        if operation not in OPERATIONS:
+            raise SystemExit(f"❌ Operación desconocida: {operation}. Usa: {', '.join(OPERATIONS)}")
+        mix[operation] = float(weight or 1)
+    if not any(mix.values()):
+        raise SystemExit("❌ La mezcla no tiene ninguna operación con peso positivo")
+    return {operation: weight for operation, weight in mix.items() if weight > 0}
+
+
+def parse_prometheus(text: str) -> Dict[str, float]:
+    """Muestras del formato de texto de Prometheus (sin cubos de histogramas)"""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#") or "_bucket{" in line:
+            continue
+        name, _, value = line.rpartition(" ")
+        try:
+            samples[name] = float(value)
+        except ValueError:
+            continue
+    return samples
+
+
+async def fetch_server_metrics(base_url: str) -> Dict:
+    """Métricas de ejecución de /statistics y muestras de /metrics"""
+    parts = urlsplit(base_url)
+    client = HTTPClient(parts.hostname or "127.0.0.1", parts.port or 80)
+    try:
+        _status, statistics = await client.request("GET", "/statistics")
+        _status, metrics = await client.request("GET", "/metrics")
+    finally:
+        client.close()
+    return {
+        "runtime_metrics": json.loads(statistics).get("runtime_metrics", {}),
+        "prometheus": parse_prometheus(metrics.decode("utf-8")),
+    }
+
+
+async def wait_until_ready(base_url: str, timeout: float):
+    parts = urlsplit(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        client = HTTPClient(parts.hostname or "127.0.0.1", parts.port or 80)
+        try:
+            status, _body = await client.request("GET", "/health")
+            if status == 200:
+                return
+        except OSError:
+            pass
+        finally:
+            client.close()
+        await asyncio.sleep(0.5)
+    raise SystemExit(f"❌ El servidor no respondió en {timeout:g} s")
+
+
+def start_server(port: int, env_overrides: List[str]) -> subprocess.Popen:
+    """Arranca truth_detector_server en un proceso aparte con la misma
+    configuración de WebSocket que `python truth_detector_server.py`"""
+    env = dict(os.environ)
+    for override in env_overrides:
+        name, _, value = override.partition("=")
+        env[name] = value
+    code = (
+        "import uvicorn, truth_detector_server as server; "
+        f"uvicorn.run(server.app, host='127.0.0.1', port={port}, log_level='warning', "
+        "ws=server.DeflateWebSocketProtocol or 'auto', "
+        "ws_per_message_deflate=server.WS_PERMESSAGE_DEFLATE)"
+    )
+    return subprocess.Popen(
+        [sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)), env=env
+    )
+
+
+def print_report(report: Dict):
+    print(
+        f"{'operación':>13} {'peticiones':>10} {'pet/s':>9} {'afirm/s':>9} {'p50 ms':>8} "
+        f"{'p90 ms':>8} {'p99 ms':>8} {'máx ms':>8} {'error':>7} {'sobrecarga':>10}"
+    )
+    for operation, row in report["operations"].items():
+        print(
+            f"{operation:>13} {row['requests']:>10,} {row['requests_per_s']:>9,.1f} "
+            f"{row['statements_per_s']:>9,.0f} {row['p50_ms']:>8.1f} {row['p90_ms']:>8.1f} "
+            f"{row['p99_ms']:>8.1f} {row['max_ms']:>8.1f} {row['error_rate']:>7.1%} {row['overload_rate']:>10.1%}"
+        )
+        for sample in row["error_samples"]:
+            print(f"{'':>13} ⚠️ {sample}")
+
+    runtime = report.get("server", {}).get("runtime_metrics", {})
+    if runtime:
+        executor = runtime.get("executor", {})
+        watchdog = runtime.get("watchdog", {})
+        singleflight = runtime.get("singleflight", {})
+        print()
+        print("📊 Servidor:")
+        print(f"   Rechazadas por el ejecutor: {executor.get('rejected', 0)}")
+        for name, lane in executor.get("lanes", {}).items():
+            print(
+                f"   Carril {name}: espera media {lane['avg_wait_time_ms']:.1f} ms, "
+                f"ejecución media {lane['avg_run_time_ms']:.1f} ms, máx. latencia {lane['max_latency_ms']:.1f} ms"
+            )
+        print(f"   Coalescencia: {singleflight.get('dedup_ratio', 0.0):.1%} de peticiones deduplicadas")
+        print(f"   Duplicados en lotes: {singleflight.get('batch_dedup_ratio', 0.0):.1%} de afirmaciones")
+        if watchdog:
+            print(
+                f"   Bucle de eventos: retraso máx. {watchdog['max_lag_ms']:.1f} ms, "
+                f"{watchdog['stalls']} bloqueos"
+            )
+
+
+async def main_async(args) -> Dict:
+    server = None
+    if args.start_server:
+        print(f"🚀 Arrancando el servidor en {args.url}...", file=sys.stderr)
+        server = start_server(urlsplit(args.url).port or 80, args.server_env)
+    try:
+        await wait_until_ready(args.url, args.ready_timeout)
+        options = {
+            "concurrency": args.concurrency,
+            "mix": parse_mix(args.mix),
+            "batch_size": args.batch_size,
+            "unique_ratio": args.unique_ratio,
+            "lean": args.lean,
+            "seed": args.seed,
+        }
+        generator = LoadGenerator(args.url, load_statements(args.dataset), options)
+        mode = f"bucle abierto a {args.rate:g} pet/s" if args.rate else f"bucle cerrado con {args.concurrency} clientes"
+        print(f"🔥 {args.duration:g} s en {mode} (calentamiento {args.warmup:g} s)...", file=sys.stderr)
+        elapsed = await generator.run(args.duration, args.warmup, args.rate)
+
+        operations = {operation: generator.stats[operation].summary(elapsed) for operation in options["mix"]}
+        everything = Stats()
+        for stats in generator.stats.values():
+            everything.latencies.extend(stats.latencies)
+            everything.ok += stats.ok
+            everything.errors += stats.errors
+            everything.overloaded += stats.overloaded
+            everything.statements += stats.statements
+        operations["total"] = everything.summary(elapsed)
+
+        return {
+            "options": {**options, "duration": elapsed, "rate": args.rate, "url": args.url},
+            "operations": operations,
+            "server": await fetch_server_metrics(args.url),
+        }
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pruebas de carga del servidor del detector de verdad")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="URL base del servidor")
+    parser.add_argument("--start-server", action="store_true", help="Arranca un servidor local para la prueba")
+    parser.add_argument(
+        "--server-env", action="append", default=[], metavar="NOMBRE=VALOR",
+        help="Variable de entorno del servidor arrancado, p. ej. INFERENCE_WORKERS=8",
+    )
+    parser.add_argument("--ready-timeout", type=float, default=120.0, help="Segundos de espera a que el servidor esté listo")
+    parser.add_argument("--duration", type=float, default=30.0, help="Segundos de medición")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Segundos de calentamiento sin medir")
+    parser.add_argument("--concurrency", type=int, default=16, help="Clientes (bucle cerrado) o conexiones máximas (bucle abierto)")
+    parser.add_argument("--rate", type=float, help="Peticiones por segundo en bucle abierto (sin él, bucle cerrado)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Pesos de cada operación ({', '.join(OPERATIONS)})")
+    parser.add_argument("--batch-size", type=int, default=32, help="Afirmaciones por petición de lote")
+    parser.add_argument("--unique-ratio", type=float, default=0.0, help="Fracción de afirmaciones alteradas para que no se repitan")
+    parser.add_argument("--lean", action="store_true", help="Pide respuestas reducidas (verbose=false)")
+    parser.add_argument("--dataset", default="super_dataset.csv", help="Afirmaciones de las que se extrae la mezcla")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("-o", "--output", help="Guarda el informe completo en JSON")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(main_async(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 Informe guardado en {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+📼 Reproducción de tráfico capturado contra el servidor del detector de verdad
+Lee una captura JSONL escrita con TRAFFIC_CAPTURE_FILE y vuelve a enviar cada
+petición de /predict, /predict/batch y /ws con su ritmo original (o acelerado
+con --speed). Compara las predicciones con las capturadas para detectar
+cambios de comportamiento y compara las latencias grabadas con las de la
+reproducción, para reproducir incidencias de producción en local
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from load_test import HTTPClient, Stats, WSClient, start_server, wait_until_ready
+
+DEFAULT_TOLERANCE = 1e-6
+
+
+def load_capture(path: str) -> List[Dict]:
+    """Registros de la captura ordenados por instante de llegada"""
+    records = []
+    with open(path, "rb") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                print(f"⚠️ Línea {number} no válida en {path}, se ignora", file=sys.stderr)
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+def skip_reason(record: Dict) -> Optional[str]:
+    """Motivo por el que un registro no se puede comparar, o None. Las
+    respuestas con límite de tiempo dependen de la carga del momento y las
+    fallidas no tienen predicciones con las que comparar"""
+    request = record.get("request")
+    response = record.get("response")
+    if not isinstance(request, dict) or not isinstance(response, dict):
+        return "cuerpo no JSON"
+    if request.get("deadline_ms") is not None:
+        return "con deadline_ms"
+    if record.get("status", 200) != 200:
+        return f"HTTP {record['status']}"
+    if response.get("success") is False or response.get("type") == "error":
+        return "respuesta de error"
+    return None
+
+
+def predictions(response: Dict):
+    """Parte de la respuesta que depende del modelo"""
+    if "results" in response:
+        return response["results"]
+    return response.get("result")
+
+
+def diff(expected, actual, tolerance: float, path: str = "") -> List[str]:
+    """Diferencias entre dos respuestas; los números se comparan con
+    `tolerance` de error absoluto"""
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        differences = []
+        for key in sorted(set(expected) | set(actual), key=str):
+            if key not in actual:
+                differences.append(f"{path}.{key}: falta en la reproducción")
+            elif key not in expected:
+                differences.append(f"{path}.{key}: campo nuevo")
+            else:
+                differences.extend(diff(expected[key], actual[key], tolerance, f"{path}.{key}"))
+        return differences
+    if isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            return [f"{path}: {len(expected)} elementos capturados, {len(actual)} reproducidos"]
+        differences = []
+        for index, (old, new) in enumerate(zip(expected, actual)):
+            differences.extend(diff(old, new, tolerance, f"{path}[{index}]"))
+        return differences
+    numbers = (int, float)
+    if (
+        isinstance(expected, numbers)
+        and isinstance(actual, numbers)
+        and not isinstance(expected, bool)
+        and not isinstance(actual, bool)
+    ):
+        if math.isclose(expected, actual, rel_tol=0.0, abs_tol=tolerance):
+            return []
+    elif expected == actual:
+        return []
+    return [f"{path}: {expected!r} → {actual!r}"]
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Replayer:
+    """Reproduce los registros con un pool de `concurrency` conexiones HTTP
+    y otras tantas WebSocket. Con `speed` > 0 cada petición sale en su
+    instante original dividido por `speed`; con 0, lo antes posible"""
+
+    def __init__(self, base_url: str, options: Dict):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 80
+        self.ws_url = f"ws://{self.host}:{self.port}/ws"
+        self.options = options
+        self.stats: Dict[str, Stats] = defaultdict(Stats)
+        self.recorded_ms: Dict[str, List[float]] = defaultdict(list)
+        self.compared = 0
+        self.mismatches: List[Dict] = []
+        self.http_pool: asyncio.Queue = asyncio.Queue()
+        self.ws_pool: asyncio.Queue = asyncio.Queue()
+        for _ in range(options["concurrency"]):
+            self.http_pool.put_nowait(HTTPClient(self.host, self.port))
+            self.ws_pool.put_nowait(WSClient(self.ws_url))
+
+    async def send(self, record: Dict) -> Optional[Dict]:
+        """Envía la petición del registro y devuelve la respuesta decodificada"""
+        if record["channel"] == "http":
+            client = await self.http_pool.get()
+            try:
+                body = json.dumps(record["request"]).encode("utf-8")
+                status, payload = await client.request("POST", record["endpoint"], body)
+            finally:
+                self.http_pool.put_nowait(client)
+            response = json.loads(payload) if payload else {}
+            if status != 200:
+                response = {**response, "success": False, "status": status}
+            return response
+        client = await self.ws_pool.get()
+        try:
+            return await client.request(record["request"])
+        finally:
+            self.ws_pool.put_nowait(client)
+
+    async def replay(self, record: Dict, scheduled: float):
+        operation = f"{record['channel']} {record['endpoint']}"
+        request = record["request"]
+        size = len(request.get("statements", ())) or 1
+        try:
+            response = await self.send(record)
+        except Exception as e:
+            self.stats[operation].record("error", time.perf_counter() - scheduled, size, f"{type(e).__name__}: {e}")
+            return
+        latency = time.perf_counter() - scheduled
+
+        if response.get("success") is False or response.get("type") == "error":
+            overloaded = response.get("status") == 503 or response.get("code") == "overloaded"
+            self.stats[operation].record(
+                "overloaded" if overloaded else "error", latency, size, json.dumps(response)[:200]
+            )
+            return
+        self.stats[operation].record("ok", latency, size)
+        if "duration_ms" in record:
+            self.recorded_ms[operation].append(record["duration_ms"])
+
+        self.compared += 1
+        differences = diff(predictions(record["response"]), predictions(response), self.options["tolerance"])
+        if differences:
+            self.mismatches.append({"t": record["t"], "operation": operation, "request": request, "differences": differences})
+
+    async def run(self, records: List[Dict]) -> float:
+        speed = self.options["speed"]
+        tasks = set()
+        started = time.perf_counter()
+        first = records[0]["t"] if records else 0.0
+        for record in records:
+            scheduled = started + (record["t"] - first) / speed if speed > 0 else time.perf_counter()
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if speed <= 0:
+                # Sin ritmo original: no se adelanta más de `concurrency` peticiones
+                while len(tasks) >= self.options["concurrency"]:
+                    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            task = asyncio.create_task(self.replay(record, scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        await self.close()
+        return elapsed
+
+    async def close(self):
+        while not self.http_pool.empty():
+            self.http_pool.get_nowait().close()
+        while not self.ws_pool.empty():
+            await self.ws_pool.get_nowait().close()
+
+
+async def server_model_version(base_url: str) -> Optional[str]:
+    parts = urlsplit(base_url)
+    client = HTTPClient(parts.hostname or "127.0.0.1", parts.port or 80)
+    try:
+        _status, body = await client.request("GET", "/statistics")
+    finally:
+        client.close()
+    return json.loads(body).get("model_statistics", {}).get("model_version")
+
+
+def print_report(report: Dict):
+    print(
+        f"{'operación':>22} {'peticiones':>10} {'error':>7} {'sobrecarga':>10} "
+        f"{'p50 grab.':>10} {'p50 repr.':>10} {'p99 grab.':>10} {'p99 repr.':>10}"
+    )
+    for operation, row in report["operations"].items():
+        print(
+            f"{operation:>22} {row['requests']:>10,} {row['error_rate']:>7.1%} {row['overload_rate']:>10.1%} "
+            f"{row['recorded_p50_ms']:>10.1f} {row['p50_ms']:>10.1f} "
+            f"{row['recorded_p99_ms']:>10.1f} {row['p99_ms']:>10.1f}"
+        )
+        for sample in row["error_samples"]:
+            print(f"{'':>22} ⚠️ {sample}")
+
+    print()
+    for reason, count in report["skipped"].items():
+        print(f"⏭️ {count} registros omitidos ({reason})")
+    print(f"🔍 {report['compared']} respuestas comparadas, {len(report['mismatches'])} con diferencias")
+    for mismatch in report["mismatches"][: report["options"]["show"]]:
+        request = mismatch["request"]
+        shown = request.get("statement") or f"{len(request.get('statements', []))} afirmaciones"
+        print(f"   ❌ {mismatch['operation']} «{shown}»")
+        for difference in mismatch["differences"][:5]:
+            print(f"      {difference}")
+
+
+async def main_async(args) -> Dict:
+    records = load_capture(args.capture)
+    skipped: Dict[str, int] = defaultdict(int)
+    replayable = []
+    for record in records:
+        reason = skip_reason(record)
+        if reason is None:
+            replayable.append(record)
+        else:
+            skipped[reason] += 1
+    if args.limit:
+        replayable = replayable[: args.limit]
+    if not replayable:
+        raise SystemExit(f"❌ No hay peticiones que reproducir en {args.capture}")
+
+    server = None
+    if args.start_server:
+        print(f"🚀 Arrancando el servidor en {args.url}...", file=sys.stderr)
+        server = start_server(urlsplit(args.url).port or 80, args.server_env)
+    try:
+        await wait_until_ready(args.url, args.ready_timeout)
+        version = await server_model_version(args.url)
+        captured_versions = {record.get("model_version") for record in replayable}
+        if captured_versions != {version}:
+            print(
+                f"⚠️ La captura se hizo con el modelo {', '.join(map(str, sorted(captured_versions, key=str)))} "
+                f"y el servidor tiene {version}: las diferencias pueden deberse al modelo",
+                file=sys.stderr,
+            )
+
+        options = {"concurrency": args.concurrency, "speed": args.speed, "tolerance": args.tolerance}
+        span = replayable[-1]["t"] - replayable[0]["t"]
+        pace = f"a velocidad x{args.speed:g}" if args.speed > 0 else "lo antes posible"
+        print(
+            f"📼 Reproduciendo {len(replayable)} peticiones ({span:.1f} s capturados) {pace}...",
+            file=sys.stderr,
+        )
+        replayer = Replayer(args.url, options)
+        elapsed = await replayer.run(replayable)
+
+        operations = {}
+        for operation, stats in sorted(replayer.stats.items()):
+            row = stats.summary(elapsed)
+            recorded = replayer.recorded_ms[operation]
+            row["recorded_p50_ms"] = percentile(recorded, 50)
+            row["recorded_p99_ms"] = percentile(recorded, 99)
+            operations[operation] = row
+
+        return {
+            "options": {
+                **options,
+                "capture": args.capture,
+                "url": args.url,
+                "duration": elapsed,
+                "show": args.show,
+                "model_version": version,
+            },
+            "operations": operations,
+            "skipped": dict(skipped),
+            "compared": replayer.compared,
+            "mismatches": replayer.mismatches,
+        }
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reproduce una captura de tráfico y compara las predicciones")
+    parser.add_argument("capture", help="Fichero JSONL escrito con TRAFFIC_CAPTURE_FILE")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="URL base del servidor")
+    parser.add_argument("--start-server", action="store_true", help="Arranca un servidor local para la reproducción")
+    parser.add_argument(
+        "--server-env", action="append", default=[], metavar="NOMBRE=VALOR",
+        help="Variable de entorno del servidor arrancado, p. ej. INFERENCE_WORKERS=8",
+    )
+    parser.add_argument("--ready-timeout", type=float, default=120.0, help="Segundos de espera a que el servidor esté listo")
+    parser.add_argument(
+        "--speed", type=float, default=1.0,
+        help="Factor de aceleración sobre el ritmo capturado (2 = el doble de rápido, 0 = sin esperas)",
+    )
+    parser.add_argument("--concurrency", type=int, default=16, help="Conexiones HTTP y WebSocket simultáneas")
+    parser.add_argument(
+        "--tolerance", type=float, default=DEFAULT_TOLERANCE,
+        help="Diferencia absoluta admitida en los valores numéricos (confianza, similitudes)",
+    )
+    parser.add_argument("--limit", type=int, help="Reproduce solo las primeras N peticiones")
+    parser.add_argument("--show", type=int, default=10, help="Diferencias que se muestran en el informe")
+    parser.add_argument("-o", "--output", help="Guarda el informe completo en JSON")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(main_async(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 Informe guardado en {args.output}", file=sys.stderr)
+    return 1 if report["mismatches"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+🎛️ Barrido de hiperparámetros del detector de verdad
+Entrena y evalúa en procesos paralelos todas las combinaciones de
+max_features, ngram_range, min_df, peso del máximo frente al promedio,
+umbral de los pesos por categoría y pesos por categoría, con las mismas
+particiones estratificadas que evaluate_detector.py. Informa del frente de
+Pareto entre exactitud, latencia p99 y memoria del índice, para elegir la
+configuración de cada tipo de despliegue
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+import warnings
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Tuple
+
+from evaluate_detector import Confusion, environment, load_dataset, percentile, stratified_folds
+
+# Pesos por categoría que se pueden barrer (None = los de producción)
+CATEGORY_WEIGHT_PRESETS: Dict[str, Optional[Dict[str, float]]] = {
+    "default": None,
+    "flat": {},
+    "strong": {
+        "matematicas": 1.4,
+        "ciencia": 1.2,
+        "geografia": 1.0,
+        "historia": 1.0,
+        "tecnologia": 1.2,
+        "astronomia": 1.3,
+    },
+}
+
+
+def parse_ngram_range(value: str) -> Tuple[int, int]:
+    low, _, high = value.partition("-")
+    try:
+        return int(low), int(high or low)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Rango de n-gramas no válido: {value} (usa p. ej. 1-3)")
+
+
+def sweep_group(
+    ngram_range: Tuple[int, int],
+    fold: int,
+    dataset_path: str,
+    dedupe: bool,
+    train_index,
+    test_index,
+    vectorizer_grid: List[Tuple[int, int]],
+    scoring_grid: List[Tuple[float, float, str]],
+    options: Dict,
+) -> List[Dict]:
+    """Evalúa en una partición todas las configuraciones con el mismo
+    `ngram_range`. La tokenización de cada afirmación se calcula una sola
+    vez y la comparten todos los vectorizadores del grupo; las variantes de
+    puntuación reutilizan el índice entrenado sin volver a entrenar"""
+    import logging
+
+    from truth_detector_server import TruthDetector
+
+    logging.getLogger("truth_detector_server").setLevel(logging.WARNING)
+    df = load_dataset(dataset_path, dedupe)
+    train = df.iloc[train_index]
+    test = df.iloc[test_index]
+    truth = train[train["truth_value"] == "verdadero"]
+    false = train[train["truth_value"] == "falso"]
+    statements = test["statement"].tolist()
+    expected = test["truth_value"].tolist()
+
+    analyze = TruthDetector(ngram_range=ngram_range).vectorizer.build_analyzer()
+    tokens: Dict[str, List[str]] = {}
+
+    def cached_analyzer(statement: str) -> List[str]:
+        result = tokens.get(statement)
+        if result is None:
+            result = tokens[statement] = analyze(statement)
+        return result
+
+    results = []
+    for max_features, min_df in vectorizer_grid:
+        detector = TruthDetector(max_features=max_features, ngram_range=ngram_range, min_df=min_df)
+        detector.truth_statements = truth["statement"].tolist()
+        detector.false_statements = false["statement"].tolist()
+        detector.truth_categories = truth["category"].tolist()
+        detector.false_categories = false["category"].tolist()
+
+        # Se entrena con el analizador en caché y después se restaura el de
+        # producción, que produce los mismos tokens, para medir la latencia real
+        detector.vectorizer.set_params(analyzer=cached_analyzer)
+        started = time.perf_counter()
+        with warnings.catch_warnings():
+            # Con un analizador propio sklearn avisa de que ignora stop_words
+            warnings.simplefilter("ignore", UserWarning)
+            detector.train(save=False)
+        train_s = time.perf_counter() - started
+        detector.vectorizer.set_params(analyzer="word")
+        index_bytes = detector.get_size()["index_bytes"]
+
+        for max_weight, weight_threshold, weights in scoring_grid:
+            detector.max_weight = max_weight
+            detector.weight_threshold = weight_threshold
+            preset = CATEGORY_WEIGHT_PRESETS[weights]
+            detector.category_weights = (
+                TruthDetector().category_weights if preset is None else dict(preset)
+            )
+            detector._prepare_scoring()
+
+            confusion = Confusion()
+            fields = frozenset(["prediction"])
+            chunk = options["batch_size"]
+            for start in range(0, len(statements), chunk):
+                predictions = detector.predict_batch(statements[start : start + chunk], fields=fields)
+                for label, prediction in zip(expected[start : start + chunk], predictions):
+                    confusion.add(label, prediction["prediction"])
+
+            latencies = []
+            for statement in statements[: options["latency_samples"]]:
+                started = time.perf_counter()
+                detector.predict(statement)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+            results.append(
+                {
+                    "config": {
+                        "max_features": max_features,
+                        "ngram_range": list(ngram_range),
+                        "min_df": min_df,
+                        "max_weight": max_weight,
+                        "weight_threshold": weight_threshold,
+                        "category_weights": weights,
+                    },
+                    "fold": fold,
+                    "confusion": confusion,
+                    "latencies_ms": latencies,
+                    "train_s": train_s,
+                    "index_bytes": index_bytes,
+                }
+            )
+    return results
+
+
+def config_key(config: Dict) -> str:
+    return (
+        f"mf={config['max_features']} ng={config['ngram_range'][0]}-{config['ngram_range'][1]} "
+        f"df={config['min_df']} mw={config['max_weight']:g} th={config['weight_threshold']:g} "
+        f"cw={config['category_weights']}"
+    )
+
+
+def dominates(a: Dict, b: Dict) -> bool:
+    """`a` es al menos tan buena como `b` en exactitud, p99 y memoria y
+    mejor en alguna de ellas"""
+    at_least = (
+        a["accuracy"] >= b["accuracy"]
+        and a["predict_p99_ms"] <= b["predict_p99_ms"]
+        and a["index_bytes"] <= b["index_bytes"]
+    )
+    better = (
+        a["accuracy"] > b["accuracy"]
+        or a["predict_p99_ms"] < b["predict_p99_ms"]
+        or a["index_bytes"] < b["index_bytes"]
+    )
+    return at_least and better
+
+
+def pareto_front(rows: List[Dict]) -> List[Dict]:
+    return [row for row in rows if not any(dominates(other, row) for other in rows if other is not row)]
+
+
+def sweep(dataset_path: str, grid: Dict, options: Dict) -> Dict:
+    df = load_dataset(dataset_path, options["dedupe"])
+    folds = stratified_folds(df, options["folds"], options["seed"])
+    vectorizer_grid = list(itertools.product(grid["max_features"], grid["min_df"]))
+    scoring_grid = list(itertools.product(grid["max_weight"], grid["weight_threshold"], grid["category_weights"]))
+    total = len(grid["ngram_range"]) * len(vectorizer_grid) * len(scoring_grid)
+    print(
+        f"🎛️ {total} configuraciones × {options['folds']} particiones "
+        f"({len(grid['ngram_range']) * options['folds']} tareas en {options['workers']} procesos)...",
+        file=sys.stderr,
+    )
+
+    context = get_context("spawn")
+    by_config: Dict[str, List[Dict]] = defaultdict(list)
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=options["workers"], mp_context=context) as pool:
+        futures = [
+            pool.submit(
+                sweep_group,
+                tuple(ngram_range),
+                fold,
+                dataset_path,
+                options["dedupe"],
+                train_index,
+                test_index,
+                vectorizer_grid,
+                scoring_grid,
+                options,
+            )
+            for ngram_range in grid["ngram_range"]
+            for fold, (train_index, test_index) in enumerate(folds)
+        ]
+        for future in futures:
+            for result in future.result():
+                by_config[config_key(result["config"])].append(result)
+
+    rows = []
+    for results in by_config.values():
+        confusion = Confusion()
+        for result in results:
+            for name in ("tp", "fp", "tn", "fn"):
+                setattr(confusion, name, getattr(confusion, name) + getattr(result["confusion"], name))
+        metrics = confusion.metrics()
+        latencies = [latency for result in results for latency in result["latencies_ms"]]
+        rows.append(
+            {
+                "config": results[0]["config"],
+                "accuracy": metrics["accuracy"],
+                "f1": metrics["f1"],
+                "false_recall": metrics["false_recall"],
+                "predict_p50_ms": percentile(latencies, 50),
+                "predict_p99_ms": percentile(latencies, 99),
+                "index_bytes": max(result["index_bytes"] for result in results),
+                "train_s": sum(result["train_s"] for result in results) / len(results),
+            }
+        )
+
+    front = pareto_front(rows)
+    for row in rows:
+        row["pareto"] = any(row is member for member in front)
+    rows.sort(key=lambda row: -row["accuracy"])
+    return {
+        "environment": environment(),
+        "options": {**options, "dataset": dataset_path, "elapsed_s": time.perf_counter() - started},
+        "grid": grid,
+        "results": rows,
+        "pareto_front": sorted(front, key=lambda row: row["index_bytes"]),
+    }
+
+
+def print_rows(rows: List[Dict]):
+    print(
+        f"{'max_feat':>8} {'ngram':>6} {'min_df':>6} {'máx':>5} {'umbral':>6} {'pesos':>8} "
+        f"{'exact.':>7} {'exh. F':>7} {'p99 ms':>7} {'índice MB':>9}"
+    )
+    for row in rows:
+        config = row["config"]
+        false_recall = f"{row['false_recall']:>7.1%}" if row["false_recall"] is not None else f"{'-':>7}"
+        print(
+            f"{config['max_features']:>8} {config['ngram_range'][0]:>4}-{config['ngram_range'][1]} "
+            f"{config['min_df']:>6} {config['max_weight']:>5g} {config['weight_threshold']:>6g} "
+            f"{config['category_weights']:>8} {row['accuracy']:>7.1%} {false_recall} "
+            f"{row['predict_p99_ms']:>7.2f} {row['index_bytes'] / 1024 / 1024:>9.2f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Barrido de hiperparámetros del detector de verdad")
+    parser.add_argument("--dataset", default="super_dataset.csv")
+    parser.add_argument("--max-features", type=int, nargs="+", default=[2000, 5000, 10000])
+    parser.add_argument("--ngram-range", type=parse_ngram_range, nargs="+", default=[(1, 2), (1, 3)], help="Rangos como 1-3")
+    parser.add_argument("--min-df", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--max-weight", type=float, nargs="+", default=[0.5, 0.7, 0.9], help="Peso del máximo frente al promedio")
+    parser.add_argument("--weight-threshold", type=float, nargs="+", default=[0.2, 0.3, 0.5], help="Similaridad desde la que se aplican los pesos por categoría")
+    parser.add_argument(
+        "--category-weights", nargs="+", default=["default", "flat"], choices=sorted(CATEGORY_WEIGHT_PRESETS),
+        help="Conjuntos de pesos por categoría",
+    )
+    parser.add_argument("--folds", type=int, default=3)
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1,
+        help="Procesos en paralelo (con 1 la latencia se mide sin interferencias)",
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=32, help="Afirmaciones por llamada a predict_batch")
+    parser.add_argument("--latency-samples", type=int, default=100, help="Llamadas a predict por configuración y partición")
+    parser.add_argument("--keep-duplicates", action="store_true", help="No quita las afirmaciones repetidas")
+    parser.add_argument("--top", type=int, default=10, help="Mejores configuraciones por exactitud que se muestran")
+    parser.add_argument("-o", "--output", default="sweep_results.json", help="Resultados en JSON")
+    args = parser.parse_args(argv)
+
+    grid = {
+        "max_features": args.max_features,
+        "ngram_range": [list(ngram_range) for ngram_range in args.ngram_range],
+        "min_df": args.min_df,
+        "max_weight": args.max_weight,
+        "weight_threshold": args.weight_threshold,
+        "category_weights": args.category_weights,
+    }
+    options = {
+        "folds": args.folds,
+        "workers": args.workers,
+        "seed": args.seed,
+        "batch_size": args.batch_size,
+        "latency_samples": args.latency_samples,
+        "dedupe": not args.keep_duplicates,
+    }
+    report = sweep(args.dataset, grid, options)
+
+    print(f"🏆 Las {args.top} configuraciones más exactas:")
+    print_rows(report["results"][: args.top])
+    print()
+    print("📐 Frente de Pareto (exactitud, p99, memoria del índice), de menor a mayor índice:")
+    print_rows(report["pareto_front"])
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 Resultados guardados en {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
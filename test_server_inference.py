@@ -0,0 +1,911 @@
+#!/usr/bin/env python3
+"""
+🧪 Pruebas de la capa de inferencia del servidor
+Verifica la coalescencia de predicciones y el procesamiento por lotes
+"""
+
+import asyncio
+import json
+import os
+import pathlib
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+import truth_detector_server as server
+from truth_detector_server import (
+    BulkJobManager,
+    LANE_BATCH,
+    LANE_INTERACTIVE,
+    InferenceExecutor,
+    InferenceLane,
+    OverloadedError,
+    SingleFlight,
+    StatementStreamParser,
+)
+
+
+def _load_detector():
+    """Carga el modelo entrenado en el detector global del servidor"""
+    if not server.truth_detector.is_trained:
+        assert server.truth_detector.load_model()
+    return server.truth_detector
+
+
+def test_singleflight_coalesces_identical_calls():
+    """Las llamadas concurrentes con la misma clave comparten una ejecución"""
+    flight = SingleFlight()
+    executions = []
+
+    async def slow_prediction():
+        executions.append(1)
+        await asyncio.sleep(0.05)
+        return {"prediction": "verdadero"}
+
+    async def run():
+        return await asyncio.gather(
+            *(flight.run(("v1", "2 + 2 = 4"), slow_prediction) for _ in range(10))
+        )
+
+    results = asyncio.run(run())
+
+    assert len(executions) == 1
+    assert all(result == {"prediction": "verdadero"} for result in results)
+    # Cada solicitante recibe su propia copia
+    assert len({id(result) for result in results}) == 10
+    metrics = flight.get_metrics()
+    assert metrics["requests"] == 10
+    assert metrics["deduplicated"] == 9
+    assert metrics["in_flight"] == 0
+
+
+def test_singleflight_new_call_after_last_waiter_cancelled():
+    """Si se cancela el único solicitante, una llamada idéntica inmediata
+    lanza una ejecución nueva en lugar de recibir CancelledError"""
+    flight = SingleFlight()
+    executions = []
+
+    async def slow_prediction():
+        executions.append(1)
+        await asyncio.sleep(0.05)
+        return {"prediction": "verdadero"}
+
+    async def run():
+        first = asyncio.ensure_future(flight.run(("v1", "2 + 2 = 4"), slow_prediction))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        try:
+            await first
+        except asyncio.CancelledError:
+            pass
+        # Sin ceder el bucle: el callback de la tarea cancelada aún no ha corrido
+        return await flight.run(("v1", "2 + 2 = 4"), slow_prediction)
+
+    assert asyncio.run(run()) == {"prediction": "verdadero"}
+    assert len(executions) == 2
+    assert flight.get_metrics()["in_flight"] == 0
+
+
+def test_batch_duplicates_are_computed_once():
+    """Los duplicados dentro de un lote se calculan una sola vez y el lote se
+    deduplica en una sola pasada"""
+    detector = _load_detector()
+    statements = ["2 + 2 = 4", "  2 + 2 = 4 ", "La Tierra es plana", "2 + 2 = 4"]
+    before = server.inflight_predictions.get_metrics()
+    canonical_keys = []
+    canonical_key = detector.canonical_key
+    detector.canonical_key = lambda statement: canonical_keys.append(statement) or canonical_key(statement)
+    try:
+        results = asyncio.run(server.predict_many_async(statements))
+    finally:
+        del detector.canonical_key
+
+    after = server.inflight_predictions.get_metrics()
+    assert canonical_keys == statements
+    assert after["batch_statements"] - before["batch_statements"] == 4
+    assert after["batch_duplicates"] - before["batch_duplicates"] == 2
+    assert after["requests"] == before["requests"]
+    assert after["deduplicated"] == before["deduplicated"]
+    assert results[0] == results[1] == results[3]
+    assert results[0] == detector.predict("2 + 2 = 4")
+    assert results[2] == detector.predict("La Tierra es plana")
+
+
+def test_executor_rejects_when_queue_is_full():
+    """Con la cola llena el ejecutor rechaza de inmediato con Retry-After"""
+    executor = InferenceExecutor(1, [InferenceLane(LANE_INTERACTIVE, 1, 1)])
+
+    async def run():
+        running = asyncio.ensure_future(executor.submit(time.sleep, 0.1))
+        queued = asyncio.ensure_future(executor.submit(time.sleep, 0.1))
+        await asyncio.sleep(0)
+        try:
+            await executor.submit(time.sleep, 0.1)
+        except OverloadedError as error:
+            rejection = error
+        else:
+            rejection = None
+        await asyncio.gather(running, queued)
+        return rejection
+
+    rejection = asyncio.run(run())
+    executor.shutdown()
+
+    assert rejection is not None and rejection.retry_after >= 1
+    metrics = executor.get_metrics()
+    assert metrics["rejected"] == 1
+    assert metrics["lanes"][LANE_INTERACTIVE]["completed"] == 2
+    assert metrics["queue_depth"] == 0
+
+
+def test_executor_keeps_dispatching_after_pool_cancels_work():
+    """Si el pool cancela un trabajo pendiente (shutdown), su solicitante
+    recibe la cancelación y el carril sigue atendiendo trabajo nuevo"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    executor = InferenceExecutor(2, [InferenceLane(LANE_INTERACTIVE, 2, 10)])
+    # Un pool con un solo hilo deja el segundo trabajo pendiente dentro del pool
+    executor._pool = ThreadPoolExecutor(max_workers=1)
+
+    async def run():
+        running = asyncio.ensure_future(executor.submit(time.sleep, 0.1))
+        pending = asyncio.ensure_future(executor.submit(time.sleep, 0.1))
+        await asyncio.sleep(0.01)
+        executor.shutdown()
+        outcomes = await asyncio.gather(running, pending, return_exceptions=True)
+        after = await asyncio.wait_for(executor.submit(lambda: "ok"), 1)
+        return outcomes, after
+
+    (first, second), after = asyncio.run(run())
+    executor.shutdown()
+
+    assert first is None
+    assert isinstance(second, asyncio.CancelledError)
+    assert after == "ok"
+    assert executor.get_metrics()["running"] == 0
+
+
+def test_interactive_lane_runs_before_queued_batch_chunks():
+    """Una predicción interactiva se adelanta a los bloques de lote en espera"""
+    executor = InferenceExecutor(
+        1,
+        [InferenceLane(LANE_INTERACTIVE, 1, 10), InferenceLane(LANE_BATCH, 1, 10)],
+    )
+    order = []
+
+    def work(name):
+        time.sleep(0.01)
+        order.append(name)
+
+    async def run():
+        batch = [
+            asyncio.ensure_future(executor.submit(work, f"chunk-{i}", lane=LANE_BATCH))
+            for i in range(3)
+        ]
+        await asyncio.sleep(0)
+        await executor.submit(work, "interactive", lane=LANE_INTERACTIVE)
+        await asyncio.gather(*batch)
+
+    asyncio.run(run())
+    executor.shutdown()
+
+    assert order == ["chunk-0", "interactive", "chunk-1", "chunk-2"]
+
+
+def test_deadline_returns_partial_results_and_timeouts():
+    """Con el plazo vencido se devuelve un resultado parcial y los bloques
+    pendientes de un lote se marcan como vencidos"""
+    detector = _load_detector()
+
+    result = detector.predict("La Tierra orbita alrededor del Sol", time.monotonic())
+    assert result["partial"] == (result["shards_total"] > 1)
+    assert result["shards_scanned"] >= 1
+
+    unbounded = detector.predict("La Tierra orbita alrededor del Sol", time.monotonic() + 60)
+    assert unbounded["partial"] is False
+    for field in ("prediction", "confidence", "most_similar_statement"):
+        assert unbounded[field] == detector.predict("La Tierra orbita alrededor del Sol")[field]
+
+    statements = ["El Sol es una estrella", "Python es un lenguaje"]
+    predictions = asyncio.run(server.predict_many_async(statements, deadline=time.monotonic()))
+    payload = server.batch_results_payload(statements, predictions)
+    assert payload["results"] == []
+    assert [item["index"] for item in payload["timed_out"]] == [0, 1]
+
+
+def test_ndjson_stream_emits_one_line_per_statement():
+    """El streaming emite una línea por afirmación, en orden, y un resumen"""
+    _load_detector()
+    statements = ["El Sol es una estrella", "2 + 2 = 5", "El Sol es una estrella"]
+
+    async def run():
+        chunks = server.iter_prediction_chunks(statements)
+        return [part async for part in server.ndjson_prediction_stream(statements, chunks)]
+
+    lines = [json.loads(line) for part in asyncio.run(run()) for line in part.splitlines()]
+
+    assert [line["type"] for line in lines] == ["result", "result", "result", "summary"]
+    assert [line["index"] for line in lines[:3]] == [0, 1, 2]
+    assert lines[0]["result"] == lines[2]["result"]
+    assert lines[-1]["completed_statements"] == 3
+
+
+def test_stream_debug_timings_emit_one_line_per_chunk():
+    """Con debug_timings el streaming añade tras cada bloque una línea con
+    sus tiempos; sin él no aparecen"""
+    from fastapi.testclient import TestClient
+
+    _load_detector()
+    statements = [f"El número {i} es par" for i in range(server.BATCH_CHUNK_SIZE + 5)]
+    with TestClient(server.app) as client:
+        traced = client.post(
+            "/predict/batch/stream", json={"statements": statements, "debug_timings": True}
+        )
+        plain = client.post("/predict/batch/stream", json={"statements": statements})
+
+    lines = [json.loads(line) for line in traced.text.splitlines()]
+    timings = [line for line in lines if line["type"] == "timings"]
+    assert [(line["index"], line["statements"]) for line in timings] == [
+        (0, server.BATCH_CHUNK_SIZE),
+        (server.BATCH_CHUNK_SIZE, 5),
+    ]
+    for line in timings:
+        for stage in ("queue", "transform", "similarity", "build", "total"):
+            assert isinstance(line["timings_ns"][stage], int)
+    assert lines[-1]["completed_statements"] == len(statements)
+    assert "timings" not in {json.loads(line)["type"] for line in plain.text.splitlines()}
+
+
+def test_stream_parser_handles_split_chunks_and_quoted_newlines():
+    """El parser reconstruye registros partidos entre fragmentos, incluidos
+    campos CSV entre comillas con saltos de línea"""
+    body = (
+        'statement,category,source\n"Hola, ""mundo""\nen dos líneas",ciencia,manual\n'
+        "El Sol es una estrella,astronomia,nasa"
+    ).encode("utf-8")
+    parser = StatementStreamParser("csv")
+    records = []
+    for start in range(0, len(body), 5):
+        records.extend(parser.feed(body[start : start + 5]))
+    records.extend(parser.close())
+
+    assert records == [
+        {"statement": 'Hola, "mundo"\nen dos líneas', "category": "ciencia", "source": "manual"},
+        {"statement": "El Sol es una estrella", "category": "astronomia", "source": "nasa"},
+    ]
+
+    parser = StatementStreamParser("ndjson")
+    records = parser.feed(b'{"statement": "2 + 2 = 4"}\n"La Tierra es pla')
+    records.extend(parser.feed(b'na"\n'))
+    assert [record["statement"] for record in records] == ["2 + 2 = 4", "La Tierra es plana"]
+
+
+def _ingest(client, body: bytes, fmt: str) -> List[Dict]:
+    response = client.post(f"/predict/ingest?format={fmt}", content=body)
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_ingest_stream_scores_ndjson_records():
+    """La ingesta NDJSON devuelve un resultado por línea y un resumen"""
+    from fastapi.testclient import TestClient
+
+    _load_detector()
+    body = b'{"statement": "2 + 2 = 4", "category": "matematicas"}\n"La Tierra es plana"\n'
+    with TestClient(server.app) as client:
+        lines = _ingest(client, body, "ndjson")
+
+    assert [line["type"] for line in lines] == ["result", "result", "summary"]
+    assert lines[0]["category"] == "matematicas" and lines[1]["statement"] == "La Tierra es plana"
+    assert lines[-1]["total_statements"] == 2
+
+
+def test_ingest_stream_scores_csv_records():
+    """La ingesta CSV usa la cabecera y admite campos entre comillas"""
+    from fastapi.testclient import TestClient
+
+    _load_detector()
+    body = 'statement,source\n"Hola, mundo",manual\nEl Sol es una estrella,nasa\n'.encode("utf-8")
+    with TestClient(server.app) as client:
+        lines = _ingest(client, body, "csv")
+
+    assert [line.get("statement") for line in lines[:2]] == ["Hola, mundo", "El Sol es una estrella"]
+    assert lines[0]["source"] == "manual"
+    assert lines[-1]["type"] == "summary" and lines[-1]["total_statements"] == 2
+
+
+def test_ingest_stream_ends_with_error_line_on_malformed_body():
+    """Un cuerpo mal formado (campo CSV mayor que el límite de csv) termina
+    con una línea de error en lugar de cortar la respuesta"""
+    from fastapi.testclient import TestClient
+
+    _load_detector()
+    body = ("statement\nEl agua hierve a 100 grados\n" + "x" * 200000 + "\n").encode("utf-8")
+    with TestClient(server.app) as client:
+        lines = _ingest(client, body, "csv")
+        invalid_json = _ingest(client, b'{"statement": "2 + 2 = 4"}\n{roto\n', "ndjson")
+
+    assert lines[-1]["type"] == "error" and "field" in lines[-1]["message"]
+    assert invalid_json[-1]["type"] == "error"
+    assert all(line["type"] != "summary" for line in lines + invalid_json)
+
+
+def test_bulk_job_resumes_from_last_completed_chunk(tmp_path):
+    """Un trabajo interrumpido continúa desde el último bloque confirmado y
+    descarta los resultados escritos a medias"""
+    detector = _load_detector()
+    statements = ["El Sol es una estrella", "2 + 2 = 5", "Python es un lenguaje", "hola", "adiós"]
+
+    async def interrupted_job():
+        manager = BulkJobManager(str(tmp_path), chunk_size=2, max_concurrent_jobs=1)
+        job = await manager.create(server.json_record_batches(statements))
+        await manager.shutdown()
+        # Simular que el primer bloque se completó antes de la caída
+        records, next_offset = manager._read_chunk(job)
+        predictions = detector.predict_batch([record["statement"] for record in records])
+        manager._commit_chunk(job, records, predictions, next_offset)
+        with open(tmp_path / job["id"] / "results.jsonl", "a", encoding="utf-8") as f:
+            f.write('{"index": 2, "statement": "Python es')
+        return job["id"]
+
+    async def resumed_job(job_id):
+        manager = BulkJobManager(str(tmp_path), chunk_size=2, max_concurrent_jobs=1)
+        await manager.resume()
+        await asyncio.gather(*manager._tasks.values())
+        return manager.jobs[job_id], b"".join(manager.iter_results(manager.jobs[job_id]))
+
+    job_id = asyncio.run(interrupted_job())
+    job, results = asyncio.run(resumed_job(job_id))
+
+    lines = [json.loads(line) for line in results.decode("utf-8").splitlines()]
+    assert job["status"] == "completed"
+    assert [line["index"] for line in lines] == [0, 1, 2, 3, 4]
+    assert [line["statement"] for line in lines] == statements
+    assert lines[2]["result"] == detector.predict("Python es un lenguaje")
+
+
+def test_bulk_job_delete_waits_for_commit_in_progress(tmp_path):
+    """Borrar un trabajo espera a que termine la escritura del bloque en curso,
+    no deja un directorio a medias que `resume` recogería ni estado del trabajo
+    en el gestor"""
+    detector = _load_detector()
+    fsync_started = threading.Event()
+    commit_finished = threading.Event()
+    original_fsync = os.fsync
+
+    def slow_fsync(fd):
+        fsync_started.set()
+        time.sleep(0.3)
+        original_fsync(fd)
+
+    async def delete_during_commit():
+        manager = BulkJobManager(str(tmp_path), chunk_size=2, max_concurrent_jobs=1)
+        job = await manager.create(server.json_record_batches(["El Sol es una estrella", "hola"]))
+        await manager.shutdown()
+        records, next_offset = manager._read_chunk(job)
+        predictions = detector.predict_batch([record["statement"] for record in records])
+
+        def commit():
+            try:
+                manager._commit_chunk(job, records, predictions, next_offset)
+            finally:
+                commit_finished.set()
+
+        server.os.fsync = slow_fsync
+        try:
+            commit_thread = asyncio.ensure_future(asyncio.to_thread(commit))
+            await asyncio.to_thread(fsync_started.wait, 5)
+            await manager.delete(job["id"])
+            finished_before_removal = commit_finished.is_set()
+            await commit_thread
+        finally:
+            server.os.fsync = original_fsync
+        # Una escritura tardía de la tarea cancelada no recrea nada
+        manager._save(job)
+        return manager, job["id"], finished_before_removal
+
+    manager, job_id, finished_before_removal = asyncio.run(delete_during_commit())
+
+    assert finished_before_removal
+    assert not (tmp_path / job_id).exists()
+    assert job_id not in manager.jobs
+    assert job_id not in manager._write_locks
+
+
+def test_scoring_parameters_survive_save_and_load(tmp_path):
+    """max_weight y weight_threshold no predeterminados se guardan con el
+    modelo, cambian su versión y se aplican al recargarlo"""
+    def trained(**params):
+        detector = server.TruthDetector(**params)
+        assert detector.load_dataset()
+        for name in ("truth_statements", "false_statements", "truth_categories", "false_categories"):
+            setattr(detector, name, getattr(detector, name)[::10])
+        detector.train(save=False)
+        return detector
+
+    default = trained()
+    tuned = trained(max_weight=0.9, weight_threshold=0.1)
+    path = str(tmp_path / "ajustado.pkl")
+    tuned.save_model(path)
+    loaded = server.TruthDetector()
+    assert loaded.load_model(path)
+
+    statements = ["El Sol es una estrella", "2 + 2 = 5", "Python es un lenguaje"]
+    assert (loaded.max_weight, loaded.weight_threshold) == (0.9, 0.1)
+    assert loaded.model_version == tuned.model_version != default.model_version
+    assert loaded.predict_batch(statements) == tuned.predict_batch(statements)
+    assert [r["confidence"] for r in tuned.predict_batch(statements)] != [
+        r["confidence"] for r in default.predict_batch(statements)
+    ]
+
+
+def test_lean_fields_skip_unrequested_work():
+    """Con campos seleccionados solo se devuelven esos campos y coinciden con
+    la respuesta completa"""
+    detector = _load_detector()
+    statement = "Python es un lenguaje de programación"
+    full = detector.predict(statement)
+
+    lean = detector.predict(statement, fields=server.resolve_fields(None, verbose=False))
+    assert list(lean) == list(server.LEAN_FIELDS)
+    assert all(lean[field] == full[field] for field in lean)
+
+    selected = detector.predict(statement, fields=frozenset(["detected_category", "confidence"]))
+    assert selected == {"confidence": full["confidence"], "detected_category": full["detected_category"]}
+
+    try:
+        server.resolve_fields(["prediction", "no_existe"])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Se esperaba un error por campo desconocido")
+
+
+def test_ws_codecs_roundtrip_and_reject_invalid_frames():
+    """Los mensajes WebSocket se reconstruyen igual en JSON y msgpack y los
+    frames inválidos se rechazan con InvalidMessageError"""
+    message = {"type": "prediction", "result": {"confidence": 0.75, "statement": "¿Sí?"}}
+    for encoding in server.WS_ENCODINGS:
+        frame = server.encode_ws_message(message, encoding)
+        assert isinstance(frame, bytes) == (encoding == "msgpack")
+        assert server.decode_ws_message(frame) == message
+    assert json.loads(server.dumps_json(message)) == message
+
+    for frame in ("no es json", "[1, 2]", b"\xc1"):
+        try:
+            server.decode_ws_message(frame)
+        except server.InvalidMessageError:
+            pass
+        else:
+            raise AssertionError(f"Se esperaba un error para {frame!r}")
+
+
+def test_ws_pipelined_requests_reply_with_their_ids():
+    """Los mensajes con `id` se procesan en paralelo, cada respuesta lleva su
+    `id` y `processing: false` suprime los mensajes de procesamiento"""
+    from fastapi.testclient import TestClient
+
+    _load_detector()
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws?processing=false&max_in_flight=3") as ws:
+            assert ws.receive_json()["max_in_flight"] == 3
+            for i in range(6):
+                ws.send_json({"type": "predict", "id": i, "statement": f"El Sol es una estrella {i}"})
+            ws.send_json({"type": "predict_batch", "id": "lote", "statements": ["2 + 2 = 4"] * 3})
+            replies = [ws.receive_json() for _ in range(7)]
+
+            ws.send_json({"type": "predict", "statement": "2 + 2 = 4", "processing": True})
+            legacy = [ws.receive_json()["type"] for _ in range(2)]
+
+    assert sorted(map(str, (reply["id"] for reply in replies))) == ["0", "1", "2", "3", "4", "5", "lote"]
+    assert {reply["type"] for reply in replies} == {"prediction", "batch_prediction"}
+    for reply in replies:
+        if reply["type"] == "prediction":
+            assert reply["statement"] == f"El Sol es una estrella {reply['id']}"
+    assert legacy == ["processing", "prediction"]
+
+
+def test_ws_cancel_stops_remaining_batch_chunks():
+    """Cancelar un lote en curso evita encolar el resto de sus bloques y la
+    cancelación queda registrada en las métricas"""
+    from fastapi.testclient import TestClient
+
+    _load_detector()
+    statements = [f"Afirmación número {i} sobre ciencia" for i in range(100 * server.BATCH_CHUNK_SIZE)]
+    lane = server.inference_executor.lanes[LANE_BATCH]
+    cancelled_before = server.manager.cancelled_by_client
+    submitted_before = lane.submitted
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws?processing=false") as ws:
+            ws.receive_json()
+            ws.send_json({"type": "predict_batch", "id": "lote", "statements": statements})
+            ws.send_json({"type": "cancel", "id": "lote"})
+            assert ws.receive_json() == {"type": "cancelled", "id": "lote"}
+            ws.send_json({"type": "ping", "id": 1})
+            assert ws.receive_json()["type"] == "pong"
+
+    assert server.manager.cancelled_by_client == cancelled_before + 1
+    assert lane.submitted - submitted_before < 100
+
+
+def test_ws_cancel_reaches_requests_waiting_for_a_slot():
+    """Con todos los huecos ocupados se siguen leyendo mensajes: cancelar una
+    petición que espera turno la descarta sin llegar a ejecutarla"""
+    from fastapi.testclient import TestClient
+
+    _load_detector()
+    statements = [f"Afirmación número {i} sobre ciencia" for i in range(50 * server.BATCH_CHUNK_SIZE)]
+    cancelled_before = server.manager.cancelled_by_client
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws?processing=false&max_in_flight=1") as ws:
+            ws.receive_json()
+            ws.send_json({"type": "predict_batch", "id": "primero", "statements": statements})
+            ws.send_json({"type": "predict_batch", "id": "segundo", "statements": ["2 + 2 = 4"]})
+            ws.send_json({"type": "cancel", "id": "segundo"})
+            assert ws.receive_json() == {"type": "cancelled", "id": "segundo"}
+            ws.send_json({"type": "cancel", "id": "primero"})
+            assert ws.receive_json() == {"type": "cancelled", "id": "primero"}
+            ws.send_json({"type": "ping", "id": 1})
+            assert ws.receive_json()["type"] == "pong"
+
+    assert server.manager.cancelled_by_client == cancelled_before + 2
+
+
+class _FakeWebSocket:
+    """WebSocket mínimo para probar el ConnectionManager sin servidor"""
+
+    def __init__(self, stalled: bool = False):
+        self.stalled = stalled
+        self.received = []
+        self.closed = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, payload):
+        if self.stalled:
+            await asyncio.Event().wait()
+        self.received.append(payload)
+
+    send_bytes = send_text
+
+    async def close(self, code: int = 1000):
+        self.closed = code
+
+
+def test_broadcast_isolates_slow_consumers():
+    """La difusión no espera a un cliente atascado: según la política se
+    descartan sus mensajes o se cierra su conexión, y el resto lo recibe todo"""
+
+    async def run(policy):
+        manager = server.ConnectionManager(send_queue_size=2, slow_consumer_policy=policy)
+        fast = [_FakeWebSocket() for _ in range(200)]
+        stalled = _FakeWebSocket(stalled=True)
+        for websocket in fast + [stalled]:
+            await manager.connect(websocket)
+        for i in range(5):
+            manager.broadcast({"type": "tick", "n": i})
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        metrics = manager.get_metrics()
+        for websocket in list(manager.active_connections):
+            manager.disconnect(websocket)
+        return fast, stalled, metrics
+
+    fast, stalled, metrics = asyncio.run(run("drop"))
+    assert all(len(websocket.received) == 5 for websocket in fast)
+    assert metrics["active_connections"] == 201
+    assert metrics["messages_dropped"] == 2 and metrics["slow_consumer_disconnects"] == 0
+    # El mensaje se codifica una vez y todas las conexiones comparten el objeto
+    assert len({id(websocket.received[0]) for websocket in fast}) == 1
+
+    fast, stalled, metrics = asyncio.run(run("disconnect"))
+    assert all(len(websocket.received) == 5 for websocket in fast)
+    assert metrics["active_connections"] == 200
+    assert metrics["slow_consumer_disconnects"] == 1 and stalled.closed == 1013
+
+
+def test_publisher_pushes_only_changes_to_subscribers():
+    """El publicador construye cada mensaje una vez por ciclo, lo difunde solo
+    a los suscriptores del tema y solo cuando cambió"""
+    state = {"model_version": "v1"}
+    builds = []
+
+    def model_message():
+        builds.append(1)
+        return {"type": "model_update", **state}
+
+    async def run():
+        manager = server.ConnectionManager()
+        publisher = server.StatisticsPublisher(manager, {"model": model_message}, interval=60)
+        subscribed = [_FakeWebSocket() for _ in range(3)]
+        other = _FakeWebSocket()
+        for websocket in subscribed + [other]:
+            await manager.connect(websocket)
+            if websocket is not other:
+                manager.subscribe(websocket, ["model"])
+
+        counts = [publisher.publish()]
+        counts.append(publisher.publish())
+        state["model_version"] = "v2"
+        counts.append(publisher.publish())
+        await asyncio.sleep(0.01)
+        for websocket in list(manager.active_connections):
+            manager.disconnect(websocket)
+        return counts, subscribed, other, manager
+
+    counts, subscribed, other, manager = asyncio.run(run())
+    assert counts == [1, 0, 1]
+    assert len(builds) == 3
+    assert other.received == []
+    for websocket in subscribed:
+        assert [json.loads(payload)["model_version"] for payload in websocket.received] == ["v1", "v2"]
+    assert len({id(websocket.received[1]) for websocket in subscribed}) == 1
+    assert manager.subscribers == {}
+
+
+def test_publisher_ignores_volatile_fields_when_detecting_changes():
+    """Los campos volátiles no provocan publicaciones, pero se envían con su
+    valor actual cuando cambia el resto del mensaje"""
+    state = {"total": 10, "ticks": 0}
+
+    def statistics_message():
+        state["ticks"] += 1
+        return {"type": "statistics", "total": state["total"], "runtime_metrics": {"ticks": state["ticks"]}}
+
+    async def run():
+        manager = server.ConnectionManager()
+        publisher = server.StatisticsPublisher(
+            manager,
+            {"statistics": statistics_message},
+            interval=60,
+            volatile={"statistics": ("runtime_metrics",)},
+        )
+        websocket = _FakeWebSocket()
+        await manager.connect(websocket)
+        manager.subscribe(websocket, ["statistics"])
+        publisher.snapshot("statistics")
+        counts = [publisher.publish(), publisher.publish()]
+        state["total"] = 11
+        counts.append(publisher.publish())
+        await asyncio.sleep(0.01)
+        manager.disconnect(websocket)
+        return counts, websocket
+
+    counts, websocket = asyncio.run(run())
+    assert counts == [0, 0, 1]
+    message = json.loads(websocket.received[-1])
+    assert (message["total"], message["runtime_metrics"]["ticks"]) == (11, 4)
+
+
+def test_gzip_compresses_large_and_streaming_responses():
+    """Las respuestas grandes se comprimen con gzip y en streaming cada bloque
+    se puede descomprimir en cuanto llega"""
+    import zlib
+
+    from fastapi.testclient import TestClient
+
+    _load_detector()
+    statements = [f"El agua hierve a {i} grados" for i in range(200)]
+    with TestClient(server.app) as client:
+        response = client.post("/predict/batch", json={"statements": statements})
+        assert response.headers["content-encoding"] == "gzip"
+        assert int(response.headers["content-length"]) * 4 < len(response.content)
+        assert response.json()["total_statements"] == 200
+
+        small = client.post("/predict", json={"statement": "2 + 2 = 4", "verbose": False})
+        assert "content-encoding" not in small.headers
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        lines = []
+        with client.stream("POST", "/predict/batch/stream", json={"statements": statements}) as stream:
+            assert stream.headers["content-encoding"] == "gzip"
+            for chunk in stream.iter_raw():
+                text = decompressor.decompress(chunk).decode("utf-8")
+                # Cada bloque recibido termina en una línea completa
+                assert text.endswith("\n")
+                lines.extend(text.splitlines())
+    assert len(lines) == 201
+
+
+def test_metrics_endpoint_exports_stage_histograms():
+    """/metrics expone el recuento por endpoint y el histograma de cada etapa
+    de predict_batch en formato de texto de Prometheus"""
+    from fastapi.testclient import TestClient
+
+    _load_detector()
+    with TestClient(server.app) as client:
+        client.post("/predict/batch", json={"statements": ["2 + 2 = 4", "La Tierra es plana"]})
+        client.get("/no-existe")
+        response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert 'truth_detector_http_requests_total{method="POST",path="/predict/batch",status="200"}' in text
+    assert 'path="unmatched",status="404"' in text
+    for stage in ("transform", "similarity", "reduction", "build"):
+        assert f'truth_detector_predict_stage_seconds_count{{stage="{stage}"}}' in text
+    assert 'truth_detector_predict_stage_seconds_bucket{stage="transform",le="+Inf"}' in text
+    assert "truth_detector_model_statements " in text
+
+
+def test_debug_timings_and_span_export():
+    """debug_timings devuelve el desglose por etapa, también con plazo, y el
+    exportador escribe un span raíz con un hijo por etapa de cada bloque"""
+    from fastapi.testclient import TestClient
+
+    _load_detector()
+    path = pathlib.Path(tempfile.mkdtemp()) / "spans.jsonl"
+    server.span_exporter = server.SpanExporter(str(path))
+    try:
+        with TestClient(server.app) as client:
+            response = client.post(
+                "/predict", json={"statement": "El agua hierve a 100 grados", "debug_timings": True}
+            ).json()
+            plain = client.post("/predict", json={"statement": "La Tierra es plana"}).json()
+            with_deadline = client.post(
+                "/predict",
+                json={"statement": "Python es un lenguaje", "deadline_ms": 5000, "debug_timings": True},
+            ).json()
+    finally:
+        server.span_exporter = None
+
+    timings = response["timings_ns"]
+    for stage in ("queue", "transform", "similarity", "weighting", "build", "total"):
+        assert isinstance(timings[stage], int)
+    assert sum(value for stage, value in timings.items() if stage != "total") <= timings["total"]
+    assert "timings_ns" not in plain
+    for stage in ("transform", "similarity", "weighting", "category", "reduction", "build"):
+        assert isinstance(with_deadline["timings_ns"][stage], int)
+
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    roots = [span for span in spans if span["parent_id"] is None]
+    assert [root["name"] for root in roots] == ["predict", "predict", "predict"]
+    children = [span for span in spans if span["parent_id"] == roots[0]["span_id"]]
+    assert {span["name"] for span in children} >= {"queue", "transform", "similarity"}
+
+
+def test_watchdog_logs_stack_of_blocking_call():
+    """Un bloqueo del bucle por encima del umbral se cuenta una vez y se
+    registra la pila de la llamada que lo bloquea"""
+    watchdog = server.LoopWatchdog(interval=0.02, threshold=0.1)
+
+    def blocking_handler():
+        time.sleep(0.4)
+
+    async def scenario():
+        watchdog.start()
+        await asyncio.sleep(0.1)
+        blocking_handler()
+        await asyncio.sleep(0.1)
+        await watchdog.stop()
+
+    asyncio.run(scenario())
+
+    metrics = watchdog.get_metrics()
+    assert watchdog.stalls == 1
+    assert "blocking_handler" in watchdog.last_stall_stack
+    assert metrics["max_lag_ms"] >= 300
+    assert metrics["last_lag_ms"] < 100
+
+
+def test_admin_endpoints_require_token_and_report_sizes():
+    """Sin ADMIN_TOKEN /admin no existe; con él exige la cabecera y devuelve
+    los tamaños del detector y un perfil de CPU"""
+    from fastapi.testclient import TestClient
+
+    _load_detector()
+    headers = {"X-Admin-Token": "secreto"}
+    with TestClient(server.app) as client:
+        assert client.get("/admin/sizes", headers=headers).status_code == 404
+        server.ADMIN_TOKEN = "secreto"
+        try:
+            assert client.get("/admin/sizes", headers={"X-Admin-Token": "otro"}).status_code == 403
+            sizes = client.get("/admin/sizes", headers=headers).json()
+            profile = client.get("/admin/profile?seconds=0.1&idle=true", headers=headers).json()
+            memory = client.get("/admin/memory", headers=headers)
+        finally:
+            server.ADMIN_TOKEN = None
+
+    structures = sizes["structures"]
+    assert structures["truth_embeddings"] > 0 and structures["vectorizer_vocabulary"] > 0
+    assert sizes["total_bytes"] == sum(structures.values())
+    assert profile["profile"]["samples"] > 0 and profile["profile"]["top_self"]
+    assert memory.status_code == 409
+
+
+def test_traffic_capture_records_http_and_ws_requests():
+    """La captura guarda cada predicción HTTP y WebSocket con su instante de
+    llegada, la petición y la respuesta decodificadas"""
+    from fastapi.testclient import TestClient
+
+    _load_detector()
+    path = pathlib.Path(tempfile.mkdtemp()) / "capture.jsonl"
+    capture = server.TrafficCapture(str(path), flush_interval=60)
+    server.traffic_capture = capture
+    started = time.time()
+    try:
+        with TestClient(server.CaptureMiddleware(server.app, capture)) as client:
+            response = client.post("/predict", json={"statement": "El agua hierve a 100 grados"}).json()
+            client.get("/health")
+            with client.websocket_connect("/ws") as ws:
+                ws.receive_json()
+                ws.send_json({"type": "predict", "statement": "La Tierra es plana", "id": 1})
+                while ws.receive_json().get("type") != "prediction":
+                    pass
+    finally:
+        server.traffic_capture = None
+    capture.flush()
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(record["channel"], record["endpoint"]) for record in records] == [
+        ("http", "/predict"),
+        ("ws", "predict"),
+    ]
+    http, ws_record = records
+    assert http["t"] >= started and http["status"] == 200
+    assert http["request"] == {"statement": "El agua hierve a 100 grados"}
+    assert http["response"]["result"] == response["result"]
+    assert ws_record["request"]["statement"] == "La Tierra es plana"
+    assert ws_record["response"]["result"]["prediction"] in ("verdadero", "falso")
+    assert capture.get_metrics()["written"] == 2
+
+
+def test_traffic_capture_skips_only_unserializable_records():
+    """Un registro que no se puede serializar no hace perder el resto del
+    bloque y la cola pendiente se limita por bytes"""
+    path = pathlib.Path(tempfile.mkdtemp()) / "capture.jsonl"
+    capture = server.TrafficCapture(str(path), max_pending_bytes=1000)
+    capture.record({"t": 1, "request": {1: "clave entera"}, "response": {"ok": True}})
+    capture.record({"t": 2, "request": {"raw": b"\x81\xa1a"}, "response": {}})
+    capture.record({"t": 3, "request": {"statement": "\ud800"}, "response": {}})
+    capture.record({"t": 4, "request": {"statement": {1, 2}}, "response": {}})
+    capture.record({"t": 5, "request": {"statement": "x" * 2000}, "response": {}})
+    capture.flush()
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record["t"] for record in records] == [1, 2, 3]
+    assert records[0]["request"] == {"1": "clave entera"}
+    assert records[1]["request"]["raw"] == "gaFh"
+    metrics = capture.get_metrics()
+    assert (metrics["failed"], metrics["dropped"], metrics["pending_bytes"]) == (1, 1, 0)
+
+
+if __name__ == "__main__":
+    test_singleflight_coalesces_identical_calls()
+    test_singleflight_new_call_after_last_waiter_cancelled()
+    test_batch_duplicates_are_computed_once()
+    test_executor_rejects_when_queue_is_full()
+    test_executor_keeps_dispatching_after_pool_cancels_work()
+    test_interactive_lane_runs_before_queued_batch_chunks()
+    test_deadline_returns_partial_results_and_timeouts()
+    test_ndjson_stream_emits_one_line_per_statement()
+    test_stream_debug_timings_emit_one_line_per_chunk()
+    test_stream_parser_handles_split_chunks_and_quoted_newlines()
+    test_ingest_stream_scores_ndjson_records()
+    test_ingest_stream_scores_csv_records()
+    test_ingest_stream_ends_with_error_line_on_malformed_body()
+    test_lean_fields_skip_unrequested_work()
+    test_ws_codecs_roundtrip_and_reject_invalid_frames()
+    test_ws_pipelined_requests_reply_with_their_ids()
+    test_ws_cancel_stops_remaining_batch_chunks()
+    test_ws_cancel_reaches_requests_waiting_for_a_slot()
+    test_broadcast_isolates_slow_consumers()
+    test_publisher_pushes_only_changes_to_subscribers()
+    test_publisher_ignores_volatile_fields_when_detecting_changes()
+    test_gzip_compresses_large_and_streaming_responses()
+    test_metrics_endpoint_exports_stage_histograms()
+    test_debug_timings_and_span_export()
+    test_watchdog_logs_stack_of_blocking_call()
+    test_admin_endpoints_require_token_and_report_sizes()
+    test_traffic_capture_records_http_and_ws_requests()
+    test_traffic_capture_skips_only_unserializable_records()
+    with tempfile.TemporaryDirectory() as directory:
+        test_bulk_job_resumes_from_last_completed_chunk(pathlib.Path(directory))
+    with tempfile.TemporaryDirectory() as directory:
+        test_bulk_job_delete_waits_for_commit_in_progress(pathlib.Path(directory))
+    with tempfile.TemporaryDirectory() as directory:
+        test_scoring_parameters_survive_save_and_load(pathlib.Path(directory))
+    print("✅ Pruebas de inferencia completadas")
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+🧪 Pruebas de las herramientas sin servidor
+Ejecuciones rápidas de los scripts de puntuación, medición y comprobación
+"""
+
+import json
+import pathlib
+import shutil
+import sys
+import socket
+import tempfile
+
+import benchmark_detector
+import check_engines
+import evaluate_detector
+import load_test
+import replay_traffic
+import sweep_detector
+import truth_detector_cli
+from truth_detector_server import TruthDetector
+
+MODEL_PATH = "truth_detector_model.pkl"
+
+
+def _load_detector() -> TruthDetector:
+    """Carga el modelo entrenado del repositorio"""
+    detector = TruthDetector()
+    assert detector.load_model(MODEL_PATH)
+    return detector
+
+
+def _free_port() -> int:
+    """Puerto local libre para arrancar un servidor de prueba"""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def test_cli_scores_csv_in_input_order():
+    """La CLI reparte los bloques entre procesos y escribe los resultados en
+    el orden de entrada, iguales a los de predict_batch"""
+    directory = pathlib.Path(tempfile.mkdtemp())
+    statements = ["El Sol es una estrella", "2 + 2 = 5", "Python es un lenguaje", "hola", "adiós"]
+    source = directory / "entrada.csv"
+    source.write_text(
+        "statement,category\n" + "".join(f"{statement},general\n" for statement in statements),
+        encoding="utf-8",
+    )
+    target = directory / "salida.jsonl"
+
+    exit_code = truth_detector_cli.main(
+        [str(source), "-o", str(target), "--workers", "2", "--chunk-size", "2", "--progress", "0"]
+    )
+
+    lines = [json.loads(line) for line in target.read_text(encoding="utf-8").splitlines()]
+    assert exit_code == 0
+    assert [line["index"] for line in lines] == [0, 1, 2, 3, 4]
+    assert [line["statement"] for line in lines] == statements
+    assert [line["category"] for line in lines] == ["general"] * 5
+    assert [line["result"] for line in lines] == _load_detector().predict_batch(statements)
+
+
+def test_benchmark_smoke_run_and_baseline_gate():
+    """Una medición pequeña termina con código 0 frente a sí misma y la
+    comparación marca como regresión solo lo que empeora más que su umbral"""
+    directory = pathlib.Path(tempfile.mkdtemp())
+    output = directory / "bench.json"
+    args = [
+        "--sizes", "300", "--repeat", "1", "--predict-samples", "10",
+        "--batch-statements", "64", "--data-dir", str(directory), "-o", str(output),
+    ]
+    assert benchmark_detector.main(args) == 0
+    results = json.loads(output.read_text(encoding="utf-8"))
+    assert set(benchmark_detector.METRICS) <= set(results["results"]["300"])
+    assert benchmark_detector.main(args + ["--baseline", str(output), "--threshold", "100"]) == 0
+
+    baseline = {"results": {"300": {"predict_p99_ms": 10.0, "batch_statements_per_s": 1000.0}}}
+    current = {"results": {"300": {"predict_p99_ms": 10.5, "batch_statements_per_s": 800.0}}}
+    thresholds = benchmark_detector.parse_thresholds(0.10, ["predict_p99_ms=0.01"])
+    regressions = {
+        row["metric"]: row["regression"]
+        for row in benchmark_detector.compare(current, baseline, thresholds)
+    }
+    assert regressions == {"predict_p99_ms": True, "batch_statements_per_s": True}
+    thresholds = benchmark_detector.parse_thresholds(0.25, [])
+    assert not any(
+        row["regression"] for row in benchmark_detector.compare(current, baseline, thresholds)
+    )
+
+
+def test_load_test_smoke_run_against_local_server():
+    """Una prueba de carga corta contra un servidor arrancado por la
+    herramienta ejecuta todas las operaciones de la mezcla sin errores"""
+    output = pathlib.Path(tempfile.mkdtemp()) / "carga.json"
+
+    exit_code = load_test.main(
+        [
+            "--start-server", "--url", f"http://127.0.0.1:{_free_port()}", "--duration", "1",
+            "--warmup", "0.2", "--concurrency", "2", "--batch-size", "4",
+            "--mix", "http_predict=1,http_batch=1,ws_predict=1,ws_batch=1", "-o", str(output),
+        ]
+    )
+
+    report = json.loads(output.read_text(encoding="utf-8"))
+    assert exit_code == 0
+    assert set(report["operations"]) == set(load_test.OPERATIONS) | {"total"}
+    for operation in load_test.OPERATIONS:
+        assert report["operations"][operation]["ok"] > 0
+    assert report["operations"]["total"]["errors"] == 0
+    assert "executor" in report["server"]["runtime_metrics"]
+    assert load_test.parse_mix("http_predict=2,ws_batch=0") == {"http_predict": 2.0}
+
+
+def test_replay_diff_and_skip_reasons():
+    """diff compara los números con tolerancia y señala campos y elementos
+    que cambian; skip_reason descarta lo que no se puede comparar"""
+    expected = {"prediction": "verdadero", "confidence": 0.5, "scores": [1, 2], "low": True}
+    assert replay_traffic.diff(expected, {**expected, "confidence": 0.5 + 1e-9}, 1e-6) == []
+    assert replay_traffic.diff(expected, {**expected, "low": False}, 1e-6) == [".low: True → False"]
+    assert replay_traffic.diff(
+        expected, {"prediction": "falso", "confidence": 0.6, "scores": [1], "new": 0}, 1e-6
+    ) == [
+        ".confidence: 0.5 → 0.6",
+        ".low: falta en la reproducción",
+        ".new: campo nuevo",
+        ".prediction: 'verdadero' → 'falso'",
+        ".scores: 2 elementos capturados, 1 reproducidos",
+    ]
+
+    ok = {"request": {"statement": "hola"}, "response": {"success": True, "result": {}}}
+    assert replay_traffic.skip_reason(ok) is None
+    assert replay_traffic.skip_reason({**ok, "request": "no json"}) == "cuerpo no JSON"
+    assert replay_traffic.skip_reason({**ok, "request": {"deadline_ms": 5}}) == "con deadline_ms"
+    assert replay_traffic.skip_reason({**ok, "status": 503}) == "HTTP 503"
+    assert replay_traffic.skip_reason({**ok, "response": {"type": "error"}}) == "respuesta de error"
+
+
+def test_replay_reports_changed_predictions():
+    """Reproducir una captura contra un servidor local compara solo los
+    registros comparables y termina con código 1 si alguna predicción cambió"""
+    detector = _load_detector()
+    sun = detector.predict("El Sol es una estrella")
+    math_fact = detector.predict("2 + 2 = 5")
+    version = detector.model_version
+    records = [
+        {"t": 1.0, "channel": "http", "endpoint": "/predict", "request": {"statement": "El Sol es una estrella"},
+         "status": 200, "response": {"success": True, "result": sun}, "duration_ms": 3.0, "model_version": version},
+        {"t": 1.1, "channel": "ws", "endpoint": "predict", "request": {"type": "predict", "statement": "2 + 2 = 5"},
+         "response": {"type": "prediction", "result": math_fact}, "duration_ms": 2.0, "model_version": version},
+        {"t": 1.2, "channel": "http", "endpoint": "/predict/batch",
+         "request": {"statements": ["El Sol es una estrella", "2 + 2 = 5"]}, "status": 200,
+         "response": {"success": True, "results": [
+             {"statement": "El Sol es una estrella", "result": {**sun, "confidence": 0.0}},
+             {"statement": "2 + 2 = 5", "result": math_fact},
+         ]},
+         "duration_ms": 4.0, "model_version": version},
+        {"t": 1.3, "channel": "http", "endpoint": "/predict", "request": {"statement": "hola", "deadline_ms": 1},
+         "status": 200, "response": {"success": True, "result": {}}, "model_version": version},
+        {"t": 1.4, "channel": "http", "endpoint": "/predict", "request": {"statement": "hola"},
+         "status": 503, "response": {"success": False}, "model_version": version},
+    ]
+    directory = pathlib.Path(tempfile.mkdtemp())
+    capture = directory / "captura.jsonl"
+    capture.write_text("".join(json.dumps(record) + "\n" for record in reversed(records)), encoding="utf-8")
+    output = directory / "informe.json"
+
+    exit_code = replay_traffic.main(
+        [str(capture), "--start-server", "--url", f"http://127.0.0.1:{_free_port()}",
+         "--speed", "0", "-o", str(output)]
+    )
+
+    report = json.loads(output.read_text(encoding="utf-8"))
+    assert exit_code == 1
+    assert report["compared"] == 3
+    assert report["skipped"] == {"con deadline_ms": 1, "HTTP 503": 1}
+    assert [mismatch["operation"] for mismatch in report["mismatches"]] == ["http /predict/batch"]
+    assert report["mismatches"][0]["differences"] == [f"[0].result.confidence: 0.0 → {sun['confidence']!r}"]
+
+
+def _sample_dataset(directory: pathlib.Path, per_category: int = 30) -> pathlib.Path:
+    """Muestra pequeña de super_dataset.csv con todas las categorías"""
+    import pandas as pd
+
+    df = pd.read_csv("super_dataset.csv")
+    sample = df.sample(frac=1.0, random_state=0).groupby("category").head(per_category)
+    path = directory / "muestra.csv"
+    sample.to_csv(path, index=False)
+    return path
+
+
+def test_evaluate_reports_index_bytes_and_gates_on_baseline():
+    """La validación cruzada prueba cada afirmación una vez, informa del
+    tamaño del índice de embeddings y falla si la exactitud baja respecto a
+    la línea base"""
+    directory = pathlib.Path(tempfile.mkdtemp())
+    dataset = _sample_dataset(directory)
+    output = directory / "evaluacion.json"
+    args = [
+        "--dataset", str(dataset), "--folds", "2", "--workers", "1",
+        "--latency-samples", "5", "-o", str(output),
+    ]
+
+    assert evaluate_detector.main(args) == 0
+    report = json.loads(output.read_text(encoding="utf-8"))
+    df = evaluate_detector.load_dataset(str(dataset))
+    assert sum(row["test_rows"] for row in report["folds"]) == report["dataset"]["rows"] == len(df)
+    assert report["overall"]["support"] == len(df)
+
+    # El tamaño del índice es el de los embeddings, como la métrica del servidor
+    train_index, _test_index = evaluate_detector.stratified_folds(df, 2, 42)[0]
+    train = df.iloc[train_index]
+    detector = TruthDetector()
+    detector.truth_statements = train[train["truth_value"] == "verdadero"]["statement"].tolist()
+    detector.false_statements = train[train["truth_value"] == "falso"]["statement"].tolist()
+    detector.truth_categories = train[train["truth_value"] == "verdadero"]["category"].tolist()
+    detector.false_categories = train[train["truth_value"] == "falso"]["category"].tolist()
+    detector.train(save=False)
+    assert report["folds"][0]["index_bytes"] == detector.get_size()["index_bytes"]
+
+    shutil.copy(output, directory / "base.json")
+    assert evaluate_detector.main(args + ["--baseline", str(directory / "base.json")]) == 0
+    report["overall"]["accuracy"] += 0.5
+    (directory / "base.json").write_text(json.dumps(report), encoding="utf-8")
+    assert evaluate_detector.main(args + ["--baseline", str(directory / "base.json")]) == 1
+
+
+def test_sweep_matches_evaluation_and_builds_pareto_front():
+    """Con la configuración de producción el barrido obtiene la misma
+    exactitud que evaluate_detector.py, y su frente de Pareto solo contiene
+    configuraciones no dominadas"""
+    directory = pathlib.Path(tempfile.mkdtemp())
+    dataset = _sample_dataset(directory)
+    output = directory / "barrido.json"
+
+    exit_code = sweep_detector.main(
+        [
+            "--dataset", str(dataset), "--max-features", "5000", "--ngram-range", "1-3",
+            "--min-df", "1", "2", "--max-weight", "0.7", "0.9", "--weight-threshold", "0.3",
+            "--category-weights", "default", "--folds", "2", "--workers", "1",
+            "--latency-samples", "5", "-o", str(output),
+        ]
+    )
+    report = json.loads(output.read_text(encoding="utf-8"))
+    assert exit_code == 0
+    assert len(report["results"]) == 4
+
+    evaluation = directory / "evaluacion.json"
+    evaluate_detector.main(
+        ["--dataset", str(dataset), "--folds", "2", "--workers", "1", "--latency-samples", "5", "-o", str(evaluation)]
+    )
+    expected = json.loads(evaluation.read_text(encoding="utf-8"))
+    production = next(
+        row for row in report["results"]
+        if (row["config"]["min_df"], row["config"]["max_weight"]) == (2, 0.7)
+    )
+    assert production["accuracy"] == expected["overall"]["accuracy"]
+    assert production["index_bytes"] == expected["performance"]["index_bytes"]
+
+    front = report["pareto_front"]
+    assert front and all(row["pareto"] for row in front)
+    for row in report["results"]:
+        dominated = any(sweep_detector.dominates(other, row) for other in report["results"])
+        assert row["pareto"] == (not dominated)
+
+
+def test_check_engines_smoke_run_and_plugin_mismatch():
+    """Todos los motores registrados coinciden con la referencia en una
+    ejecución corta, y un motor de --import que cambia la predicción hace
+    terminar con código 1"""
+    directory = pathlib.Path(tempfile.mkdtemp())
+    output = directory / "motores.json"
+    assert check_engines.main(["--limit", "50", "--random-count", "20", "-o", str(output)]) == 0
+    report = json.loads(output.read_text(encoding="utf-8"))
+    assert set(report["engines"]) == set(check_engines.ENGINES)
+
+    (directory / "motor_roto.py").write_text(
+        "from check_engines import register_engine\n"
+        "\n"
+        "@register_engine('inverted', fields=frozenset(['prediction']))\n"
+        "def inverted(detector, statements):\n"
+        "    flip = {'verdadero': 'falso', 'falso': 'verdadero'}\n"
+        "    return [{**r, 'prediction': flip[r['prediction']]} for r in detector.predict_batch(statements)]\n",
+        encoding="utf-8",
+    )
+    sys.path.insert(0, str(directory))
+    try:
+        exit_code = check_engines.main(
+            ["--limit", "20", "--random-count", "0", "--import", "motor_roto",
+             "--engines", "inverted", "-o", str(output)]
+        )
+    finally:
+        sys.path.remove(str(directory))
+        sys.modules.pop("motor_roto", None)
+        check_engines.ENGINES.pop("inverted", None)
+    report = json.loads(output.read_text(encoding="utf-8"))
+    assert exit_code == 1
+    assert report["engines"]["inverted"]["mismatches"]["prediction"] > 0
+
+
+if __name__ == "__main__":
+    test_cli_scores_csv_in_input_order()
+    test_benchmark_smoke_run_and_baseline_gate()
+    test_load_test_smoke_run_against_local_server()
+    test_replay_diff_and_skip_reasons()
+    test_replay_reports_changed_predictions()
+    test_evaluate_reports_index_bytes_and_gates_on_baseline()
+    test_sweep_matches_evaluation_and_builds_pareto_front()
+    test_check_engines_smoke_run_and_plugin_mismatch()
+    print("✅ Pruebas de herramientas completadas")
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+🧮 Puntuación Masiva del Detector de Verdad sin Servidor
+Carga el modelo una sola vez y puntúa un CSV/JSONL (o stdin) en paralelo,
+repartiendo bloques entre procesos que comparten el modelo de solo lectura
+"""
+
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List
+
+from truth_detector_server import StatementStreamParser, TruthDetector
+
+READ_BLOCK_SIZE = 1024 * 1024
+CSV_OUTPUT_FIELDS = [
+    "statement",
+    "category",
+    "source",
+    "prediction",
+    "confidence",
+    "confidence_level",
+    "detected_category",
+    "most_similar_statement",
+]
+
+# Modelo del proceso actual. Con `fork` los procesos hijos lo heredan ya
+# cargado y comparten sus páginas de memoria con el proceso principal
+_detector = None
+
+
+def _load_detector(model_path: str) -> TruthDetector:
+    detector = TruthDetector()
+    if not detector.load_model(model_path):
+        raise SystemExit(f"❌ No se pudo cargar el modelo: {model_path}")
+    return detector
+
+
+def _init_worker(model_path: str):
+    """Inicializa un proceso del pool (solo carga el modelo si no lo heredó)"""
+    global _detector
+    if _detector is None:
+        _detector = _load_detector(model_path)
+
+
+def _score_chunk(statements: List[str]) -> List[Dict]:
+    return _detector.predict_batch(statements)
+
+
+def read_chunks(stream, fmt: str, chunk_size: int) -> Iterator[List[Dict]]:
+    """Lee registros del fichero de entrada en bloques de `chunk_size`"""
+    parser = StatementStreamParser(fmt)
+    pending: List[Dict] = []
+    while True:
+        data = stream.read(READ_BLOCK_SIZE)
+        if not data:
+            break
+        pending.extend(parser.feed(data))
+        while len(pending) >= chunk_size:
+            yield pending[:chunk_size]
+            pending = pending[chunk_size:]
+    pending.extend(parser.close())
+    while pending:
+        yield pending[:chunk_size]
+        pending = pending[chunk_size:]
+
+
+def score_in_order(chunks: Iterator[List[Dict]], pool, window: int) -> Iterator[tuple]:
+    """Envía bloques al pool manteniendo como mucho `window` en vuelo y
+    devuelve (registros, resultados) en el orden de entrada"""
+    in_flight = deque()
+    for records in chunks:
+        statements = [record["statement"] for record in records]
+        in_flight.append((records, pool.submit(_score_chunk, statements)))
+        if len(in_flight) >= window:
+            records, future = in_flight.popleft()
+            yield records, future.result()
+    while in_flight:
+        records, future = in_flight.popleft()
+        yield records, future.result()
+
+
+class ResultWriter:
+    """Escribe los resultados como JSONL o CSV"""
+
+    def __init__(self, stream, fmt: str):
+        self.stream = stream
+        self.format = fmt
+        self.index = 0
+        self._csv = None
+        if fmt == "csv":
+            self._csv = csv.DictWriter(stream, fieldnames=CSV_OUTPUT_FIELDS, extrasaction="ignore")
+            self._csv.writeheader()
+
+    def write(self, records: List[Dict], results: List[Dict]):
+        for record, result in zip(records, results):
+            if self._csv is not None:
+                self._csv.writerow({**result, **record})
+            else:
+                line = {"index": self.index, **record, "result": result}
+                self.stream.write(json.dumps(line, ensure_ascii=False) + "\n")
+            self.index += 1
+
+
+def detect_format(path: str, fmt: str) -> str:
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Puntúa un fichero CSV/JSONL con el detector de verdad sin iniciar el servidor"
+    )
+    parser.add_argument("input", help="Fichero CSV o JSONL de entrada ('-' para stdin)")
+    parser.add_argument("-o", "--output", default="-", help="Fichero de salida ('-' para stdout)")
+    parser.add_argument("--input-format", choices=StatementStreamParser.FORMATS, help="Por defecto, según la extensión")
+    parser.add_argument("--output-format", choices=("jsonl", "csv"), default="jsonl")
+    parser.add_argument("--model", default="truth_detector_model.pkl", help="Modelo entrenado")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos de puntuación")
+    parser.add_argument("--chunk-size", type=int, default=512, help="Afirmaciones por bloque")
+    parser.add_argument("--progress", type=float, default=5.0, help="Segundos entre informes de progreso (0 = nunca)")
+    args = parser.parse_args(argv)
+
+    logging.getLogger("truth_detector_server").setLevel(logging.WARNING)
+
+    global _detector
+    print(f"🤖 Cargando modelo {args.model}...", file=sys.stderr)
+    _detector = _load_detector(args.model)
+
+    input_format = detect_format(args.input, args.input_format)
+    source = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    target = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    writer = ResultWriter(target, args.output_format)
+    started = time.perf_counter()
+    last_report = started
+
+    print(f"🚀 Puntuando con {args.workers} procesos (bloques de {args.chunk_size})...", file=sys.stderr)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(args.model,),
+        ) as pool:
+            chunks = read_chunks(source, input_format, args.chunk_size)
+            for records, results in score_in_order(chunks, pool, window=args.workers * 2):
+                writer.write(records, results)
+                now = time.perf_counter()
+                if args.progress and now - last_report >= args.progress:
+                    rate = writer.index / (now - started)
+                    print(f"📈 {writer.index} filas ({rate:,.0f} filas/s)", file=sys.stderr)
+                    last_report = now
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+
+    elapsed = time.perf_counter() - started
+    rate = writer.index / elapsed if elapsed else 0.0
+    print(
+        f"✅ {writer.index} filas puntuadas en {elapsed:.2f} s ({rate:,.0f} filas/s)",
+        file=sys.stderr,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,33 +9,814 @@ from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 import pickle
 import os
+import base64
+import gzip
+import io
+import hashlib
+import hmac
+import shutil
+import tempfile
+import uuid
 import json
 import csv
 import pandas as pd
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Callable, Awaitable, Optional, AsyncIterator
 import logging
 import asyncio
-from contextlib import asynccontextmanager
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import functools
+import math
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from bisect import bisect_left
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar, copy_context
+from fastapi import FastAPI, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+from pydantic import BaseModel, Field, field_validator
 import uvicorn
 
+# Codificadores rápidos opcionales
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Protocolo WebSocket de uvicorn (implementación `websockets`), para poder
+# ajustar el nivel de compresión permessage-deflate
+try:
+    from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+    from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+except ImportError:
+    WebSocketProtocol = None
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Configuración del ejecutor de inferencia
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", min(4, os.cpu_count() or 1)))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", 256))
+INTERACTIVE_CONCURRENCY = int(os.getenv("INTERACTIVE_CONCURRENCY", INFERENCE_WORKERS))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", max(1, INFERENCE_WORKERS // 2)))
+BACKGROUND_CONCURRENCY = int(
+    os.getenv("BACKGROUND_CONCURRENCY", max(1, INFERENCE_WORKERS // 4))
+)
+# Número de afirmaciones que se puntúan juntas en cada ejecución de un lote
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", 32))
+# Tamaño máximo de los lotes con respuesta completa y de los lotes en streaming
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 10000))
+MAX_STREAM_BATCH_SIZE = int(os.getenv("MAX_STREAM_BATCH_SIZE", 1000000))
+
+# Trabajos de predicción masiva
+JOBS_DIR = os.getenv("JOBS_DIR", "jobs")
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", 256))
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", 2))
+
+# Peticiones con `id` en vuelo a la vez por conexión WebSocket
+WS_MAX_IN_FLIGHT = int(os.getenv("WS_MAX_IN_FLIGHT", 8))
+# Mensajes recibidos por conexión que esperan turno (hueco en vuelo o el
+# procesamiento secuencial); por encima se rechazan sin dejar de leer
+WS_MAX_PENDING = int(os.getenv("WS_MAX_PENDING", 64))
+
+# Mensajes pendientes de envío por conexión WebSocket y qué hacer con los
+# mensajes de difusión cuando la cola de un cliente lento está llena
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", 256))
+SLOW_CONSUMER_POLICIES = ("drop", "disconnect")
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "disconnect")
+
+# Compresión gzip de respuestas HTTP (nivel 0 = desactivada) y
+# permessage-deflate en WebSocket
+HTTP_COMPRESSION_LEVEL = int(os.getenv("HTTP_COMPRESSION_LEVEL", 5))
+HTTP_COMPRESSION_MIN_SIZE = int(os.getenv("HTTP_COMPRESSION_MIN_SIZE", 1024))
+WS_PERMESSAGE_DEFLATE = os.getenv("WS_PERMESSAGE_DEFLATE", "true").lower() in ("1", "true", "yes")
+WS_DEFLATE_LEVEL = int(os.getenv("WS_DEFLATE_LEVEL", 5))
+
+# Segundos entre publicaciones a los suscriptores de estadísticas
+STATS_PUSH_INTERVAL = float(os.getenv("STATS_PUSH_INTERVAL", 1.0))
+
+# Peticiones de predicción más lentas que este umbral se registran con sus
+# tiempos por etapa (0 = desactivado) y fichero JSONL opcional de spans
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 1000))
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE")
+
+# Vigilancia del bucle de eventos: cada cuántos segundos se mide el retraso
+# (0 = desactivada) y a partir de qué retraso se registra la pila del bucle
+WATCHDOG_INTERVAL = float(os.getenv("WATCHDOG_INTERVAL", 0.1))
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", 200))
+
+# Captura opcional del tráfico de predicción en JSONL (sin valor = desactivada),
+# cada cuántos segundos se escribe lo capturado y cuántos bytes pueden quedar
+# pendientes de escribir antes de descartar registros
+TRAFFIC_CAPTURE_FILE = os.getenv("TRAFFIC_CAPTURE_FILE")
+CAPTURE_FLUSH_INTERVAL = float(os.getenv("CAPTURE_FLUSH_INTERVAL", 1.0))
+CAPTURE_MAX_PENDING_BYTES = int(os.getenv("CAPTURE_MAX_PENDING_BYTES", 64 * 1024 * 1024))
+
+# Endpoints /admin: sin ADMIN_TOKEN quedan desactivados. Duración máxima y
+# periodo de muestreo del perfil de CPU
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 60))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.005))
+
+# ============================================================================
+# SERIALIZACIÓN
+# ============================================================================
+
+
+def dumps_json(content) -> bytes:
+    """Codifica a JSON en UTF-8 con orjson si está disponible"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """Respuesta JSON codificada con `dumps_json`. Los endpoints que la
+    devuelven directamente evitan además el paso por `jsonable_encoder`"""
+
+    def render(self, content) -> bytes:
+        return dumps_json(content)
+
+
+class _FlushingGzipFile(gzip.GzipFile):
+    """Vacía el compresor tras cada escritura para que cada bloque de una
+    respuesta en streaming llegue al cliente sin esperar a los siguientes"""
+
+    def write(self, data) -> int:
+        written = super().write(data)
+        self.flush()
+        return written
+
+
+class _StreamingGZipResponder(GZipResponder):
+    def __init__(self, app, minimum_size: int, compresslevel: int = 9):
+        super().__init__(app, minimum_size, compresslevel=compresslevel)
+        # El GzipFile del padre ya escribió su cabecera: se usa un búfer nuevo
+        self.gzip_buffer = io.BytesIO()
+        self.gzip_file = _FlushingGzipFile(
+            mode="wb", fileobj=self.gzip_buffer, compresslevel=compresslevel
+        )
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Compresión gzip negociada con `Accept-Encoding` para respuestas de al
+    menos `minimum_size` bytes. A diferencia de GZipMiddleware, las respuestas
+    en streaming (NDJSON) se comprimen bloque a bloque sin retener líneas"""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            headers = Headers(scope=scope)
+            if "gzip" in headers.get("Accept-Encoding", ""):
+                responder = _StreamingGZipResponder(
+                    self.app, self.minimum_size, compresslevel=self.compresslevel
+                )
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+if WebSocketProtocol is not None:
+
+    class DeflateWebSocketProtocol(WebSocketProtocol):
+        """Protocolo WebSocket de uvicorn con permessage-deflate al nivel
+        WS_DEFLATE_LEVEL (uvicorn solo permite activarlo o desactivarlo)"""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            if self.config.ws_per_message_deflate:
+                self.available_extensions = [
+                    ServerPerMessageDeflateFactory(
+                        compress_settings={"level": WS_DEFLATE_LEVEL}
+                    )
+                ]
+
+else:
+    DeflateWebSocketProtocol = None
+
+
+# Codificaciones de mensajes WebSocket: JSON en frames de texto o msgpack
+# en frames binarios (solo si el paquete msgpack está instalado)
+WS_ENCODINGS = ("json", "msgpack") if msgpack is not None else ("json",)
+
+
+class InvalidMessageError(ValueError):
+    """Mensaje WebSocket que no se puede decodificar"""
+
+
+def encode_ws_message(message: Dict, encoding: str):
+    """Codifica un mensaje WebSocket: str para JSON, bytes para msgpack"""
+    if encoding == "msgpack":
+        return msgpack.packb(message, use_bin_type=True)
+    return dumps_json(message).decode("utf-8")
+
+
+def decode_ws_message(frame) -> Dict:
+    """Decodifica un frame WebSocket de texto (JSON) o binario (msgpack)"""
+    try:
+        if isinstance(frame, bytes):
+            if msgpack is None:
+                raise InvalidMessageError("Mensajes binarios no soportados")
+            message = msgpack.unpackb(frame, raw=False)
+        else:
+            message = orjson.loads(frame) if orjson is not None else json.loads(frame)
+    except InvalidMessageError:
+        raise
+    except Exception as e:
+        raise InvalidMessageError(str(e)) from e
+    if not isinstance(message, dict):
+        raise InvalidMessageError("El mensaje debe ser un objeto")
+    return message
+
+
+# ============================================================================
+# MÉTRICAS (FORMATO DE TEXTO DE PROMETHEUS)
+# ============================================================================
+
+# Límites superiores de los histogramas, en segundos
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGE_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1)
+# Observaciones encoladas antes de volcarlas en los cubos sin esperar a /metrics
+METRICS_PENDING_LIMIT = 10000
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, le: Optional[str] = None) -> str:
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class CounterMetric:
+    """Contador monótono con etiquetas"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: Dict[Tuple, float] = {}
+        self._pending: deque = deque()
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        # deque.append es atómico: el camino caliente no toma el cerrojo
+        self._pending.append((labels, amount))
+        if len(self._pending) > METRICS_PENDING_LIMIT:
+            self._fold()
+
+    def _fold(self):
+        """Vuelca las observaciones pendientes en los acumulados"""
+        pending = self._pending
+        with self._lock:
+            values = self._values
+            while pending:
+                try:
+                    labels, amount = pending.popleft()
+                except IndexError:
+                    break
+                values[labels] = values.get(labels, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        self._fold()
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in sorted(values)
+        ]
+
+
+class HistogramMetric:
+    """Histograma con etiquetas. `observe` solo encola el valor; el reparto
+    en cubos y los acumulados se calculan al exportar (o cuando la cola
+    supera METRICS_PENDING_LIMIT), fuera del camino de cada petición"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # etiquetas -> [recuentos por cubo (+Inf al final), suma]
+        self._series: Dict[Tuple, list] = {}
+        self._pending: deque = deque()
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        self._pending.append((labels, value))
+        if len(self._pending) > METRICS_PENDING_LIMIT:
+            self._fold()
+
+    def observe_many(self, values: Dict):
+        """Registra varias observaciones, una por valor de la única etiqueta
+        del histograma"""
+        self._pending.extend([((label,), value) for label, value in values.items()])
+        if len(self._pending) > METRICS_PENDING_LIMIT:
+            self._fold()
+
+    def _fold(self):
+        """Reparte las observaciones pendientes en sus cubos"""
+        pending = self._pending
+        buckets = self.buckets
+        with self._lock:
+            series_by_labels = self._series
+            while pending:
+                try:
+                    labels, value = pending.popleft()
+                except IndexError:
+                    break
+                series = series_by_labels.get(labels)
+                if series is None:
+                    series = series_by_labels[labels] = [[0] * (len(buckets) + 1), 0.0]
+                series[0][bisect_left(buckets, value)] += 1
+                series[1] += value
+
+    def samples(self) -> List[str]:
+        self._fold()
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        lines = []
+        for labels, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Registro de métricas exportadas en `/metrics`. Los medidores (gauges)
+    se calculan en el momento de exportar a partir de una función"""
+
+    def __init__(self):
+        self._metrics: List = []
+        self._gauges: List[Tuple[str, str, Tuple[str, ...], Callable]] = []
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> CounterMetric:
+        metric = CounterMetric(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> HistogramMetric:
+        metric = HistogramMetric(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, callback: Callable, labelnames: Tuple[str, ...] = ()):
+        """`callback` devuelve un número o, con etiquetas, un dict
+        {valores de etiquetas: número}"""
+        self._gauges.append((name, help_text, labelnames, callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for name, help_text, labelnames, callback in self._gauges:
+            try:
+                value = callback()
+            except Exception as e:
+                logger.error(f"Error calculando la métrica {name}: {e}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                for labels, sample in sorted(value.items()):
+                    if not isinstance(labels, tuple):
+                        labels = (labels,)
+                    lines.append(f"{name}{_format_labels(labelnames, labels)} {sample}")
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Middleware ASGI que cuenta las peticiones HTTP y mide su latencia por
+    endpoint (plantilla de la ruta, no la URL concreta)"""
+
+    def __init__(self, app, requests_total: CounterMetric, duration: HistogramMetric):
+        self.app = app
+        self.requests_total = requests_total
+        self.duration = duration
+        self._paths: Optional[Dict] = None
+
+    def _route_path(self, scope) -> str:
+        if self._paths is None:
+            self._paths = {
+                route.endpoint: route.path
+                for route in scope["app"].router.routes
+                if hasattr(route, "endpoint")
+            }
+        return self._paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            path = self._route_path(scope)
+            self.duration.observe(time.perf_counter() - started, scope["method"], path)
+            self.requests_total.inc(scope["method"], path, status)
+
+
 # ============================================================================
 # MODELOS DE DATOS
 # ============================================================================
 
+# Campos del resultado de una predicción, en el orden en que se devuelven
+RESULT_FIELDS = (
+    "prediction",
+    "confidence",
+    "confidence_level",
+    "explanation",
+    "most_similar_statement",
+    "similarity_score",
+    "detected_category",
+    "category_weight",
+    "max_true_similarity",
+    "max_false_similarity",
+    "avg_true_similarity",
+    "avg_false_similarity",
+    "total_training_data",
+    "model_status",
+)
+# Campos de la respuesta reducida (verbose=False)
+LEAN_FIELDS = ("prediction", "confidence", "confidence_level")
+
+
+def resolve_fields(fields: Optional[List[str]], verbose: bool = True) -> Optional[frozenset]:
+    """Campos pedidos por el cliente; None significa la respuesta completa"""
+    if fields is None:
+        return None if verbose else frozenset(LEAN_FIELDS)
+    if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+        raise ValueError("fields debe ser una lista de nombres de campo")
+    unknown = sorted(set(fields) - set(RESULT_FIELDS))
+    if unknown:
+        raise ValueError(
+            f"Campos desconocidos: {', '.join(unknown)}. Disponibles: {', '.join(RESULT_FIELDS)}"
+        )
+    return frozenset(fields)
+
+
+class ResponseOptions(BaseModel):
+    # Campos del resultado a devolver; con verbose=False, solo LEAN_FIELDS
+    fields: Optional[List[str]] = None
+    verbose: bool = True
+
+    @field_validator("fields")
+    @classmethod
+    def check_fields(cls, fields):
+        resolve_fields(fields)
+        return fields
+
+    def selected_fields(self) -> Optional[frozenset]:
+        return resolve_fields(self.fields, self.verbose)
 
-class StatementRequest(BaseModel):
+
+class StatementRequest(ResponseOptions):
     statement: str
+    # Presupuesto de latencia opcional en milisegundos
+    deadline_ms: Optional[float] = Field(default=None, gt=0)
+    # Añade a la respuesta el desglose de tiempos por etapa (timings_ns)
+    debug_timings: bool = False
 
 
-class BatchRequest(BaseModel):
+class BatchRequest(ResponseOptions):
     statements: List[str]
+    deadline_ms: Optional[float] = Field(default=None, gt=0)
+    debug_timings: bool = False
+
+
+# ============================================================================
+# TRAZAS Y TIEMPOS POR PETICIÓN
+# ============================================================================
+
+
+class RequestTrace:
+    """Tiempos de una petición de predicción: espera en la cola del ejecutor
+    y duración de cada etapa de `predict_batch`, acumulados en nanosegundos
+    sobre todos los bloques de la petición"""
+
+    __slots__ = ("name", "trace_id", "statement", "size", "debug", "started", "started_wall", "timings", "spans")
+
+    def __init__(self, name: str, statement: str, size: int = 1, debug: bool = False, record_spans: bool = False):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.statement = statement
+        self.size = size
+        self.debug = debug
+        self.started = time.perf_counter_ns()
+        self.started_wall = time.time_ns()
+        self.timings: Dict[str, int] = {}
+        # (etapa, inicio en perf_counter_ns, duración) solo si se exportan
+        self.spans: Optional[List[Tuple[str, int, int]]] = [] if record_spans else None
+
+    def add_stages(self, stages: Dict[str, float]):
+        """Acumula etapas consecutivas (en segundos) que terminan ahora"""
+        end = time.perf_counter_ns()
+        durations = [(stage, int(seconds * 1e9)) for stage, seconds in stages.items()]
+        start = end - sum(duration for _stage, duration in durations)
+        for stage, duration in durations:
+            self.timings[stage] = self.timings.get(stage, 0) + duration
+            if self.spans is not None:
+                self.spans.append((stage, start, duration))
+            start += duration
+
+    def timings_ns(self) -> Dict[str, int]:
+        """Desglose por etapa más el tiempo total transcurrido hasta ahora"""
+        return {**self.timings, "total": time.perf_counter_ns() - self.started}
+
+    def to_spans(self, total_ns: int, model_version: Optional[str]) -> List[Dict]:
+        """Span raíz de la petición y un span hijo por etapa registrada"""
+        root_id = uuid.uuid4().hex[:16]
+        records = [
+            {
+                "trace_id": self.trace_id,
+                "span_id": root_id,
+                "parent_id": None,
+                "name": self.name,
+                "start_ns": self.started_wall,
+                "duration_ns": total_ns,
+                "attributes": {
+                    "statements": self.size,
+                    "model_version": model_version,
+                    "debug_timings": self.debug,
+                },
+            }
+        ]
+        for stage, start, duration in self.spans or ():
+            records.append(
+                {
+                    "trace_id": self.trace_id,
+                    "span_id": uuid.uuid4().hex[:16],
+                    "parent_id": root_id,
+                    "name": stage,
+                    "start_ns": self.started_wall + (start - self.started),
+                    "duration_ns": duration,
+                }
+            )
+        return records
+
+
+# Traza de la petición en curso; el ejecutor de inferencia la propaga a sus hilos
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+
+class SpanExporter:
+    """Añade los spans de cada petición como líneas JSON a un fichero local
+    para analizarlos sin conexión"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.exported = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Dict]):
+        data = b"".join(dumps_json(span) + b"\n" for span in spans)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "ab")
+            self._file.write(data)
+            self.exported += len(spans)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# ============================================================================
+# CAPTURA DE TRÁFICO
+# ============================================================================
+
+
+def _approx_size(value) -> int:
+    """Tamaño aproximado en bytes de un valor una vez serializado"""
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_approx_size(key) + _approx_size(item) for key, item in value.items()) + 2
+    if isinstance(value, (list, tuple)):
+        return sum(_approx_size(item) for item in value) + 2
+    return 8
+
+
+def _capture_default(value):
+    """Valores que JSON no admite: los bytes (p. ej. de frames msgpack) se
+    guardan en base64"""
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode("ascii")
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+class TrafficCapture:
+    """Añade las peticiones de predicción y sus respuestas a un fichero JSONL
+    sin bloquear: la petición solo encola el registro y un hilo lo serializa
+    y lo escribe cada `flush_interval` segundos. Si lo pendiente de escribir
+    supera `max_pending_bytes`, los registros nuevos se descartan"""
+
+    def __init__(self, path: str, flush_interval: float = 1.0, max_pending_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_pending_bytes = max_pending_bytes
+        self._pending: deque = deque()
+        self._pending_bytes = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Métricas
+        self.captured = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+
+    def record(self, record: Dict):
+        """Encola un registro. `request` y `response` pueden ser dicts o el
+        cuerpo JSON en bytes, que se decodifica al escribir"""
+        size = _approx_size(record.get("request")) + _approx_size(record.get("response"))
+        with self._lock:
+            if self._pending_bytes + size > self.max_pending_bytes:
+                self.dropped += 1
+                return
+            self._pending_bytes += size
+        self._pending.append((record, size))
+        self.captured += 1
+
+    @staticmethod
+    def _encode(record: Dict) -> bytes:
+        for key in ("request", "response"):
+            value = record.get(key)
+            if isinstance(value, bytes):
+                try:
+                    record[key] = json.loads(value)
+                except ValueError:
+                    record[key] = value.decode("utf-8", "replace")
+        if orjson is not None:
+            try:
+                return orjson.dumps(
+                    record,
+                    default=_capture_default,
+                    option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+                ) + b"\n"
+            except TypeError:
+                # p. ej. textos con surrogates sueltos: se escapan en ASCII
+                pass
+        return json.dumps(record, default=_capture_default).encode("ascii") + b"\n"
+
+    def flush(self):
+        lines = []
+        while True:
+            try:
+                record, size = self._pending.popleft()
+            except IndexError:
+                break
+            with self._lock:
+                self._pending_bytes -= size
+            try:
+                lines.append(self._encode(record))
+            except Exception as e:
+                # Un registro no serializable no arrastra al resto del bloque
+                self.failed += 1
+                logger.warning(f"Registro de la captura de tráfico descartado: {e}")
+        if lines:
+            with open(self.path, "ab") as f:
+                f.write(b"".join(lines))
+            self.written += len(lines)
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error escribiendo la captura de tráfico: {e}")
+        self.flush()
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+        self._thread.start()
+        logger.info(f"📼 Capturando el tráfico de predicción en {self.path}")
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def get_metrics(self) -> Dict:
+        return {
+            "path": self.path,
+            "captured": self.captured,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "pending": len(self._pending),
+            "pending_bytes": self._pending_bytes,
+        }
+
+
+class CaptureMiddleware:
+    """Middleware ASGI que registra las peticiones a /predict y
+    /predict/batch con su instante de llegada, su cuerpo y la respuesta"""
+
+    PATHS = frozenset(["/predict", "/predict/batch"])
+
+    def __init__(self, app, capture: TrafficCapture):
+        self.app = app
+        self.capture = capture
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        arrived = time.time()
+        started = time.perf_counter()
+        request_body: List[bytes] = []
+        response_body: List[bytes] = []
+        status = 500
+
+        async def capture_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                request_body.append(message.get("body", b""))
+            return message
+
+        async def capture_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_body.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            self.capture.record(
+                {
+                    "t": arrived,
+                    "channel": "http",
+                    "endpoint": scope["path"],
+                    "request": b"".join(request_body),
+                    "status": status,
+                    "response": b"".join(response_body),
+                    "duration_ms": (time.perf_counter() - started) * 1000,
+                    "model_version": truth_detector.model_version,
+                }
+            )
 
 
 # ============================================================================
@@ -43,18 +824,50 @@ class BatchRequest(BaseModel):
 # ============================================================================
 
 
+def _matrix_bytes(matrix) -> int:
+    """Bytes de los datos de un array de numpy o de una matriz dispersa"""
+    if matrix is None:
+        return 0
+    if hasattr(matrix, "indptr"):
+        return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    return matrix.nbytes
+
+
+def _container_bytes(container) -> int:
+    """Bytes de una lista, conjunto o dict y de los objetos distintos que contiene"""
+    items = container.items() if isinstance(container, dict) else ((item,) for item in container)
+    seen = {}
+    for pair in items:
+        for item in pair:
+            seen[id(item)] = item
+    return sys.getsizeof(container) + sum(sys.getsizeof(item) for item in seen.values())
+
+
 class TruthDetector:
-    def __init__(self):
+    def __init__(
+        self,
+        max_features: int = 5000,
+        ngram_range: Tuple[int, int] = (1, 3),
+        min_df: int = 2,
+        max_weight: float = 0.7,
+        weight_threshold: float = 0.3,
+        category_weights: Optional[Dict[str, float]] = None,
+    ):
+        """Los parámetros permiten ajustar el modelo (barridos de
+        hiperparámetros); sus valores por defecto son los de producción.
+        `max_weight` es el peso de la similaridad máxima en la puntuación
+        combinada (el promedio pesa el resto) y `weight_threshold`, la
+        similaridad a partir de la cual se aplican los pesos por categoría"""
         # Vectorizador TF-IDF mejorado con más features y stop_words en español
         spanish_stop_words = [
             'el', 'la', 'de', 'que', 'y', 'a', 'en', 'un', 'es', 'se', 'no', 'te', 'lo', 'le', 'da', 'su', 'por', 'son', 'con', 'para', 'al', 'del', 'las', 'una', 'también', 'pero', 'sus', 'me', 'hasta', 'hay', 'donde', 'han', 'quien', 'están', 'estado', 'desde', 'todo', 'nos', 'durante', 'todos', 'uno', 'les', 'ni', 'contra', 'otros', 'ese', 'eso', 'ante', 'ellos', 'e', 'esto', 'mí', 'antes', 'algunos', 'qué', 'unos', 'yo', 'otro', 'otras', 'otra', 'él', 'tanto', 'esa', 'estos', 'mucho', 'quienes', 'nada', 'muchos', 'cual', 'poco', 'ella', 'estar', 'estas', 'algunas', 'algo', 'nosotros'
         ]
         
         self.vectorizer = TfidfVectorizer(
-            max_features=5000,  # Aumentado de 2000 a 5000
+            max_features=max_features,  # 5000 por defecto (antes 2000)
             stop_words=spanish_stop_words,  # Stop words en español
-            ngram_range=(1, 3),  # Unigramas, bigramas y trigramas
-            min_df=2,  # Frecuencia mínima de documento
+            ngram_range=tuple(ngram_range),  # Unigramas, bigramas y trigramas
+            min_df=min_df,  # Frecuencia mínima de documento
             max_df=0.95,  # Frecuencia máxima de documento
             sublinear_tf=True,  # Aplicar log a frecuencias
             analyzer='word'
@@ -75,6 +888,13 @@ class TruthDetector:
         self.false_categories = []
         self.is_trained = False
         self.dataset_path = "super_dataset.csv"
+        self.model_version = None
+        self._truth_weight_vector = None
+        self._false_weight_vector = None
+        self._shards = None
+        # Observador opcional que recibe los tiempos de cada etapa de
+        # `predict_batch` (lo usa el servidor para sus métricas)
+        self.stage_observer: Optional[Callable[[Dict[str, float]], None]] = None
 
         # Estadísticas del modelo
         self.total_statements = 0
@@ -82,8 +902,12 @@ class TruthDetector:
         self.false_count = 0
         self.categories = set()
         
+        # Combinación de similaridades: máximo y promedio
+        self.max_weight = max_weight
+        self.weight_threshold = weight_threshold
+
         # Pesos por categoría para mejorar afinidad
-        self.category_weights = {
+        self.category_weights = dict(category_weights) if category_weights is not None else {
             'matematicas': 1.2,      # Matemáticas: alta precisión
             'ciencia': 1.1,           # Ciencia: buena precisión
             'geografia': 1.0,         # Geografía: precisión estándar
@@ -129,8 +953,9 @@ class TruthDetector:
             logger.error(f"Error cargando dataset: {e}")
             return False
 
-    def train(self):
-        """Entrena el modelo usando el dataset masivo con técnicas mejoradas"""
+    def train(self, save: bool = True):
+        """Entrena el modelo usando el dataset masivo con técnicas mejoradas.
+        Con `save=False` no se guarda en disco (evaluaciones y barridos)"""
         logger.info("Entrenando el modelo de detección de verdad mejorado...")
 
         # Cargar dataset si no está cargado
@@ -160,51 +985,273 @@ class TruthDetector:
         self.false_embeddings = self.vectorizer.transform(self.false_statements)
 
         self.is_trained = True
+        self._prepare_scoring()
+        self._update_model_version()
         logger.info("Modelo mejorado entrenado exitosamente!")
 
         # Guardar el modelo
-        self.save_model()
+        if save:
+            self.save_model()
 
-    def predict(self, statement: str) -> Dict:
+    def predict(
+        self,
+        statement: str,
+        deadline: Optional[float] = None,
+        fields: Optional[frozenset] = None,
+    ) -> Dict:
         """Predice si una afirmación es verdadera o falsa con afinidad mejorada"""
+        return self.predict_batch([statement], deadline, fields)[0]
+
+    def predict_batch(
+        self,
+        statements: List[str],
+        deadline: Optional[float] = None,
+        fields: Optional[frozenset] = None,
+    ) -> List[Dict]:
+        """Predice varias afirmaciones a la vez vectorizando la transformación,
+        la similaridad y los pesos por categoría sobre todo el bloque.
+
+        Si se indica `deadline` (instante de `time.monotonic()`), el índice se
+        recorre por fragmentos de categoría y se devuelve el mejor resultado
+        obtenido al vencer el plazo, marcado como parcial. Con `fields`
+        (subconjunto de RESULT_FIELDS) solo se calculan esos campos"""
         if not self.is_trained:
             logger.warning("El modelo no está entrenado. Entrenando...")
             self.train()
 
-        # Generar embedding TF-IDF de la nueva afirmación
-        statement_embedding = self.vectorizer.transform([statement])
-        
-        # Detectar categoría de la afirmación
-        detected_category = self._detect_category(statement)
-        category_weight = self.category_weights.get(detected_category, 1.0)
+        if not statements:
+            return []
+
+        if deadline is not None:
+            return self._predict_batch_anytime(statements, deadline, fields)
+
+        perf_counter = time.perf_counter
+        started = perf_counter()
+
+        # Generar embeddings TF-IDF de todas las afirmaciones del bloque
+        statement_embeddings = self.vectorizer.transform(statements)
+        transformed = perf_counter()
 
         # Calcular similaridad con afirmaciones verdaderas y falsas
         true_similarities = cosine_similarity(
-            statement_embedding, self.truth_embeddings
+            statement_embeddings, self.truth_embeddings
         )
         false_similarities = cosine_similarity(
-            statement_embedding, self.false_embeddings
+            statement_embeddings, self.false_embeddings
         )
+        compared = perf_counter()
 
         # Aplicar pesos por categoría para mejorar afinidad
         true_similarities = self._apply_category_weights(
-            true_similarities, self.truth_categories, category_weight
+            true_similarities, self._truth_weight_vector
         )
         false_similarities = self._apply_category_weights(
-            false_similarities, self.false_categories, category_weight
+            false_similarities, self._false_weight_vector
         )
+        weighted = perf_counter()
+
+        # Detectar la categoría solo si se va a devolver
+        if fields is None or "detected_category" in fields or "category_weight" in fields:
+            categories = [self._detect_category(statement) for statement in statements]
+        else:
+            categories = [None] * len(statements)
+        detected = perf_counter()
+
+        reductions = [
+            self._reduce_similarities(
+                true_similarities[row : row + 1], false_similarities[row : row + 1]
+            )
+            for row in range(len(statements))
+        ]
+        reduced = perf_counter()
+
+        results = [
+            self._build_prediction(
+                statement,
+                true_similarities[row : row + 1],
+                false_similarities[row : row + 1],
+                fields=fields,
+                reduction=reductions[row],
+                detected_category=categories[row],
+            )
+            for row, statement in enumerate(statements)
+        ]
+
+        if self.stage_observer is not None:
+            self.stage_observer(
+                {
+                    "transform": transformed - started,
+                    "similarity": compared - transformed,
+                    "weighting": weighted - compared,
+                    "category": detected - weighted,
+                    "reduction": reduced - detected,
+                    "build": perf_counter() - reduced,
+                }
+            )
+        return results
+
+    def _predict_batch_anytime(
+        self, statements: List[str], deadline: float, fields: Optional[frozenset] = None
+    ) -> List[Dict]:
+        """Puntúa el bloque fragmento a fragmento del índice, empezando por las
+        categorías detectadas con más frecuencia, hasta completar el índice o
+        vencer el plazo. Siempre se puntúa al menos un fragmento de cada clase.
+        Informa al `stage_observer` con las mismas etapas que `predict_batch`;
+        la similaridad y los pesos se acumulan a lo largo de los fragmentos"""
+        perf_counter = time.perf_counter
+        started = perf_counter()
+
+        statement_embeddings = self.vectorizer.transform(statements)
+        transformed = perf_counter()
+
+        categories = [self._detect_category(statement) for statement in statements]
+        detected = Counter(categories)
+        shards = sorted(self._index_shards(), key=lambda shard: -detected[shard[0]])
+        categorized = perf_counter()
+
+        rows = len(statements)
+        true_similarities = np.zeros((rows, self.truth_embeddings.shape[0]))
+        false_similarities = np.zeros((rows, self.false_embeddings.shape[0]))
+        true_seen, false_seen = [], []
+        scanned = 0
+        similarity_time = weighting_time = 0.0
+
+        for _category, true_columns, true_matrix, false_columns, false_matrix in shards:
+            if true_seen and false_seen and time.monotonic() >= deadline:
+                break
+
+            if true_columns.size:
+                shard_started = perf_counter()
+                similarities = cosine_similarity(statement_embeddings, true_matrix)
+                shard_compared = perf_counter()
+                true_similarities[:, true_columns] = self._apply_category_weights(
+                    similarities, self._truth_weight_vector[true_columns]
+                )
+                similarity_time += shard_compared - shard_started
+                weighting_time += perf_counter() - shard_compared
+                true_seen.append(true_columns)
+            if false_columns.size:
+                shard_started = perf_counter()
+                similarities = cosine_similarity(statement_embeddings, false_matrix)
+                shard_compared = perf_counter()
+                false_similarities[:, false_columns] = self._apply_category_weights(
+                    similarities, self._false_weight_vector[false_columns]
+                )
+                similarity_time += shard_compared - shard_started
+                weighting_time += perf_counter() - shard_compared
+                false_seen.append(false_columns)
+            scanned += 1
+        scored = perf_counter()
+
+        partial = scanned < len(shards)
+        true_columns = false_columns = None
+        if partial:
+            # Solo se consideran las columnas puntuadas, en su orden original
+            true_columns = np.sort(np.concatenate(true_seen))
+            false_columns = np.sort(np.concatenate(false_seen))
+            true_similarities = true_similarities[:, true_columns]
+            false_similarities = false_similarities[:, false_columns]
+
+        reductions = [
+            self._reduce_similarities(
+                true_similarities[row : row + 1], false_similarities[row : row + 1]
+            )
+            for row in range(rows)
+        ]
+        reduced = perf_counter()
+
+        results = []
+        for row, statement in enumerate(statements):
+            result = self._build_prediction(
+                statement,
+                true_similarities[row : row + 1],
+                false_similarities[row : row + 1],
+                true_columns,
+                false_columns,
+                fields,
+                reduction=reductions[row],
+                detected_category=categories[row],
+            )
+            result["partial"] = partial
+            result["shards_scanned"] = scanned
+            result["shards_total"] = len(shards)
+            results.append(result)
+
+        if self.stage_observer is not None:
+            self.stage_observer(
+                {
+                    "transform": transformed - started,
+                    "similarity": similarity_time,
+                    "weighting": weighting_time,
+                    "category": categorized - transformed,
+                    "reduction": reduced - scored,
+                    "build": perf_counter() - reduced,
+                }
+            )
+        return results
+
+    def _index_shards(self) -> List[Tuple]:
+        """Fragmentos del índice por categoría: (categoría, columnas verdaderas,
+        embeddings verdaderos, columnas falsas, embeddings falsos)"""
+        if self._shards is None:
+            true_rows = self._rows_by_category(
+                self.truth_categories, self.truth_embeddings.shape[0]
+            )
+            false_rows = self._rows_by_category(
+                self.false_categories, self.false_embeddings.shape[0]
+            )
+            empty = np.array([], dtype=int)
+            shards = []
+            for category in sorted(set(true_rows) | set(false_rows)):
+                true_columns = np.array(true_rows.get(category, empty), dtype=int)
+                false_columns = np.array(false_rows.get(category, empty), dtype=int)
+                shards.append(
+                    (
+                        category,
+                        true_columns,
+                        self.truth_embeddings[true_columns],
+                        false_columns,
+                        self.false_embeddings[false_columns],
+                    )
+                )
+            self._shards = shards
+        return self._shards
+
+    @staticmethod
+    def _rows_by_category(categories, size) -> Dict[str, List[int]]:
+        rows: Dict[str, List[int]] = {}
+        for i in range(size):
+            category = categories[i] if i < len(categories) else "general"
+            rows.setdefault(category, []).append(i)
+        return rows
+
+    def _build_prediction(
+        self,
+        statement: str,
+        true_similarities,
+        false_similarities,
+        true_columns=None,
+        false_columns=None,
+        fields: Optional[frozenset] = None,
+        reduction: Optional[Tuple] = None,
+        detected_category: Optional[str] = None,
+    ) -> Dict:
+        """Construye el resultado de una afirmación a partir de sus similaridades.
+        `true_columns`/`false_columns` indican qué filas del índice representan
+        las similaridades cuando solo se ha puntuado una parte del mismo. Con
+        `fields` solo se calculan y devuelven esos campos del resultado.
+        `reduction` y `detected_category` permiten pasar ya calculadas la
+        reducción de las similaridades y la categoría"""
+        wants = fields.__contains__ if fields is not None else lambda _field: True
+
+        if reduction is None:
+            reduction = self._reduce_similarities(true_similarities, false_similarities)
+        max_true_sim, max_false_sim, avg_true_sim, avg_false_sim = reduction
 
-        # Calcular métricas mejoradas de similaridad
-        max_true_sim = np.max(true_similarities)
-        max_false_sim = np.max(false_similarities)
-        
-        # Usar promedio ponderado para mayor estabilidad
-        avg_true_sim = np.mean(true_similarities)
-        avg_false_sim = np.mean(false_similarities)
-        
         # Combinar métricas para mejor afinidad
-        combined_true_score = (max_true_sim * 0.7) + (avg_true_sim * 0.3)
-        combined_false_score = (max_false_sim * 0.7) + (avg_false_sim * 0.3)
+        mean_weight = 1.0 - self.max_weight
+        combined_true_score = (max_true_sim * self.max_weight) + (avg_true_sim * mean_weight)
+        combined_false_score = (max_false_sim * self.max_weight) + (avg_false_sim * mean_weight)
 
         # Calcular confianza y decisión con umbral adaptativo
         confidence_threshold = 0.1  # Umbral mínimo para evitar predicciones muy inciertas
@@ -212,33 +1259,20 @@ class TruthDetector:
         if combined_true_score > combined_false_score and combined_true_score > confidence_threshold:
             confidence = float(combined_true_score)
             prediction = "verdadero"
-            explanation = f"La afirmación tiene {confidence:.2%} de similaridad con afirmaciones verdaderas conocidas"
-            similarities = true_similarities
-            statements = self.truth_statements
+            low_confidence = False
         elif combined_false_score > combined_true_score and combined_false_score > confidence_threshold:
             confidence = float(combined_false_score)
             prediction = "falso"
-            explanation = f"La afirmación tiene {confidence:.2%} de similaridad con afirmaciones falsas conocidas"
-            similarities = false_similarities
-            statements = self.false_statements
+            low_confidence = False
         else:
             # Caso de baja confianza - usar la más alta pero marcar como incierta
             if combined_true_score > combined_false_score:
                 confidence = float(combined_true_score)
                 prediction = "verdadero"
-                explanation = f"La afirmación tiene {confidence:.2%} de similaridad con afirmaciones verdaderas conocidas (BAJA CONFIANZA)"
             else:
                 confidence = float(combined_false_score)
                 prediction = "falso"
-                explanation = f"La afirmación tiene {confidence:.2%} de similaridad con afirmaciones falsas conocidas (BAJA CONFIANZA)"
-            
-            similarities = true_similarities if prediction == "verdadero" else false_similarities
-            statements = self.truth_statements if prediction == "verdadero" else self.false_statements
-
-        # Encontrar afirmaciones más similares para explicación
-        most_similar_idx = np.argmax(similarities)
-        most_similar = statements[most_similar_idx]
-        similarity_score = similarities[0][most_similar_idx]
+            low_confidence = True
 
         # Determinar nivel de confianza mejorado
         if confidence > 0.8:
@@ -252,23 +1286,64 @@ class TruthDetector:
         else:
             confidence_level = "muy baja"
 
-        return {
+        # Solo se calcula lo que se va a devolver
+        result = {
             "prediction": prediction,
             "confidence": confidence,
             "confidence_level": confidence_level,
-            "explanation": explanation,
-            "most_similar_statement": most_similar,
-            "similarity_score": float(similarity_score),
-            "detected_category": detected_category,
-            "category_weight": category_weight,
-            "max_true_similarity": float(max_true_sim),
-            "max_false_similarity": float(max_false_sim),
-            "avg_true_similarity": float(avg_true_sim),
-            "avg_false_similarity": float(avg_false_sim),
-            "total_training_data": self.total_statements,
-            "model_status": "entrenado" if self.is_trained else "no entrenado",
         }
 
+        if wants("explanation"):
+            kind = "verdaderas" if prediction == "verdadero" else "falsas"
+            explanation = f"La afirmación tiene {confidence:.2%} de similaridad con afirmaciones {kind} conocidas"
+            if low_confidence:
+                explanation += " (BAJA CONFIANZA)"
+            result["explanation"] = explanation
+
+        if wants("most_similar_statement") or wants("similarity_score"):
+            # Encontrar afirmaciones más similares para explicación
+            if prediction == "verdadero":
+                similarities, statements, columns = true_similarities, self.truth_statements, true_columns
+            else:
+                similarities, statements, columns = false_similarities, self.false_statements, false_columns
+            most_similar_idx = np.argmax(similarities)
+            most_similar = statements[
+                most_similar_idx if columns is None else columns[most_similar_idx]
+            ]
+            similarity_score = similarities[0][most_similar_idx]
+            result["most_similar_statement"] = most_similar
+            result["similarity_score"] = float(similarity_score)
+
+        if wants("detected_category") or wants("category_weight"):
+            # Detectar categoría de la afirmación
+            if detected_category is None:
+                detected_category = self._detect_category(statement)
+            result["detected_category"] = detected_category
+            result["category_weight"] = self.category_weights.get(detected_category, 1.0)
+
+        result["max_true_similarity"] = float(max_true_sim)
+        result["max_false_similarity"] = float(max_false_sim)
+        result["avg_true_similarity"] = float(avg_true_sim)
+        result["avg_false_similarity"] = float(avg_false_sim)
+        result["total_training_data"] = self.total_statements
+        result["model_status"] = "entrenado" if self.is_trained else "no entrenado"
+
+        if fields is not None:
+            result = {field: result[field] for field in RESULT_FIELDS if field in fields}
+        return result
+
+    @staticmethod
+    def _reduce_similarities(true_similarities, false_similarities) -> Tuple:
+        """Máximo y promedio de las similaridades con cada clase"""
+        # Calcular métricas mejoradas de similaridad
+        max_true_sim = np.max(true_similarities)
+        max_false_sim = np.max(false_similarities)
+
+        # Usar promedio ponderado para mayor estabilidad
+        avg_true_sim = np.mean(true_similarities)
+        avg_false_sim = np.mean(false_similarities)
+        return max_true_sim, max_false_sim, avg_true_sim, avg_false_sim
+
     def _detect_category(self, statement: str) -> str:
         """Detecta la categoría de una afirmación usando palabras clave"""
         statement_lower = statement.lower()
@@ -295,18 +1370,27 @@ class TruthDetector:
         else:
             return 'general'
 
-    def _apply_category_weights(self, similarities, categories, target_weight):
+    def _apply_category_weights(self, similarities, weight_vector):
         """Aplica pesos por categoría a las similaridades"""
-        weighted_similarities = similarities.copy()
-        
-        for i, category in enumerate(categories):
-            if category in self.category_weights:
-                weight = self.category_weights[category]
-                # Aplicar peso solo si la similaridad es alta (> 0.3)
-                if similarities[0][i] > 0.3:
-                    weighted_similarities[0][i] *= weight
-        
-        return weighted_similarities
+        # Aplicar peso solo si la similaridad es alta (> weight_threshold)
+        return np.where(similarities > self.weight_threshold, similarities * weight_vector, similarities)
+
+    def _prepare_scoring(self):
+        """Precalcula el vector de pesos por categoría de cada conjunto de entrenamiento"""
+        self._shards = None
+        self._truth_weight_vector = self._category_weight_vector(
+            self.truth_categories, self.truth_embeddings.shape[0]
+        )
+        self._false_weight_vector = self._category_weight_vector(
+            self.false_categories, self.false_embeddings.shape[0]
+        )
+
+    def _category_weight_vector(self, categories, size):
+        """Peso de cada fila del índice; las filas sin categoría conocida pesan 1.0"""
+        weights = np.ones(size)
+        for i, category in enumerate(categories[:size]):
+            weights[i] = self.category_weights.get(category, 1.0)
+        return weights
 
     def get_statistics(self) -> Dict:
         """Obtiene estadísticas del modelo y dataset"""
@@ -318,9 +1402,75 @@ class TruthDetector:
             "is_trained": self.is_trained,
             "model_name": "TF-IDF-Vectorizer-Mejorado",
             "category_weights": self.category_weights,
+            "max_weight": self.max_weight,
+            "weight_threshold": self.weight_threshold,
             "features": self.vectorizer.max_features,
             "ngram_range": self.vectorizer.ngram_range,
+            "model_version": self.model_version,
+        }
+
+    def get_size(self) -> Dict:
+        """Tamaño del modelo en memoria: vocabulario y matrices del índice"""
+        return {
+            "vocabulary_size": len(getattr(self.vectorizer, "vocabulary_", {})),
+            "index_bytes": _matrix_bytes(self.truth_embeddings) + _matrix_bytes(self.false_embeddings),
+        }
+
+    def get_memory_usage(self) -> Dict[str, int]:
+        """Bytes en memoria de cada estructura del detector. Los objetos
+        compartidos (p. ej. las cadenas de categoría repetidas) se cuentan una
+        vez por estructura"""
+        usage = {
+            "truth_embeddings": _matrix_bytes(self.truth_embeddings),
+            "false_embeddings": _matrix_bytes(self.false_embeddings),
+            "truth_statements": _container_bytes(self.truth_statements),
+            "false_statements": _container_bytes(self.false_statements),
+            "truth_categories": _container_bytes(self.truth_categories),
+            "false_categories": _container_bytes(self.false_categories),
+            "category_weight_vectors": (
+                _matrix_bytes(self._truth_weight_vector) + _matrix_bytes(self._false_weight_vector)
+            ),
+            "index_shards_cache": sum(
+                _matrix_bytes(true_columns)
+                + _matrix_bytes(true_matrix)
+                + _matrix_bytes(false_columns)
+                + _matrix_bytes(false_matrix)
+                for _category, true_columns, true_matrix, false_columns, false_matrix in self._shards or ()
+            ),
         }
+        for prefix, vectorizer in (("vectorizer", self.vectorizer), ("category_vectorizer", self.category_vectorizer)):
+            usage[f"{prefix}_vocabulary"] = _container_bytes(getattr(vectorizer, "vocabulary_", {}))
+            usage[f"{prefix}_idf"] = _matrix_bytes(getattr(vectorizer, "idf_", None))
+            usage[f"{prefix}_stop_words"] = _container_bytes(vectorizer.stop_words or [])
+            # Términos descartados por min_df/max_df/max_features que sklearn
+            # guarda tras el entrenamiento aunque no se usan para predecir
+            usage[f"{prefix}_pruned_terms"] = _container_bytes(getattr(vectorizer, "stop_words_", set()))
+        return usage
+
+    def canonical_key(self, statement: str) -> str:
+        """Forma canónica de una afirmación: dos afirmaciones con la misma clave
+        producen exactamente la misma predicción (el vectorizer y la detección de
+        categorías ya trabajan en minúsculas e ignoran los bordes)"""
+        return statement.strip().lower()
+
+    def _update_model_version(self):
+        """Calcula una huella estable del modelo a partir de sus datos de entrenamiento"""
+        digest = hashlib.sha1()
+        for items in (
+            self.truth_statements,
+            self.false_statements,
+            self.truth_categories,
+            self.false_categories,
+        ):
+            digest.update("\x1f".join(map(str, items)).encode("utf-8"))
+            digest.update(b"\x1e")
+        digest.update(json.dumps(self.category_weights, sort_keys=True).encode("utf-8"))
+        if (self.max_weight, self.weight_threshold) != (0.7, 0.3):
+            # Solo si no son los de siempre: la versión de los modelos
+            # existentes no cambia
+            digest.update(f"{self.max_weight}/{self.weight_threshold}".encode("utf-8"))
+        digest.update(repr(self.vectorizer.get_params()).encode("utf-8"))
+        self.model_version = digest.hexdigest()[:12]
 
     def _load_basic_knowledge(self):
         """Carga conocimiento básico como fallback con categorías"""
@@ -378,6 +1528,8 @@ class TruthDetector:
             "false_count": self.false_count,
             "categories": list(self.categories),
             "category_weights": self.category_weights,
+            "max_weight": self.max_weight,
+            "weight_threshold": self.weight_threshold,
         }
 
         with open(filepath, "wb") as f:
@@ -406,6 +1558,10 @@ class TruthDetector:
                 self.false_count = model_data.get("false_count", 0)
                 self.categories = set(model_data.get("categories", []))
                 self.category_weights = model_data.get("category_weights", self.category_weights)
+                self.max_weight = model_data.get("max_weight", self.max_weight)
+                self.weight_threshold = model_data.get("weight_threshold", self.weight_threshold)
+                self._prepare_scoring()
+                self._update_model_version()
 
                 logger.info(f"Modelo mejorado cargado desde {filepath}")
                 logger.info(
@@ -427,31 +1583,1146 @@ class TruthDetector:
 # ============================================================================
 
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+class _Connection:
+    __slots__ = ("websocket", "encoding", "queue", "writer", "topics", "sent", "dropped")
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+    def __init__(self, websocket: WebSocket, encoding: str, queue_size: int):
+        self.websocket = websocket
+        self.encoding = encoding
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.topics = set()
+        self.sent = 0
+        self.dropped = 0
+
+
+class ConnectionManager:
+    """Registro de conexiones WebSocket. Cada conexión tiene una cola de
+    salida acotada y una tarea escritora propia, de modo que un cliente lento
+    nunca bloquea a los demás. Las respuestas a peticiones del propio cliente
+    esperan hueco en su cola (contrapresión); los mensajes de difusión nunca
+    esperan y, si la cola está llena, se aplica la política de consumidor
+    lento: descartar el mensaje (`drop`) o cerrar la conexión (`disconnect`)"""
+
+    def __init__(self, send_queue_size: int = 256, slow_consumer_policy: str = "disconnect"):
+        if slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Política de consumidor lento desconocida: {slow_consumer_policy}")
+        self.active_connections: Dict[WebSocket, _Connection] = {}
+        # Conexiones suscritas a cada tema de difusión
+        self.subscribers: Dict[str, set] = {}
+        self.send_queue_size = send_queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+
+        # Métricas
+        self.messages_sent = 0
+        self.messages_dropped = 0
+        self.broadcasts = 0
+        self.slow_consumer_disconnects = 0
+        # Peticiones canceladas por el cliente o por desconexión
+        self.cancelled_by_client = 0
+        self.cancelled_on_disconnect = 0
+
+    async def connect(self, websocket: WebSocket, encoding: str = "json"):
+        await websocket.accept()
+        connection = _Connection(websocket, encoding, self.send_queue_size)
+        connection.writer = asyncio.create_task(self._write(connection))
+        self.active_connections[websocket] = connection
         logger.info(f"Nueva conexión WebSocket. Total: {len(self.active_connections)}")
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        connection = self.active_connections.pop(websocket, None)
+        if connection is None:
+            return
+        connection.writer.cancel()
+        self._unsubscribe(connection, list(connection.topics))
+        self.messages_sent += connection.sent
         logger.info(
             f"Conexión WebSocket cerrada. Total: {len(self.active_connections)}"
         )
 
+    def subscribe(self, websocket: WebSocket, topics):
+        connection = self.active_connections.get(websocket)
+        if connection is None:
+            return
+        for topic in topics:
+            connection.topics.add(topic)
+            self.subscribers.setdefault(topic, set()).add(connection)
+
+    def unsubscribe(self, websocket: WebSocket, topics):
+        connection = self.active_connections.get(websocket)
+        if connection is not None:
+            self._unsubscribe(connection, topics)
+
+    def _unsubscribe(self, connection: _Connection, topics):
+        for topic in topics:
+            connection.topics.discard(topic)
+            subscribers = self.subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(connection)
+                if not subscribers:
+                    del self.subscribers[topic]
+
+    def has_subscribers(self, topic: str) -> bool:
+        return bool(self.subscribers.get(topic))
+
+    def set_encoding(self, websocket: WebSocket, encoding: str):
+        """Cambia la codificación de los mensajes que se encolen a partir de ahora"""
+        connection = self.active_connections.get(websocket)
+        if connection is not None:
+            connection.encoding = encoding
+
+    async def _write(self, connection: _Connection):
+        """Tarea escritora: envía en orden los mensajes de la cola"""
+        websocket = connection.websocket
+        try:
+            while True:
+                payload = await connection.queue.get()
+                if isinstance(payload, bytes):
+                    await websocket.send_bytes(payload)
+                else:
+                    await websocket.send_text(payload)
+                connection.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # El cliente ya no está: el bucle de lectura recibirá la desconexión
+            logger.debug(f"Error enviando por WebSocket: {e}")
+
     async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+        connection = self.active_connections.get(websocket)
+        if connection is not None:
+            await connection.queue.put(message)
+
+    async def send_message(self, message: Dict, websocket: WebSocket):
+        """Encola un mensaje con la codificación negociada por la conexión"""
+        connection = self.active_connections.get(websocket)
+        if connection is not None:
+            await connection.queue.put(encode_ws_message(message, connection.encoding))
+
+    async def receive_frame(self, websocket: WebSocket):
+        """Recibe un frame de texto (str) o binario (bytes)"""
+        frame = await websocket.receive()
+        if frame["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(frame.get("code", 1000))
+        if frame.get("bytes") is not None:
+            return frame["bytes"]
+        return frame.get("text", "")
+
+    def broadcast(self, message: Dict, topic: Optional[str] = None) -> int:
+        """Difunde un mensaje a todas las conexiones (o solo a las suscritas a
+        `topic`) sin esperar a ninguna. Se codifica una sola vez por
+        codificación. Devuelve cuántas conexiones lo recibieron en su cola"""
+        self.broadcasts += 1
+        if topic is None:
+            targets = list(self.active_connections.values())
+        else:
+            targets = list(self.subscribers.get(topic, ()))
+        payloads: Dict[str, object] = {}
+        delivered = 0
+        slow = []
+        for connection in targets:
+            payload = payloads.get(connection.encoding)
+            if payload is None:
+                payload = payloads[connection.encoding] = encode_ws_message(
+                    message, connection.encoding
+                )
+            try:
+                connection.queue.put_nowait(payload)
+                delivered += 1
+            except asyncio.QueueFull:
+                connection.dropped += 1
+                self.messages_dropped += 1
+                slow.append(connection)
+
+        if self.slow_consumer_policy == "disconnect":
+            for connection in slow:
+                self._disconnect_slow_consumer(connection)
+        return delivered
+
+    def _disconnect_slow_consumer(self, connection: _Connection):
+        logger.warning("🐢 Cerrando conexión WebSocket con la cola de salida llena")
+        self.slow_consumer_disconnects += 1
+        self.disconnect(connection.websocket)
+        asyncio.create_task(self._close(connection.websocket))
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await asyncio.wait_for(websocket.close(code=1013), timeout=5)
+        except Exception:
+            pass
+
+    def get_metrics(self) -> Dict:
+        depths = [connection.queue.qsize() for connection in self.active_connections.values()]
+        return {
+            "active_connections": len(self.active_connections),
+            "send_queue_size": self.send_queue_size,
+            "send_queue_depth": sum(depths),
+            "max_send_queue_depth": max(depths, default=0),
+            "slow_consumer_policy": self.slow_consumer_policy,
+            "messages_sent": self.messages_sent
+            + sum(connection.sent for connection in self.active_connections.values()),
+            "messages_dropped": self.messages_dropped,
+            "broadcasts": self.broadcasts,
+            "subscribers": {topic: len(connections) for topic, connections in self.subscribers.items()},
+            "slow_consumer_disconnects": self.slow_consumer_disconnects,
+            "cancelled_by_client": self.cancelled_by_client,
+            "cancelled_on_disconnect": self.cancelled_on_disconnect,
+        }
+
+
+# ============================================================================
+# PUBLICACIÓN DE ESTADÍSTICAS
+# ============================================================================
+
+
+class StatisticsPublisher:
+    """Publica periódicamente a los suscriptores de cada tema. En cada ciclo
+    se construye una sola vez el mensaje de cada tema con suscriptores y solo
+    se difunde si cambió desde la última publicación.
+
+    `volatile` indica, por tema, los campos que cambian en cada ciclo (p. ej.
+    contadores de ejecución): no cuentan para decidir si el mensaje cambió,
+    pero se envían con su valor actual cuando se publica"""
+
+    def __init__(
+        self,
+        connections: ConnectionManager,
+        sources: Dict[str, Callable[[], Dict]],
+        interval: float,
+        volatile: Optional[Dict[str, Tuple[str, ...]]] = None,
+    ):
+        self.connections = connections
+        self.sources = sources
+        self.interval = interval
+        self.volatile = volatile or {}
+        self.latest: Dict[str, Dict] = {}
+        self._compared: Dict[str, Dict] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        # Métricas
+        self.ticks = 0
+        self.published = 0
+
+    @property
+    def topics(self) -> Tuple[str, ...]:
+        return tuple(self.sources)
+
+    def snapshot(self, topic: str) -> Dict:
+        """Último mensaje publicado de un tema (lo que ya tienen los demás
+        suscriptores), para enviarlo al suscribirse"""
+        if topic not in self.latest:
+            message = self.sources[topic]()
+            self.latest[topic] = message
+            self._compared[topic] = self._without_volatile(topic, message)
+        return self.latest[topic]
+
+    def _without_volatile(self, topic: str, message: Dict) -> Dict:
+        volatile = self.volatile.get(topic, ())
+        return {key: value for key, value in message.items() if key not in volatile}
+
+    def publish(self) -> int:
+        """Difunde los temas que cambiaron. Devuelve cuántos se publicaron"""
+        self.ticks += 1
+        published = 0
+        for topic, build in self.sources.items():
+            if not self.connections.has_subscribers(topic):
+                self.latest.pop(topic, None)
+                self._compared.pop(topic, None)
+                continue
+            message = build()
+            compared = self._without_volatile(topic, message)
+            if compared == self._compared.get(topic):
+                continue
+            self.latest[topic] = message
+            self._compared[topic] = compared
+            self.connections.broadcast(message, topic)
+            published += 1
+        self.published += published
+        return published
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.publish()
+            except Exception as e:
+                logger.error(f"Error publicando estadísticas: {e}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get_metrics(self) -> Dict:
+        return {
+            "interval_s": self.interval,
+            "ticks": self.ticks,
+            "published": self.published,
+        }
+
+
+# ============================================================================
+# VIGILANCIA DEL BUCLE DE EVENTOS
+# ============================================================================
+
+
+class LoopWatchdog:
+    """Mide el retraso con el que el bucle de eventos atiende una tarea que
+    duerme `interval` segundos y la espera de una tarea trivial en el
+    ejecutor por defecto del bucle (el de `asyncio.to_thread`). Un hilo
+    aparte comprueba el latido del bucle: si se detiene más de `threshold`
+    segundos, registra la pila del hilo del bucle mientras sigue bloqueado,
+    una vez por bloqueo"""
+
+    def __init__(
+        self,
+        interval: float,
+        threshold: float,
+        lag_histogram: Optional[HistogramMetric] = None,
+        stalls_counter: Optional[CounterMetric] = None,
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.lag_histogram = lag_histogram
+        self.stalls_counter = stalls_counter
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = time.monotonic()
+        self._probe_submitted: Optional[float] = None
+
+        # Métricas
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.last_stall_stack: Optional[str] = None
+        self.probe_wait = 0.0
+        self.max_probe_wait = 0.0
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(0.0, now - expected)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            if self.lag_histogram is not None:
+                self.lag_histogram.observe(lag)
+            if self._probe_submitted is None:
+                self._probe(loop)
+
+    def _probe(self, loop: asyncio.AbstractEventLoop):
+        """Encola una llamada trivial en el ejecutor por defecto y mide cuánto
+        tarda en empezar"""
+        self._probe_submitted = time.monotonic()
+        loop.run_in_executor(None, time.monotonic).add_done_callback(self._on_probe)
+
+    def _on_probe(self, done: asyncio.Future):
+        if not done.cancelled() and done.exception() is None:
+            self.probe_wait = done.result() - self._probe_submitted
+            self.max_probe_wait = max(self.max_probe_wait, self.probe_wait)
+        self._probe_submitted = None
+
+    def pending_probe_wait(self) -> float:
+        """Espera de la sonda en curso, o de la última si ya terminó"""
+        submitted = self._probe_submitted
+        if submitted is None:
+            return self.probe_wait
+        return max(self.probe_wait, time.monotonic() - submitted)
+
+    def _watch(self):
+        stalled = False
+        while not self._stopped.wait(self.interval):
+            blocked = time.monotonic() - self._heartbeat
+            if blocked < self.threshold + self.interval:
+                stalled = False
+                continue
+            if stalled:
+                continue
+            stalled = True
+            self.stalls += 1
+            if self.stalls_counter is not None:
+                self.stalls_counter.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            self.last_stall_stack = stack
+            logger.warning(
+                f"🐌 Bucle de eventos bloqueado {blocked * 1000:.0f} ms. Pila del bucle:\n{stack}"
+            )
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._run())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def get_metrics(self) -> Dict:
+        return {
+            "interval_s": self.interval,
+            "threshold_ms": self.threshold * 1000,
+            "last_lag_ms": self.last_lag * 1000,
+            "max_lag_ms": self.max_lag * 1000,
+            "stalls": self.stalls,
+            "default_executor_wait_ms": self.pending_probe_wait() * 1000,
+            "max_default_executor_wait_ms": self.max_probe_wait * 1000,
+        }
+
+
+# ============================================================================
+# DIAGNÓSTICO BAJO DEMANDA
+# ============================================================================
+
+
+# Marcos más internos de los hilos que esperan sin usar CPU (selector del
+# bucle de eventos, hilos de un pool sin trabajo, esperas de threading)
+IDLE_FRAMES = frozenset(
+    [
+        ("select", "selectors.py"),
+        ("_worker", "thread.py"),
+        ("wait", "threading.py"),
+        ("_wait_for_tstate_lock", "threading.py"),
+        ("get", "queue.py"),
+    ]
+)
+
+
+class StackSampler:
+    """Perfilador de CPU por muestreo: cada `interval` segundos toma la pila
+    de todos los hilos (salvo el propio) y cuenta cuántas veces aparece cada
+    una. Su coste depende de la frecuencia de muestreo, no del código
+    perfilado, por lo que puede usarse en producción. Salvo con
+    `include_idle`, se descartan las muestras de hilos en espera"""
+
+    def __init__(self, interval: float, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+        # (hilo, marco exterior, ..., marco interior) -> muestras
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.duration = 0.0
+
+    def run(self, seconds: float):
+        own = threading.get_ident()
+        started = time.monotonic()
+        deadline = started + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                code = frame.f_code
+                if not self.include_idle and (code.co_name, os.path.basename(code.co_filename)) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+        self.duration = time.monotonic() - started
+
+    def collapsed(self) -> str:
+        """Pilas plegadas, una por línea con su número de muestras (entrada de
+        flamegraph.pl y speedscope)"""
+        return "".join(
+            ";".join(stack) + f" {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def summary(self, top: int = 25) -> Dict:
+        """Funciones con más muestras en lo alto de la pila (propias) y en
+        cualquier posición (acumuladas), por hilo. El porcentaje es la
+        fracción de muestras en que el hilo estaba en esa función"""
+        own: Counter = Counter()
+        cumulative: Counter = Counter()
+        for (thread, *frames), count in self.stacks.items():
+            if frames:
+                own[(thread, frames[-1])] += count
+            for frame in set(frames):
+                cumulative[(thread, frame)] += count
+
+        def rows(counter: Counter) -> List[Dict]:
+            return [
+                {
+                    "thread": thread,
+                    "function": function,
+                    "samples": count,
+                    "percent": round(100 * count / self.samples, 2) if self.samples else 0.0,
+                }
+                for (thread, function), count in counter.most_common(top)
+            ]
+
+        return {
+            "samples": self.samples,
+            "duration_s": self.duration,
+            "interval_ms": self.interval * 1000,
+            "top_self": rows(own),
+            "top_cumulative": rows(cumulative),
+        }
+
+
+# Filtros que ocultan las asignaciones del propio tracemalloc y de la importación
+TRACEMALLOC_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def summarize_snapshot(
+    snapshot: tracemalloc.Snapshot,
+    previous: Optional[tracemalloc.Snapshot] = None,
+    group_by: str = "lineno",
+    top: int = 25,
+) -> Dict:
+    """Líneas (o ficheros) con más memoria asignada y, si hay una captura
+    anterior, las que más han crecido desde entonces"""
+    snapshot = snapshot.filter_traces(TRACEMALLOC_FILTERS)
+    stats = snapshot.statistics(group_by)
+    summary = {
+        "group_by": group_by,
+        "total_bytes": sum(stat.size for stat in stats),
+        "top": [
+            {"location": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+            for stat in stats[:top]
+        ],
+    }
+    if previous is not None:
+        differences = snapshot.compare_to(previous.filter_traces(TRACEMALLOC_FILTERS), group_by)
+        summary["growth"] = [
+            {
+                "location": str(stat.traceback),
+                "size_diff_bytes": stat.size_diff,
+                "count_diff": stat.count_diff,
+                "size_bytes": stat.size,
+            }
+            for stat in differences[:top]
+        ]
+    return summary
+
+
+# ============================================================================
+# EJECUTOR DE INFERENCIA CON CONTROL DE ADMISIÓN
+# ============================================================================
+
+
+class OverloadedError(Exception):
+    """La cola de inferencia está llena y la petición se rechaza"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Servidor sobrecargado, intenta de nuevo más tarde")
+        self.retry_after = retry_after
+
+
+# Carriles de prioridad, de mayor a menor
+LANE_INTERACTIVE = "interactive"
+LANE_BATCH = "batch"
+LANE_BACKGROUND = "background"
+LANES = (LANE_INTERACTIVE, LANE_BATCH, LANE_BACKGROUND)
+
+
+class InferenceLane:
+    """Cola de espera y métricas de un carril de prioridad"""
+
+    def __init__(self, name: str, max_concurrency: int, max_queue_size: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.queue = deque()
+        self.running = 0
+
+        # Métricas
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.wasted = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.total_run_time = 0.0
+        self.wasted_run_time = 0.0
+        self.max_latency = 0.0
+
+    def has_capacity(self) -> bool:
+        return self.running < self.max_concurrency and bool(self.queue)
+
+    def get_metrics(self) -> Dict:
+        finished = self.completed + self.failed
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue_size": self.max_queue_size,
+            "queue_depth": len(self.queue),
+            "running": self.running,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "wasted": self.wasted,
+            "wasted_run_time_ms": self.wasted_run_time * 1000,
+            "avg_wait_time_ms": (
+                self.total_wait_time / self.started * 1000 if self.started else 0.0
+            ),
+            "max_wait_time_ms": self.max_wait_time * 1000,
+            "avg_run_time_ms": (
+                self.total_run_time / finished * 1000 if finished else 0.0
+            ),
+            "max_latency_ms": self.max_latency * 1000,
+        }
+
+
+class InferenceExecutor:
+    """Ejecutor dedicado para la inferencia con un número fijo de hilos y una
+    cola de espera acotada por carril de prioridad. Cada hilo libre atiende
+    primero el carril interactivo, luego los bloques de lotes y por último el
+    trabajo en segundo plano, respetando el límite de concurrencia de cada
+    carril. Cuando la cola de un carril está llena rechaza el trabajo de
+    inmediato en lugar de acumular latencia"""
+
+    def __init__(self, max_workers: int, lanes: List[InferenceLane]):
+        self.max_workers = max_workers
+        self.lanes = {lane.name: lane for lane in lanes}
+        # El pool se crea al primer uso, también tras un `shutdown`
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._running = 0
+
+    async def submit(self, func: Callable, *args, lane: str = LANE_INTERACTIVE):
+        """Encola una llamada bloqueante en un carril y espera su resultado"""
+        target = self.lanes[lane]
+        if len(target.queue) >= target.max_queue_size:
+            target.rejected += 1
+            raise OverloadedError(self.retry_after(lane))
+
+        future = asyncio.get_running_loop().create_future()
+        # El contexto (con la traza de la petición) se ejecuta en el hilo
+        context = copy_context()
+        target.queue.append((future, func, args, context, time.perf_counter()))
+        target.submitted += 1
+        self._dispatch()
+        return await future
+
+    def _next_lane(self):
+        for lane in self.lanes.values():
+            if lane.has_capacity():
+                return lane
+        return None
+
+    def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while self._running < self.max_workers:
+            lane = self._next_lane()
+            if lane is None:
+                return
+
+            future, func, args, context, enqueued_at = lane.queue.popleft()
+            if future.cancelled():
+                lane.cancelled += 1
+                continue
+
+            lane.started += 1
+            started_at = time.perf_counter()
+            wait_time = started_at - enqueued_at
+            lane.total_wait_time += wait_time
+            lane.max_wait_time = max(lane.max_wait_time, wait_time)
+            trace = context.get(current_trace)
+            if trace is not None:
+                trace.add_stages({"queue": wait_time})
+
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="inference"
+                )
+            self._running += 1
+            lane.running += 1
+            work = loop.run_in_executor(self._pool, context.run, func, *args)
+            work.add_done_callback(
+                functools.partial(
+                    self._on_done,
+                    lane=lane,
+                    future=future,
+                    enqueued_at=enqueued_at,
+                    started_at=started_at,
+                )
+            )
+
+    def _on_done(
+        self,
+        done: asyncio.Future,
+        lane: InferenceLane,
+        future: asyncio.Future,
+        enqueued_at: float,
+        started_at: float,
+    ):
+        finished_at = time.perf_counter()
+        self._running -= 1
+        lane.running -= 1
+        lane.total_run_time += finished_at - started_at
+        lane.max_latency = max(lane.max_latency, finished_at - enqueued_at)
+        if future.cancelled():
+            # El solicitante se canceló mientras el trabajo ya se ejecutaba
+            lane.wasted += 1
+            lane.wasted_run_time += finished_at - started_at
+        if done.cancelled():
+            # El pool canceló el trabajo antes de ejecutarlo (shutdown con
+            # cancel_futures): el solicitante no debe quedarse esperando
+            lane.cancelled += 1
+            if not future.done():
+                future.cancel()
+        elif done.exception() is not None:
+            lane.failed += 1
+            if not future.done():
+                future.set_exception(done.exception())
+        else:
+            lane.completed += 1
+            if not future.done():
+                future.set_result(done.result())
+        self._dispatch()
+
+    def retry_after(self, lane: str = LANE_INTERACTIVE) -> int:
+        """Segundos estimados hasta que la cola del carril tenga hueco"""
+        target = self.lanes[lane]
+        finished = target.completed + target.failed
+        avg_run_time = target.total_run_time / finished if finished else 0.1
+        backlog = len(target.queue) + target.running
+        return max(1, math.ceil(backlog * avg_run_time / target.max_concurrency))
+
+    def queue_depth(self) -> int:
+        return sum(len(lane.queue) for lane in self.lanes.values())
+
+    def get_metrics(self) -> Dict:
+        return {
+            "workers": self.max_workers,
+            "running": self._running,
+            "queue_depth": self.queue_depth(),
+            "rejected": sum(lane.rejected for lane in self.lanes.values()),
+            "lanes": {name: lane.get_metrics() for name, lane in self.lanes.items()},
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# ============================================================================
+# COALESCENCIA DE PREDICCIONES EN CURSO (SINGLEFLIGHT)
+# ============================================================================
+
+
+class _InFlightCall:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Agrupa llamadas idénticas concurrentes: mientras una predicción para la
+    misma clave está en curso, los siguientes solicitantes esperan su resultado
+    en lugar de lanzar otra ejecución"""
+
+    def __init__(self):
+        self._in_flight: Dict[Tuple, _InFlightCall] = {}
+        self.total_requests = 0
+        self.deduplicated = 0
+        self.batch_statements = 0
+        self.batch_duplicates = 0
+
+    async def run(self, key: Tuple, coro_factory: Callable[[], Awaitable[Dict]]) -> Dict:
+        self.total_requests += 1
+        call = self._in_flight.get(key)
+        if call is None:
+            call = _InFlightCall(asyncio.ensure_future(coro_factory()))
+            self._in_flight[key] = call
+            call.task.add_done_callback(lambda _task: self._forget(key, call))
+        else:
+            self.deduplicated += 1
+
+        call.waiters += 1
+        try:
+            result = await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            # Si ya nadie espera el resultado, no tiene sentido seguir
+            # calculándolo. Se olvida la clave antes de cancelar para que una
+            # petición idéntica que llegue ahora no se una a la tarea cancelada
+            if call.waiters == 0 and not call.task.done():
+                self._forget(key, call)
+                call.task.cancel()
+
+        # Cada solicitante recibe su propia copia para que pueda modificarla
+        return dict(result)
+
+    def record_batch(self, total: int, duplicates: int):
+        """Registra un lote deduplicado por clave canónica antes de puntuarlo.
+        Se cuenta aparte de la coalescencia entre peticiones concurrentes"""
+        self.batch_statements += total
+        self.batch_duplicates += duplicates
+
+    def _forget(self, key: Tuple, call: _InFlightCall):
+        if self._in_flight.get(key) is call:
+            del self._in_flight[key]
+
+    def get_metrics(self) -> Dict:
+        return {
+            "requests": self.total_requests,
+            "deduplicated": self.deduplicated,
+            "dedup_ratio": (
+                self.deduplicated / self.total_requests if self.total_requests else 0.0
+            ),
+            "in_flight": len(self._in_flight),
+            "batch_statements": self.batch_statements,
+            "batch_duplicates": self.batch_duplicates,
+            "batch_dedup_ratio": (
+                self.batch_duplicates / self.batch_statements if self.batch_statements else 0.0
+            ),
+        }
+
+
+# ============================================================================
+# ANÁLISIS INCREMENTAL DE NDJSON / CSV
+# ============================================================================
+
+
+class StatementStreamParser:
+    """Analiza incrementalmente un cuerpo NDJSON o CSV con las mismas columnas
+    que super_dataset.csv sin la etiqueta (statement, category, source). Solo
+    guarda en memoria la línea o el registro CSV que aún está incompleto"""
+
+    FORMATS = ("ndjson", "csv")
+    COLUMNS = ("statement", "category", "source")
+    MAX_RECORD_BYTES = 1024 * 1024
+
+    def __init__(self, fmt: str = "ndjson"):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Formato no soportado: {fmt}. Usa: {', '.join(self.FORMATS)}")
+        self.format = fmt
+        self.records_parsed = 0
+        self._buffer = b""
+        self._pending_csv = ""
+        self._header = None
+
+    def feed(self, data: bytes) -> List[Dict]:
+        """Añade bytes del cuerpo y devuelve los registros completos"""
+        *lines, self._buffer = (self._buffer + data).split(b"\n")
+        if len(self._buffer) + len(self._pending_csv) > self.MAX_RECORD_BYTES:
+            raise ValueError("Registro demasiado grande o sin salto de línea")
+        return self._parse_lines(lines)
+
+    def close(self) -> List[Dict]:
+        """Procesa lo que quede en el búfer al terminar el cuerpo"""
+        lines = [self._buffer] if self._buffer else []
+        self._buffer = b""
+        records = self._parse_lines(lines)
+        if self._pending_csv:
+            raise ValueError("El CSV termina con un campo entre comillas sin cerrar")
+        return records
+
+    def _parse_lines(self, lines: List[bytes]) -> List[Dict]:
+        records = []
+        for raw_line in lines:
+            line = raw_line.decode("utf-8").rstrip("\r")
+            if self.format == "ndjson":
+                record = self._parse_ndjson(line)
+            else:
+                record = self._parse_csv(line)
+            if record is not None:
+                self.records_parsed += 1
+                records.append(record)
+        return records
+
+    def _parse_ndjson(self, line: str) -> Optional[Dict]:
+        if not line.strip():
+            return None
+        value = json.loads(line)
+        if isinstance(value, str):
+            value = {"statement": value}
+        if not isinstance(value, dict) or not isinstance(value.get("statement"), str):
+            raise ValueError(
+                f"Línea NDJSON {self.records_parsed + 1} sin campo 'statement' de texto"
+            )
+        return {column: value[column] for column in self.COLUMNS if column in value}
+
+    def _parse_csv(self, line: str) -> Optional[Dict]:
+        # Un registro CSV continúa en la siguiente línea mientras tenga un
+        # número impar de comillas (campo entre comillas con saltos de línea)
+        record = f"{self._pending_csv}\n{line}" if self._pending_csv else line
+        if record.count('"') % 2:
+            self._pending_csv = record
+            return None
+        self._pending_csv = ""
+        if not record.strip():
+            return None
+
+        fields = next(csv.reader([record]))
+        if self._header is None:
+            if "statement" not in fields:
+                raise ValueError("La cabecera CSV debe incluir la columna 'statement'")
+            self._header = fields
+            return None
+        row = dict(zip(self._header, fields))
+        return {column: row[column] for column in self.COLUMNS if column in row}
+
+
+# ============================================================================
+# TRABAJOS DE PREDICCIÓN MASIVA EN DISCO
+# ============================================================================
+
+
+class BulkJobManager:
+    """Trabajos de predicción masiva que se procesan en segundo plano por
+    bloques y escriben sus resultados en disco a medida que avanzan.
+
+    Cada trabajo vive en su propio directorio con `input.jsonl` (registros de
+    entrada), `results.jsonl` (una línea por afirmación) y `job.json` (estado).
+    El estado guarda los desplazamientos de entrada y de resultados del último
+    bloque completado, de modo que tras un reinicio el trabajo continúa desde
+    ahí descartando cualquier bloque escrito a medias.
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
+    Las escrituras en disco se hacen en hilos que la cancelación de la tarea no
+    detiene, así que cada trabajo tiene un candado que `delete` adquiere antes
+    de borrar el directorio. Las escrituras toman ese candado y no hacen nada
+    si el trabajo ya no está registrado"""
+
+    RESUMABLE_STATUSES = ("queued", "running")
+
+    def __init__(self, directory: str, chunk_size: int, max_concurrent_jobs: int):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.jobs: Dict[str, Dict] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._write_locks: Dict[str, threading.RLock] = {}
+        self._slots = None
+
+    def _path(self, job_id: str, name: str = "") -> str:
+        return os.path.join(self.directory, job_id, name)
+
+    def _register(self, job: Dict):
+        self._write_locks[job["id"]] = threading.RLock()
+        self.jobs[job["id"]] = job
+
+    @contextmanager
+    def _writing(self, job: Dict):
+        """Candado de escritura del trabajo; produce False si ya se borró"""
+        lock = self._write_locks.get(job["id"])
+        if lock is None:
+            yield False
+            return
+        with lock:
+            yield self.jobs.get(job["id"]) is job
+
+    def _save(self, job: Dict):
+        with self._writing(job) as registered:
+            if not registered:
+                return
+            job["updated_at"] = time.time()
+            temporary = self._path(job["id"], "job.json.tmp")
+            with open(temporary, "w", encoding="utf-8") as f:
+                json.dump(job, f, ensure_ascii=False)
+            os.replace(temporary, self._path(job["id"], "job.json"))
+
+    async def create(self, record_batches: AsyncIterator[List[Dict]]) -> Dict:
+        """Crea un trabajo volcando los registros de entrada a disco"""
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._path(job_id))
+        total = 0
+        try:
+            with open(self._path(job_id, "input.jsonl"), "w", encoding="utf-8") as f:
+                async for records in record_batches:
+                    lines = "".join(
+                        json.dumps(record, ensure_ascii=False) + "\n" for record in records
+                    )
+                    await asyncio.to_thread(f.write, lines)
+                    total += len(records)
+        except BaseException:
+            shutil.rmtree(self._path(job_id), ignore_errors=True)
+            raise
+        open(self._path(job_id, "results.jsonl"), "w").close()
+
+        now = time.time()
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "total": total,
+            "processed": 0,
+            "input_offset": 0,
+            "results_bytes": 0,
+            "model_version": truth_detector.model_version,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self._register(job)
+        self._save(job)
+        self._start(job)
+        return job
+
+    async def resume(self):
+        """Recupera los trabajos del directorio y reanuda los pendientes"""
+        if not os.path.isdir(self.directory):
+            return
+        for job_id in sorted(os.listdir(self.directory)):
             try:
-                await connection.send_text(message)
-            except:
-                # Remover conexiones muertas
-                self.active_connections.remove(connection)
+                with open(self._path(job_id, "job.json"), encoding="utf-8") as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                continue
+            self._register(job)
+            if job["status"] in self.RESUMABLE_STATUSES:
+                # Descartar resultados de un bloque que no llegó a confirmarse
+                with open(self._path(job_id, "results.jsonl"), "ab") as f:
+                    f.truncate(job["results_bytes"])
+                logger.info(
+                    f"🔁 Reanudando trabajo {job_id}: {job['processed']}/{job['total']}"
+                )
+                self._start(job)
+
+    def _start(self, job: Dict):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent_jobs)
+        self._tasks[job["id"]] = asyncio.create_task(self._run(job))
+
+    async def _run(self, job: Dict):
+        async with self._slots:
+            job["status"] = "running"
+            if job["model_version"] != truth_detector.model_version:
+                logger.warning(
+                    f"El trabajo {job['id']} se creó con el modelo {job['model_version']} "
+                    f"y continúa con {truth_detector.model_version}"
+                )
+            await asyncio.to_thread(self._save, job)
+            try:
+                while job["processed"] < job["total"]:
+                    records, next_offset = await asyncio.to_thread(self._read_chunk, job)
+                    try:
+                        predictions = await inference_executor.submit(
+                            truth_detector.predict_batch,
+                            [record["statement"] for record in records],
+                            lane=LANE_BACKGROUND,
+                        )
+                    except OverloadedError as e:
+                        await asyncio.sleep(e.retry_after)
+                        continue
+                    await asyncio.to_thread(
+                        self._commit_chunk, job, records, predictions, next_offset
+                    )
+                job["status"] = "completed"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en el trabajo {job['id']}: {e}")
+                job["status"] = "failed"
+                job["error"] = str(e)
+            finally:
+                self._tasks.pop(job["id"], None)
+            await asyncio.to_thread(self._save, job)
+            logger.info(f"📦 Trabajo {job['id']} {job['status']}")
+
+    def _read_chunk(self, job: Dict) -> Tuple[List[Dict], int]:
+        records = []
+        with open(self._path(job["id"], "input.jsonl"), "rb") as f:
+            f.seek(job["input_offset"])
+            while len(records) < self.chunk_size:
+                line = f.readline()
+                if not line:
+                    break
+                records.append(json.loads(line))
+            return records, f.tell()
+
+    def _commit_chunk(self, job: Dict, records: List[Dict], predictions: List[Dict], next_offset: int):
+        with self._writing(job) as registered:
+            if not registered:
+                return
+            with open(self._path(job["id"], "results.jsonl"), "a", encoding="utf-8") as f:
+                for index, (record, result) in enumerate(zip(records, predictions), job["processed"]):
+                    f.write(
+                        json.dumps({"index": index, **record, "result": result}, ensure_ascii=False)
+                        + "\n"
+                    )
+                f.flush()
+                os.fsync(f.fileno())
+                results_bytes = f.tell()
+            job["processed"] += len(records)
+            job["input_offset"] = next_offset
+            job["results_bytes"] = results_bytes
+            self._save(job)
+
+    def describe(self, job: Dict) -> Dict:
+        """Vista pública del estado de un trabajo"""
+        return {
+            "job_id": job["id"],
+            "status": job["status"],
+            "total": job["total"],
+            "processed": job["processed"],
+            "progress": job["processed"] / job["total"] if job["total"] else 1.0,
+            "model_version": job["model_version"],
+            "error": job["error"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+            "results_url": f"/jobs/{job['id']}/results",
+        }
+
+    def iter_results(self, job: Dict, block_size: int = 65536):
+        """Lee los resultados confirmados hasta el momento"""
+        remaining = job["results_bytes"]
+        with open(self._path(job["id"], "results.jsonl"), "rb") as f:
+            while remaining > 0:
+                block = f.read(min(block_size, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+
+    def _remove(self, job_id: str):
+        # Las escrituras que lleguen después ya no encuentran el candado; se
+        # espera a que termine la que esté en curso antes de borrar
+        lock = self._write_locks.pop(job_id, None)
+        if lock is None:
+            return
+        with lock:
+            shutil.rmtree(self._path(job_id), ignore_errors=True)
+
+    async def delete(self, job_id: str):
+        self.jobs.pop(job_id, None)
+        task = self._tasks.pop(job_id, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await asyncio.to_thread(self._remove, job_id)
+
+    async def shutdown(self):
+        """Detiene los trabajos en curso; se reanudarán en el próximo arranque"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
 # ============================================================================
@@ -473,45 +2744,565 @@ async def lifespan(app: FastAPI):
         )
         logger.info(f"🏷️ Categorías: {', '.join(stats['categories'])}")
 
-    if not truth_detector.load_model():
-        logger.info("🔄 Entrenando nuevo modelo con dataset masivo...")
-        # Usar asyncio.to_thread para entrenar en un hilo separado
-        await asyncio.to_thread(truth_detector.train)
-    else:
-        logger.info("✅ Modelo pre-entrenado cargado exitosamente!")
+    if not truth_detector.load_model():
+        logger.info("🔄 Entrenando nuevo modelo con dataset masivo...")
+        # Usar asyncio.to_thread para entrenar en un hilo separado
+        await asyncio.to_thread(truth_detector.train)
+    else:
+        logger.info("✅ Modelo pre-entrenado cargado exitosamente!")
+
+    await job_manager.resume()
+    statistics_publisher.start()
+    if WATCHDOG_INTERVAL > 0:
+        loop_watchdog.start()
+    if traffic_capture is not None:
+        traffic_capture.start()
+
+    logger.info("🚀 API lista para recibir solicitudes!")
+
+    yield
+
+    # Shutdown (opcional)
+    logger.info("🛑 Cerrando servidor...")
+    await statistics_publisher.stop()
+    await loop_watchdog.stop()
+    if traffic_capture is not None:
+        traffic_capture.stop()
+    await job_manager.shutdown()
+    inference_executor.shutdown()
+    if span_exporter is not None:
+        span_exporter.close()
+
+
+# ============================================================================
+# APLICACIÓN FASTAPI
+# ============================================================================
+
+# Inicializar FastAPI con lifespan
+app = FastAPI(
+    title="Truth Detector API - Completo",
+    description="API completa para detectar verdad/falsedad usando IA con WebSocket",
+    version="3.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
+)
+
+# Captura opcional del tráfico de predicción (el primer middleware añadido es
+# el interior: ve las respuestas antes de comprimirlas)
+traffic_capture = (
+    TrafficCapture(TRAFFIC_CAPTURE_FILE, CAPTURE_FLUSH_INTERVAL, CAPTURE_MAX_PENDING_BYTES)
+    if TRAFFIC_CAPTURE_FILE else None
+)
+if traffic_capture is not None:
+    app.add_middleware(CaptureMiddleware, capture=traffic_capture)
+
+# Configurar CORS para React
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # En producción, especifica tu dominio de React
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Comprimir las respuestas grandes (lotes, resultados de trabajos, streaming)
+if HTTP_COMPRESSION_LEVEL > 0:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=HTTP_COMPRESSION_MIN_SIZE,
+        compresslevel=HTTP_COMPRESSION_LEVEL,
+    )
+
+# Inicializar el detector de verdad y el manager de conexiones
+truth_detector = TruthDetector()
+manager = ConnectionManager(WS_SEND_QUEUE_SIZE, WS_SLOW_CONSUMER_POLICY)
+inflight_predictions = SingleFlight()
+inference_executor = InferenceExecutor(
+    INFERENCE_WORKERS,
+    [
+        InferenceLane(LANE_INTERACTIVE, INTERACTIVE_CONCURRENCY, INFERENCE_QUEUE_SIZE),
+        InferenceLane(LANE_BATCH, BATCH_CONCURRENCY, INFERENCE_QUEUE_SIZE),
+        InferenceLane(LANE_BACKGROUND, BACKGROUND_CONCURRENCY, INFERENCE_QUEUE_SIZE),
+    ],
+)
+job_manager = BulkJobManager(JOBS_DIR, JOB_CHUNK_SIZE, MAX_CONCURRENT_JOBS)
+
+# Métricas exportadas en /metrics
+metrics = MetricsRegistry()
+http_requests_total = metrics.counter(
+    "truth_detector_http_requests_total",
+    "Peticiones HTTP por endpoint y código de estado",
+    ("method", "path", "status"),
+)
+http_request_duration = metrics.histogram(
+    "truth_detector_http_request_duration_seconds",
+    "Latencia de las peticiones HTTP por endpoint",
+    ("method", "path"),
+)
+ws_messages_total = metrics.counter(
+    "truth_detector_ws_messages_total", "Mensajes WebSocket procesados por tipo", ("type",)
+)
+ws_message_duration = metrics.histogram(
+    "truth_detector_ws_message_duration_seconds",
+    "Tiempo de procesamiento de los mensajes WebSocket por tipo",
+    ("type",),
+)
+predict_stage_duration = metrics.histogram(
+    "truth_detector_predict_stage_seconds",
+    "Duración de cada etapa de la predicción de un bloque",
+    ("stage",),
+    STAGE_BUCKETS,
+)
+slow_requests_total = metrics.counter(
+    "truth_detector_slow_requests_total",
+    f"Peticiones de predicción por encima de SLOW_REQUEST_MS ({SLOW_REQUEST_MS:g} ms)",
+    ("name",),
+)
+span_exporter = SpanExporter(TRACE_EXPORT_FILE) if TRACE_EXPORT_FILE else None
+event_loop_lag = metrics.histogram(
+    "truth_detector_event_loop_lag_seconds",
+    "Retraso del bucle de eventos al despertar una tarea programada",
+)
+event_loop_stalls_total = metrics.counter(
+    "truth_detector_event_loop_stalls_total",
+    f"Bloqueos del bucle de eventos de más de LOOP_LAG_THRESHOLD_MS ({LOOP_LAG_THRESHOLD_MS:g} ms)",
+)
+loop_watchdog = LoopWatchdog(
+    WATCHDOG_INTERVAL, LOOP_LAG_THRESHOLD_MS / 1000, event_loop_lag, event_loop_stalls_total
+)
+
+
+def observe_predict_stages(stages: Dict[str, float]):
+    """Registra las etapas de un bloque en /metrics y en la traza en curso"""
+    predict_stage_duration.observe_many(stages)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_stages(stages)
+
+
+truth_detector.stage_observer = observe_predict_stages
+
+metrics.gauge(
+    "truth_detector_ws_connections",
+    "Conexiones WebSocket activas",
+    lambda: len(manager.active_connections),
+)
+metrics.gauge(
+    "truth_detector_ws_send_queue_depth",
+    "Mensajes pendientes de envío en todas las conexiones WebSocket",
+    lambda: sum(connection.queue.qsize() for connection in manager.active_connections.values()),
+)
+metrics.gauge(
+    "truth_detector_inference_queue_depth",
+    "Trabajos en espera en cada carril del ejecutor de inferencia",
+    lambda: {name: len(lane.queue) for name, lane in inference_executor.lanes.items()},
+    ("lane",),
+)
+metrics.gauge(
+    "truth_detector_inference_running",
+    "Trabajos en ejecución en cada carril del ejecutor de inferencia",
+    lambda: {name: lane.running for name, lane in inference_executor.lanes.items()},
+    ("lane",),
+)
+metrics.gauge(
+    "truth_detector_inference_utilization",
+    "Fracción de hilos de inferencia ocupados",
+    lambda: inference_executor._running / inference_executor.max_workers,
+)
+metrics.gauge(
+    "truth_detector_default_executor_wait_seconds",
+    "Espera de una tarea trivial en el ejecutor por defecto del bucle",
+    lambda: loop_watchdog.pending_probe_wait(),
+)
+metrics.gauge(
+    "truth_detector_model_statements",
+    "Afirmaciones de entrenamiento del modelo",
+    lambda: truth_detector.total_statements,
+)
+metrics.gauge(
+    "truth_detector_model_vocabulary_size",
+    "Términos del vocabulario TF-IDF",
+    lambda: truth_detector.get_size()["vocabulary_size"],
+)
+metrics.gauge(
+    "truth_detector_model_index_bytes",
+    "Bytes en memoria de las matrices de embeddings del índice",
+    lambda: truth_detector.get_size()["index_bytes"],
+)
+
+# Medir todas las peticiones HTTP (el último middleware añadido es el exterior)
+app.add_middleware(
+    MetricsMiddleware,
+    requests_total=http_requests_total,
+    duration=http_request_duration,
+)
+
+# ============================================================================
+# INFERENCIA ASÍNCRONA
+# ============================================================================
+
+
+def request_deadline(deadline_ms) -> Optional[float]:
+    """Convierte un presupuesto en milisegundos en un instante de `time.monotonic()`"""
+    if deadline_ms is None:
+        return None
+    valid = isinstance(deadline_ms, (int, float)) and not isinstance(deadline_ms, bool)
+    if not valid or deadline_ms <= 0:
+        raise ValueError("deadline_ms debe ser un número positivo")
+    return time.monotonic() + deadline_ms / 1000
+
+
+def finish_trace(trace: RequestTrace):
+    """Exporta los spans de la petición y la registra si fue lenta"""
+    timings = trace.timings_ns()
+    if span_exporter is not None:
+        span_exporter.export(trace.to_spans(timings["total"], truth_detector.model_version))
+    if SLOW_REQUEST_MS > 0 and timings["total"] >= SLOW_REQUEST_MS * 1e6:
+        slow_requests_total.inc(trace.name)
+        record = {
+            "trace_id": trace.trace_id,
+            "name": trace.name,
+            "statement": trace.statement[:200],
+            "total_statements": trace.size,
+            "timings_ns": timings,
+            "model_version": truth_detector.model_version,
+        }
+        logger.warning(
+            f"🐢 Petición lenta ({timings['total'] / 1e6:.1f} ms): {dumps_json(record).decode('utf-8')}"
+        )
+
+
+@contextmanager
+def traced_request(name: str, statement: str, size: int = 1, debug: bool = False):
+    """Activa una traza para la petición mientras dura el bloque `with`"""
+    trace = RequestTrace(name, statement, size, debug, record_spans=span_exporter is not None)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+        finish_trace(trace)
+
+
+async def predict_async(
+    statement: str,
+    deadline: Optional[float] = None,
+    fields: Optional[frozenset] = None,
+) -> Dict:
+    """Predice en un hilo aparte, compartiendo la ejecución con peticiones
+    idénticas (misma versión del modelo y mismos campos) que ya estén en
+    curso. Las peticiones con plazo no se comparten porque su resultado puede
+    ser parcial, ni las que piden `debug_timings`, que miden su propia
+    ejecución"""
+    trace = current_trace.get()
+    if deadline is not None or (trace is not None and trace.debug):
+        return await inference_executor.submit(
+            truth_detector.predict, statement, deadline, fields
+        )
+
+    key = (truth_detector.model_version, truth_detector.canonical_key(statement), fields)
+    return await inflight_predictions.run(
+        key,
+        lambda: inference_executor.submit(truth_detector.predict, statement, None, fields),
+    )
+
+
+def _dedupe(statements: List[str]) -> Tuple[Dict[str, str], List[str]]:
+    """Afirmaciones distintas por clave canónica (en orden de aparición) y la
+    clave de cada afirmación de entrada. Registra los duplicados encontrados"""
+    unique: Dict[str, str] = {}
+    keys = []
+    for statement in statements:
+        key = truth_detector.canonical_key(statement)
+        unique.setdefault(key, statement)
+        keys.append(key)
+    inflight_predictions.record_batch(len(statements), len(statements) - len(unique))
+    return unique, keys
+
+
+async def predict_chunk_async(
+    statements: List[str],
+    lane: str = LANE_BATCH,
+    deadline: Optional[float] = None,
+    fields: Optional[frozenset] = None,
+    already_unique: bool = False,
+) -> List[Dict]:
+    """Puntúa un bloque en una sola ejecución del ejecutor, calculando una
+    sola vez cada afirmación distinta del bloque. Con `already_unique` el
+    bloque ya viene deduplicado y se puntúa tal cual"""
+    if already_unique:
+        return await inference_executor.submit(
+            truth_detector.predict_batch, statements, deadline, fields, lane=lane
+        )
+
+    unique, keys = _dedupe(statements)
+    predictions = await inference_executor.submit(
+        truth_detector.predict_batch, list(unique.values()), deadline, fields, lane=lane
+    )
+    results = dict(zip(unique, predictions))
+    return [dict(results[key]) for key in keys]
+
+
+async def iter_prediction_chunks(
+    statements: List[str],
+    lane: str = LANE_BATCH,
+    deadline: Optional[float] = None,
+    fields: Optional[frozenset] = None,
+    already_unique: bool = False,
+) -> AsyncIterator[Tuple[int, List[Optional[Dict]]]]:
+    """Recorre un lote en bloques de BATCH_CHUNK_SIZE y produce
+    (posición inicial, resultados) a medida que se puntúa cada bloque. Los
+    bloques se encolan uno tras otro, de modo que las predicciones
+    interactivas pueden adelantarse entre bloque y bloque.
+
+    Con plazo, los bloques que no llegan a empezar antes de que venza quedan
+    sin resultado (None). `already_unique` evita volver a deduplicar cada
+    bloque cuando el lote ya no tiene repetidas"""
+    for start in range(0, len(statements), BATCH_CHUNK_SIZE):
+        chunk = statements[start : start + BATCH_CHUNK_SIZE]
+        if deadline is not None and time.monotonic() >= deadline:
+            yield start, [None] * len(chunk)
+        else:
+            yield start, await predict_chunk_async(chunk, lane, deadline, fields, already_unique)
+
+
+async def traced_prediction_chunks(
+    statements: List[str],
+    chunks: AsyncIterator[Tuple[int, List[Optional[Dict]]]],
+    name: str,
+) -> AsyncIterator[Tuple[int, List[Optional[Dict]], Dict[str, int]]]:
+    """Puntúa cada bloque de `iter_prediction_chunks` bajo su propia traza y
+    añade a cada bloque su desglose de tiempos (timings_ns)"""
+    for start in range(0, len(statements), BATCH_CHUNK_SIZE):
+        size = min(BATCH_CHUNK_SIZE, len(statements) - start)
+        with traced_request(name, statements[start], size, debug=True) as trace:
+            start, predictions = await chunks.__anext__()
+        yield start, predictions, trace.timings_ns()
+
+
+async def predict_many_async(
+    statements: List[str],
+    lane: str = LANE_BATCH,
+    deadline: Optional[float] = None,
+    fields: Optional[frozenset] = None,
+) -> List[Optional[Dict]]:
+    """Predice un lote calculando una sola vez cada afirmación distinta"""
+    unique, keys = _dedupe(statements)
+
+    pending = list(unique)
+    results = {}
+    async for start, predictions in iter_prediction_chunks(
+        list(unique.values()), lane, deadline, fields, already_unique=True
+    ):
+        for key, result in zip(pending[start:], predictions):
+            if result is not None:
+                results[key] = result
+
+    return [dict(results[key]) if key in results else None for key in keys]
+
+
+def batch_results_payload(
+    statements: List[str], predictions: List[Optional[Dict]], lean: bool = False
+) -> Dict:
+    """Resultados de un lote y afirmaciones que vencieron su plazo. En modo
+    reducido los resultados van alineados con la entrada (null si venció) y
+    sin repetir cada afirmación"""
+    timed_out = [
+        {"index": index, "statement": statement}
+        for index, (statement, result) in enumerate(zip(statements, predictions))
+        if result is None
+    ]
+    if lean:
+        results = predictions
+    else:
+        results = [
+            {"statement": statement, "result": result}
+            for statement, result in zip(statements, predictions)
+            if result is not None
+        ]
+    return {
+        "results": results,
+        "completed_statements": len(statements) - len(timed_out),
+        "timed_out": timed_out,
+    }
+
+
+def get_runtime_metrics() -> Dict:
+    """Métricas de ejecución del servidor"""
+    return {
+        "singleflight": inflight_predictions.get_metrics(),
+        "executor": inference_executor.get_metrics(),
+        "websocket": manager.get_metrics(),
+        "publisher": statistics_publisher.get_metrics(),
+        "watchdog": loop_watchdog.get_metrics(),
+        "capture": traffic_capture.get_metrics() if traffic_capture is not None else None,
+    }
+
+
+def statistics_message() -> Dict:
+    """Mensaje WebSocket con las estadísticas del modelo y de ejecución"""
+    return {
+        "type": "statistics",
+        "model_statistics": truth_detector.get_statistics(),
+        "active_connections": len(manager.active_connections),
+        "runtime_metrics": get_runtime_metrics(),
+    }
+
+
+def model_update_message() -> Dict:
+    """Mensaje WebSocket con la versión actual del modelo"""
+    return {
+        "type": "model_update",
+        "model_version": truth_detector.model_version,
+        "model_status": "entrenado" if truth_detector.is_trained else "no entrenado",
+        "total_training_data": truth_detector.total_statements,
+    }
+
+
+def load_message() -> Dict:
+    """Mensaje WebSocket con la carga actual del servidor"""
+    return {
+        "type": "load",
+        "active_connections": len(manager.active_connections),
+        "inference_running": inference_executor._running,
+        "inference_queue_depth": {
+            name: len(lane.queue) for name, lane in inference_executor.lanes.items()
+        },
+        "in_flight_predictions": len(inflight_predictions._in_flight),
+    }
+
+
+statistics_publisher = StatisticsPublisher(
+    manager,
+    {"statistics": statistics_message, "model": model_update_message, "load": load_message},
+    STATS_PUSH_INTERVAL,
+    volatile={"statistics": ("runtime_metrics",)},
+)
+
+
+def overloaded_response(error: OverloadedError) -> JSONResponse:
+    """Respuesta HTTP 503 con Retry-After para peticiones rechazadas"""
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(error.retry_after)},
+        content={
+            "success": False,
+            "error": str(error),
+            "retry_after": error.retry_after,
+        },
+    )
+
+
+def overloaded_message(error: OverloadedError) -> Dict:
+    """Mensaje de error WebSocket para peticiones rechazadas"""
+    return {
+        "type": "error",
+        "code": "overloaded",
+        "message": str(error),
+        "retry_after": error.retry_after,
+    }
+
+
+def too_many_pending_message(request_id) -> Dict:
+    """Mensaje de error WebSocket cuando una conexión acumula más de
+    WS_MAX_PENDING mensajes esperando turno"""
+    response = {
+        "type": "error",
+        "code": "too_many_pending",
+        "message": f"Hay demasiados mensajes esperando turno (máximo {WS_MAX_PENDING})",
+    }
+    if request_id is not None:
+        response["id"] = request_id
+    return response
+
+
+def batch_too_large_response(size: int, limit: int) -> JSONResponse:
+    """Respuesta HTTP 413 para lotes que superan el tamaño máximo"""
+    return JSONResponse(
+        status_code=413,
+        content={
+            "success": False,
+            "error": f"El lote tiene {size} afirmaciones y el máximo es {limit}",
+            "max_batch_size": limit,
+            "streaming_endpoint": "/predict/batch/stream",
+        },
+    )
 
-    logger.info("🚀 API lista para recibir solicitudes!")
 
-    yield
+def model_info() -> Dict:
+    """Metadatos del modelo que se repiten en las respuestas"""
+    return {
+        "total_training_data": truth_detector.total_statements,
+        "model_status": "entrenado" if truth_detector.is_trained else "no entrenado",
+    }
 
-    # Shutdown (opcional)
-    logger.info("🛑 Cerrando servidor...")
 
+async def ndjson_prediction_stream(
+    statements: List[str],
+    chunks: AsyncIterator[Tuple],
+    lean: bool = False,
+) -> AsyncIterator[bytes]:
+    """Emite una línea NDJSON por afirmación en cuanto se puntúa su bloque y
+    una línea de resumen al final. Solo se mantiene en memoria un bloque. En
+    modo reducido las líneas de resultado no repiten la afirmación. Si los
+    bloques traen su desglose de tiempos (`traced_prediction_chunks`), se
+    emite tras cada bloque una línea `timings`"""
+    completed = 0
+    timed_out = 0
+    try:
+        async for start, predictions, *timings in chunks:
+            lines = []
+            for index, result in enumerate(predictions, start):
+                if result is None:
+                    timed_out += 1
+                    line = {"type": "timed_out", "index": index, "statement": statements[index]}
+                else:
+                    completed += 1
+                    if lean:
+                        line = {"type": "result", "index": index, "result": result}
+                    else:
+                        line = {
+                            "type": "result",
+                            "index": index,
+                            "statement": statements[index],
+                            "result": result,
+                        }
+                lines.append(dumps_json(line))
+            if timings:
+                lines.append(
+                    dumps_json(
+                        {
+                            "type": "timings",
+                            "index": start,
+                            "statements": len(predictions),
+                            "timings_ns": timings[0],
+                        }
+                    )
+                )
+            yield b"\n".join(lines) + b"\n"
+    except OverloadedError as e:
+        yield dumps_json(overloaded_message(e)) + b"\n"
+        return
+    except Exception as e:
+        logger.error(f"Error en predicción en streaming: {e}")
+        yield dumps_json({"type": "error", "message": str(e)}) + b"\n"
+        return
 
-# ============================================================================
-# APLICACIÓN FASTAPI
-# ============================================================================
+    summary = {
+        "type": "summary",
+        "total_statements": len(statements),
+        "completed_statements": completed,
+        "timed_out": timed_out,
+        "model_info": model_info(),
+    }
+    yield dumps_json(summary) + b"\n"
 
-# Inicializar FastAPI con lifespan
-app = FastAPI(
-    title="Truth Detector API - Completo",
-    description="API completa para detectar verdad/falsedad usando IA con WebSocket",
-    version="3.0.0",
-    lifespan=lifespan,
-)
 
-# Configurar CORS para React
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # En producción, especifica tu dominio de React
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+async def _prepend(first, rest: AsyncIterator) -> AsyncIterator:
+    yield first
+    async for item in rest:
+        yield item
 
-# Inicializar el detector de verdad y el manager de conexiones
-truth_detector = TruthDetector()
-manager = ConnectionManager()
 
 # ============================================================================
 # ENDPOINTS HTTP
@@ -535,7 +3326,11 @@ async def root():
             "websocket": "/ws",
             "http_predict": "/predict",
             "batch_predict": "/predict/batch",
+            "batch_predict_stream": "/predict/batch/stream",
+            "ingest": "/predict/ingest",
+            "jobs": "/jobs",
             "statistics": "/statistics",
+            "metrics": "/metrics",
             "health": "/health",
         },
     }
@@ -550,6 +3345,7 @@ async def health_check():
         "active_connections": len(manager.active_connections),
         "dataset_loaded": stats["total_statements"] > 0,
         "total_statements": stats["total_statements"],
+        "inference_queue_depth": inference_executor.queue_depth(),
     }
 
 
@@ -560,24 +3356,42 @@ async def get_statistics():
         "success": True,
         "model_statistics": truth_detector.get_statistics(),
         "active_connections": len(manager.active_connections),
+        "runtime_metrics": get_runtime_metrics(),
     }
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Métricas en el formato de texto de Prometheus"""
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
 @app.post("/predict")
 async def predict_statement(request: StatementRequest):
     """Endpoint HTTP para predecir si una afirmación es verdadera o falsa"""
     try:
-        result = await asyncio.to_thread(truth_detector.predict, request.statement)
+        fields = request.selected_fields()
+        with traced_request("predict", request.statement, debug=request.debug_timings) as trace:
+            result = await predict_async(
+                request.statement, request_deadline(request.deadline_ms), fields
+            )
 
-        return {
-            "success": True,
-            "statement": request.statement,
-            "result": result,
-            "model_info": {
-                "total_training_data": result.get("total_training_data", 0),
-                "model_status": result.get("model_status", "desconocido"),
-            },
-        }
+            response = {
+                "success": True,
+                "statement": request.statement,
+                "result": result,
+                "model_info": model_info(),
+            }
+            if fields is not None:
+                del response["statement"]
+            if request.debug_timings:
+                response["timings_ns"] = trace.timings_ns()
+            # Respuesta ya serializable: se evita el paso por jsonable_encoder
+            return FastJSONResponse(response)
+    except OverloadedError as e:
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"Error en predicción: {e}")
         return {"success": False, "error": str(e)}
@@ -586,40 +3400,656 @@ async def predict_statement(request: StatementRequest):
 @app.post("/predict/batch")
 async def predict_batch_statements(request: BatchRequest):
     """Endpoint HTTP para predecir múltiples afirmaciones en lote"""
+    if len(request.statements) > MAX_BATCH_SIZE:
+        return batch_too_large_response(len(request.statements), MAX_BATCH_SIZE)
+
     try:
-        results = []
-        for statement in request.statements:
-            result = await asyncio.to_thread(truth_detector.predict, statement)
-            results.append({"statement": statement, "result": result})
+        fields = request.selected_fields()
+        first = request.statements[0] if request.statements else ""
+        with traced_request(
+            "predict_batch", first, len(request.statements), request.debug_timings
+        ) as trace:
+            predictions = await predict_many_async(
+                request.statements,
+                deadline=request_deadline(request.deadline_ms),
+                fields=fields,
+            )
+            payload = batch_results_payload(
+                request.statements, predictions, lean=fields is not None
+            )
 
-        return {
-            "success": True,
-            "total_statements": len(request.statements),
-            "results": results,
-            "model_info": {
-                "total_training_data": (
-                    results[0]["result"].get("total_training_data", 0) if results else 0
-                ),
-                "model_status": (
-                    results[0]["result"].get("model_status", "desconocido")
-                    if results
-                    else "desconocido"
-                ),
-            },
-        }
+            response = {
+                "success": True,
+                "total_statements": len(request.statements),
+                "results": payload["results"],
+                "model_info": model_info(),
+            }
+            if request.deadline_ms is not None:
+                response["completed_statements"] = payload["completed_statements"]
+                response["timed_out"] = payload["timed_out"]
+            if request.debug_timings:
+                response["timings_ns"] = trace.timings_ns()
+            return FastJSONResponse(response)
+    except OverloadedError as e:
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"Error en predicción por lotes: {e}")
         return {"success": False, "error": str(e)}
 
 
+@app.post("/predict/batch/stream")
+async def predict_batch_stream(request: BatchRequest):
+    """Endpoint HTTP que devuelve los resultados del lote como NDJSON, una
+    línea por afirmación, a medida que se puntúa cada bloque. Con
+    `debug_timings` cada bloque va seguido de una línea con sus tiempos"""
+    if len(request.statements) > MAX_STREAM_BATCH_SIZE:
+        return batch_too_large_response(len(request.statements), MAX_STREAM_BATCH_SIZE)
+
+    fields = request.selected_fields()
+    chunks = iter_prediction_chunks(
+        request.statements,
+        deadline=request_deadline(request.deadline_ms),
+        fields=fields,
+    )
+    if request.debug_timings:
+        chunks = traced_prediction_chunks(request.statements, chunks, "predict_batch_stream")
+    # El primer bloque se puntúa antes de responder para poder devolver un 503
+    try:
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        first_chunk = None
+    except OverloadedError as e:
+        return overloaded_response(e)
+
+    if first_chunk is not None:
+        chunks = _prepend(first_chunk, chunks)
+    return StreamingResponse(
+        ndjson_prediction_stream(request.statements, chunks, lean=fields is not None),
+        media_type="application/x-ndjson",
+    )
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """StreamingResponse que no consume `receive()` mientras responde, para
+    que el cuerpo de la petición pueda seguir leyéndose durante el streaming.
+    La desconexión del cliente se detecta al leer el cuerpo"""
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+def ingest_format(request: Request, fmt: Optional[str]) -> str:
+    """Formato del cuerpo a partir del parámetro `format` o del Content-Type"""
+    if fmt:
+        return fmt.lower()
+    content_type = request.headers.get("content-type", "")
+    return "csv" if "csv" in content_type else "ndjson"
+
+
+async def ingest_prediction_stream(
+    body: AsyncIterator[bytes],
+    parser: StatementStreamParser,
+    fields: Optional[frozenset] = None,
+) -> AsyncIterator[bytes]:
+    """Lee el cuerpo por fragmentos, puntúa bloques de BATCH_CHUNK_SIZE
+    registros en cuanto se completan y emite sus resultados como NDJSON"""
+    index = 0
+    pending: List[Dict] = []
+
+    async def score(records: List[Dict]) -> bytes:
+        nonlocal index
+        predictions = await predict_chunk_async(
+            [record["statement"] for record in records], fields=fields
+        )
+        lines = []
+        for record, result in zip(records, predictions):
+            if fields is not None:
+                line = {"type": "result", "index": index, "result": result}
+            else:
+                line = {"type": "result", "index": index, **record, "result": result}
+            lines.append(dumps_json(line))
+            index += 1
+        return b"\n".join(lines) + b"\n"
+
+    try:
+        async for data in body:
+            pending.extend(parser.feed(data))
+            while len(pending) >= BATCH_CHUNK_SIZE:
+                records, pending = pending[:BATCH_CHUNK_SIZE], pending[BATCH_CHUNK_SIZE:]
+                yield await score(records)
+        pending.extend(parser.close())
+        if pending:
+            yield await score(pending)
+    except OverloadedError as e:
+        yield dumps_json(overloaded_message(e)) + b"\n"
+        return
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        # Cuerpo mal formado: la línea de error distingue el fallo de una
+        # subida truncada
+        logger.warning(f"Cuerpo no válido en la ingesta en streaming: {e}")
+        yield dumps_json({"type": "error", "message": str(e)}) + b"\n"
+        return
+    except Exception as e:
+        logger.error(f"Error en la ingesta en streaming: {e}")
+        yield dumps_json({"type": "error", "message": str(e)}) + b"\n"
+        return
+
+    summary = {
+        "type": "summary",
+        "total_statements": index,
+        "model_info": model_info(),
+    }
+    yield dumps_json(summary) + b"\n"
+
+
+@app.post("/predict/ingest")
+async def predict_ingest(
+    request: Request,
+    format: Optional[str] = Query(default=None),
+    fields: Optional[str] = Query(default=None, description="Campos separados por comas"),
+    verbose: bool = Query(default=True),
+):
+    """Endpoint HTTP que acepta un cuerpo NDJSON o CSV en streaming y devuelve
+    los resultados como NDJSON mientras sigue leyendo la subida. La memoria
+    usada depende del tamaño de bloque y no del tamaño de la subida"""
+    try:
+        parser = StatementStreamParser(ingest_format(request, format))
+        selected = resolve_fields(fields.split(",") if fields else None, verbose)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+
+    return DuplexStreamingResponse(
+        ingest_prediction_stream(request.stream(), parser, selected),
+        media_type="application/x-ndjson",
+    )
+
+
+# ============================================================================
+# TRABAJOS MASIVOS
+# ============================================================================
+
+
+async def json_record_batches(statements: List[str]) -> AsyncIterator[List[Dict]]:
+    yield [{"statement": statement} for statement in statements]
+
+
+async def parsed_record_batches(
+    body: AsyncIterator[bytes], parser: StatementStreamParser
+) -> AsyncIterator[List[Dict]]:
+    async for data in body:
+        records = parser.feed(data)
+        if records:
+            yield records
+    records = parser.close()
+    if records:
+        yield records
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: Request, format: Optional[str] = Query(default=None)):
+    """Crea un trabajo de predicción masiva a partir de un JSON
+    {"statements": [...]} o de un fichero NDJSON/CSV enviado como cuerpo"""
+    try:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            batch = BatchRequest(**(await request.json()))
+            records = json_record_batches(batch.statements)
+        else:
+            parser = StatementStreamParser(ingest_format(request, format))
+            records = parsed_record_batches(request.stream(), parser)
+        job = await job_manager.create(records)
+    except (ValueError, UnicodeDecodeError, TypeError) as e:
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+
+    return {"success": True, "job": job_manager.describe(job)}
+
+
+@app.get("/jobs")
+async def list_jobs():
+    return {
+        "success": True,
+        "jobs": [job_manager.describe(job) for job in job_manager.jobs.values()],
+    }
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"success": False, "error": "Trabajo no encontrado"})
+    return {"success": True, "job": job_manager.describe(job)}
+
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(job_id: str):
+    """Descarga los resultados confirmados (parciales si el trabajo sigue en curso)"""
+    job = job_manager.jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"success": False, "error": "Trabajo no encontrado"})
+    return StreamingResponse(
+        job_manager.iter_results(dict(job)),
+        media_type="application/x-ndjson",
+        headers={
+            "Content-Disposition": f'attachment; filename="{job_id}.jsonl"',
+            "X-Job-Status": job["status"],
+        },
+    )
+
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    if job_id not in job_manager.jobs:
+        return JSONResponse(status_code=404, content={"success": False, "error": "Trabajo no encontrado"})
+    await job_manager.delete(job_id)
+    return {"success": True, "job_id": job_id}
+
+
+# ============================================================================
+# ADMINISTRACIÓN Y DIAGNÓSTICO
+# ============================================================================
+
+profile_lock = asyncio.Lock()
+# Última captura de tracemalloc, para comparar con la siguiente
+last_memory_snapshot: Optional[tracemalloc.Snapshot] = None
+
+
+def admin_denied(request: Request) -> Optional[JSONResponse]:
+    """Respuesta de error si la petición no trae el X-Admin-Token correcto.
+    Sin ADMIN_TOKEN configurado los endpoints /admin no existen"""
+    if not ADMIN_TOKEN:
+        return JSONResponse(status_code=404, content={"success": False, "error": "Not Found"})
+    token = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        return JSONResponse(
+            status_code=403, content={"success": False, "error": "Token de administración no válido"}
+        )
+    return None
+
+
+@app.get("/admin/profile", include_in_schema=False)
+async def admin_profile(
+    request: Request,
+    seconds: float = Query(default=5.0, gt=0),
+    format: str = Query(default="json"),
+    top: int = Query(default=25, gt=0),
+    idle: bool = Query(default=False),
+):
+    """Perfil de CPU por muestreo de todos los hilos durante `seconds`
+    segundos, como resumen JSON o como pilas plegadas descargables. Con
+    `idle` se incluyen también los hilos en espera"""
+    denied = admin_denied(request)
+    if denied is not None:
+        return denied
+    if seconds > PROFILE_MAX_SECONDS:
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "error": f"seconds no puede superar {PROFILE_MAX_SECONDS:g}"},
+        )
+    if format not in ("json", "collapsed"):
+        return JSONResponse(
+            status_code=400, content={"success": False, "error": "format debe ser json o collapsed"}
+        )
+    if profile_lock.locked():
+        return JSONResponse(
+            status_code=409, content={"success": False, "error": "Ya hay un perfil en curso"}
+        )
+
+    async with profile_lock:
+        logger.info(f"🔬 Perfilando la CPU durante {seconds:g} s...")
+        sampler = StackSampler(PROFILE_SAMPLE_INTERVAL, include_idle=idle)
+        await asyncio.to_thread(sampler.run, seconds)
+
+    if format == "collapsed":
+        return PlainTextResponse(
+            sampler.collapsed(),
+            headers={"Content-Disposition": f'attachment; filename="profile-{int(time.time())}.folded"'},
+        )
+    return {"success": True, "profile": sampler.summary(top)}
+
+
+@app.post("/admin/memory/start", include_in_schema=False)
+async def admin_memory_start(request: Request, frames: int = Query(default=1, gt=0, le=100)):
+    """Activa tracemalloc (ralentiza las asignaciones mientras está activo)"""
+    denied = admin_denied(request)
+    if denied is not None:
+        return denied
+    global last_memory_snapshot
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        last_memory_snapshot = None
+        logger.info(f"🧠 tracemalloc activado ({frames} marcos por asignación)")
+    return {"success": True, "tracing": True, "frames": tracemalloc.get_traceback_limit()}
+
+
+@app.post("/admin/memory/stop", include_in_schema=False)
+async def admin_memory_stop(request: Request):
+    denied = admin_denied(request)
+    if denied is not None:
+        return denied
+    global last_memory_snapshot
+    tracemalloc.stop()
+    last_memory_snapshot = None
+    return {"success": True, "tracing": False}
+
+
+@app.get("/admin/memory", include_in_schema=False)
+async def admin_memory(
+    request: Request,
+    group_by: str = Query(default="lineno"),
+    top: int = Query(default=25, gt=0),
+    format: str = Query(default="json"),
+):
+    """Resumen de una captura de tracemalloc comparada con la anterior, o la
+    captura completa descargable (se abre con tracemalloc.Snapshot.load)"""
+    denied = admin_denied(request)
+    if denied is not None:
+        return denied
+    if not tracemalloc.is_tracing():
+        return JSONResponse(
+            status_code=409,
+            content={"success": False, "error": "tracemalloc no está activo: POST /admin/memory/start"},
+        )
+    if group_by not in ("lineno", "filename", "traceback") or format not in ("json", "snapshot"):
+        return JSONResponse(
+            status_code=400,
+            content={
+                "success": False,
+                "error": "group_by debe ser lineno, filename o traceback y format json o snapshot",
+            },
+        )
+
+    global last_memory_snapshot
+    snapshot = await asyncio.to_thread(tracemalloc.take_snapshot)
+    current, peak = tracemalloc.get_traced_memory()
+
+    if format == "snapshot":
+        path = os.path.join(tempfile.gettempdir(), f"memory-{uuid.uuid4().hex}.snapshot")
+        await asyncio.to_thread(snapshot.dump, path)
+        return FileResponse(
+            path,
+            filename=f"memory-{int(time.time())}.snapshot",
+            background=BackgroundTask(os.remove, path),
+        )
+
+    previous, last_memory_snapshot = last_memory_snapshot, snapshot
+    summary = await asyncio.to_thread(summarize_snapshot, snapshot, previous, group_by, top)
+    return {
+        "success": True,
+        "traced_bytes": current,
+        "traced_peak_bytes": peak,
+        "tracemalloc_overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+        "memory": summary,
+    }
+
+
+@app.get("/admin/sizes", include_in_schema=False)
+async def admin_sizes(request: Request):
+    """Bytes en memoria de cada estructura del detector"""
+    denied = admin_denied(request)
+    if denied is not None:
+        return denied
+    usage = await asyncio.to_thread(truth_detector.get_memory_usage)
+    return {
+        "success": True,
+        "model_version": truth_detector.model_version,
+        "total_bytes": sum(usage.values()),
+        "structures": dict(sorted(usage.items(), key=lambda item: -item[1])),
+    }
+
+
 # ============================================================================
 # WEBSOCKET
 # ============================================================================
 
 
+# Tipos de mensaje WebSocket que se distinguen en las métricas
+WS_MESSAGE_TYPES = frozenset(
+    ["predict", "predict_batch", "get_statistics", "ping", "subscribe", "unsubscribe"]
+)
+
+
+async def handle_ws_message(
+    websocket: WebSocket,
+    message: Dict,
+    show_processing: bool = True,
+    arrived: Optional[float] = None,
+):
+    """Procesa un mensaje WebSocket y envía sus respuestas. Si el mensaje trae
+    `id`, todas sus respuestas lo incluyen para poder emparejarlas. `arrived`
+    es el instante de llegada (time.time()) que se guarda en la captura"""
+    request_id = message.get("id")
+    show_processing = message.get("processing", show_processing)
+
+    async def reply(response: Dict):
+        if request_id is not None:
+            response["id"] = request_id
+        await manager.send_message(response, websocket)
+
+    started = time.perf_counter()
+    if arrived is None:
+        arrived = time.time()
+
+    def capture(response: Dict):
+        if traffic_capture is not None:
+            traffic_capture.record(
+                {
+                    "t": arrived,
+                    "channel": "ws",
+                    "endpoint": message["type"],
+                    "request": message,
+                    "response": response,
+                    "duration_ms": (time.perf_counter() - started) * 1000,
+                    "model_version": truth_detector.model_version,
+                }
+            )
+
+    try:
+        if message.get("type") == "predict":
+            statement = message.get("statement", "").strip()
+
+            if not statement:
+                error_response = {
+                    "type": "error",
+                    "message": "La afirmación no puede estar vacía",
+                }
+                await reply(error_response)
+                return
+
+            # Enviar mensaje de procesamiento
+            if show_processing:
+                processing_response = {
+                    "type": "processing",
+                    "message": f"Analizando: '{statement}'",
+                    "model_status": (
+                        "entrenado" if truth_detector.is_trained else "no entrenado"
+                    ),
+                }
+                await reply(processing_response)
+
+            # Realizar la predicción
+            fields = resolve_fields(
+                message.get("fields"), message.get("verbose", True)
+            )
+            debug_timings = bool(message.get("debug_timings", False))
+            with traced_request("ws_predict", statement, debug=debug_timings) as trace:
+                result = await predict_async(
+                    statement, request_deadline(message.get("deadline_ms")), fields
+                )
+
+                # Enviar resultado
+                response = {
+                    "type": "prediction",
+                    "statement": statement,
+                    "result": result,
+                    "timestamp": asyncio.get_event_loop().time(),
+                    "model_info": model_info(),
+                }
+                if fields is not None:
+                    del response["statement"]
+                if debug_timings:
+                    response["timings_ns"] = trace.timings_ns()
+            await reply(response)
+            capture(response)
+
+        elif message.get("type") == "predict_batch":
+            statements = message.get("statements", [])
+
+            if not statements:
+                error_response = {
+                    "type": "error",
+                    "message": "La lista de afirmaciones no puede estar vacía",
+                }
+                await reply(error_response)
+                return
+
+            if len(statements) > MAX_BATCH_SIZE:
+                error_response = {
+                    "type": "error",
+                    "code": "batch_too_large",
+                    "message": f"El lote tiene {len(statements)} afirmaciones y el máximo es {MAX_BATCH_SIZE}",
+                    "max_batch_size": MAX_BATCH_SIZE,
+                }
+                await reply(error_response)
+                return
+
+            # Enviar mensaje de procesamiento
+            if show_processing:
+                processing_response = {
+                    "type": "processing_batch",
+                    "message": f"Analizando {len(statements)} afirmaciones en lote",
+                    "total_statements": len(statements),
+                }
+                await reply(processing_response)
+
+            # Procesar en lotes
+            fields = resolve_fields(
+                message.get("fields"), message.get("verbose", True)
+            )
+            debug_timings = bool(message.get("debug_timings", False))
+            with traced_request(
+                "ws_predict_batch", str(statements[0]), len(statements), debug_timings
+            ) as trace:
+                predictions = await predict_many_async(
+                    statements,
+                    deadline=request_deadline(message.get("deadline_ms")),
+                    fields=fields,
+                )
+                payload = batch_results_payload(
+                    statements, predictions, lean=fields is not None
+                )
+
+                # Enviar resultados por lotes
+                batch_response = {
+                    "type": "batch_prediction",
+                    "total_statements": len(statements),
+                    "results": payload["results"],
+                    "timestamp": asyncio.get_event_loop().time(),
+                    "model_info": model_info(),
+                }
+                if message.get("deadline_ms") is not None:
+                    batch_response["completed_statements"] = payload["completed_statements"]
+                    batch_response["timed_out"] = payload["timed_out"]
+                if debug_timings:
+                    batch_response["timings_ns"] = trace.timings_ns()
+            await reply(batch_response)
+            capture(batch_response)
+
+        elif message.get("type") == "get_statistics":
+            # Enviar estadísticas del modelo
+            await reply(statistics_message())
+
+        elif message.get("type") in ("subscribe", "unsubscribe"):
+            # Suscripción a las publicaciones periódicas de estadísticas
+            topics = message.get("topics") or list(statistics_publisher.topics)
+            unknown = [topic for topic in topics if topic not in statistics_publisher.topics]
+            if unknown:
+                error_response = {
+                    "type": "error",
+                    "message": f"Temas desconocidos: {', '.join(map(str, unknown))}",
+                    "supported_topics": list(statistics_publisher.topics),
+                }
+                await reply(error_response)
+                return
+
+            if message["type"] == "unsubscribe":
+                manager.unsubscribe(websocket, topics)
+                await reply({"type": "unsubscribed", "topics": topics})
+                return
+
+            manager.subscribe(websocket, topics)
+            await reply(
+                {
+                    "type": "subscribed",
+                    "topics": topics,
+                    "interval_s": statistics_publisher.interval,
+                }
+            )
+            # Estado actual; después solo llegan los cambios
+            for topic in topics:
+                await manager.send_message(statistics_publisher.snapshot(topic), websocket)
+
+        elif message.get("type") == "ping":
+            # Responder a ping con pong
+            pong_response = {"type": "pong", "message": "Conexión activa"}
+            await reply(pong_response)
+
+        else:
+            # Tipo de mensaje no reconocido
+            error_response = {
+                "type": "error",
+                "message": f"Tipo de mensaje no reconocido: {message.get('type')}",
+                "supported_types": [
+                    "predict",
+                    "predict_batch",
+                    "get_statistics",
+                    "ping",
+                    "cancel",
+                    "subscribe",
+                    "unsubscribe",
+                ],
+            }
+            await reply(error_response)
+
+    except OverloadedError as e:
+        await reply(overloaded_message(e))
+
+    except Exception as e:
+        # Error general
+        logger.error(f"Error en WebSocket: {e}")
+        error_response = {
+            "type": "error",
+            "message": f"Error interno: {str(e)}",
+        }
+        await reply(error_response)
+
+    finally:
+        # Los tipos desconocidos se agrupan para no disparar la cardinalidad
+        message_type = message.get("type")
+        if message_type not in WS_MESSAGE_TYPES:
+            message_type = "other"
+        ws_message_duration.observe(time.perf_counter() - started, message_type)
+        ws_messages_total.inc(message_type)
+
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    """Endpoint WebSocket para comunicación en tiempo real con React"""
+async def websocket_endpoint(
+    websocket: WebSocket,
+    encoding: str = "json",
+    max_in_flight: int = WS_MAX_IN_FLIGHT,
+    processing: bool = True,
+):
+    """Endpoint WebSocket para comunicación en tiempo real con React. Con
+    `?encoding=msgpack` los mensajes del servidor posteriores a la bienvenida
+    se envían como frames binarios msgpack.
+
+    Los mensajes con `id` se procesan en paralelo (hasta `max_in_flight` por
+    conexión) y sus respuestas llegan en orden de finalización con el mismo
+    `id`. Los mensajes sin `id` se procesan de uno en uno, como antes.
+    `?processing=false` suprime los mensajes de procesamiento"""
+    if encoding not in WS_ENCODINGS:
+        encoding = "json"
+    max_in_flight = max(1, min(max_in_flight, WS_MAX_IN_FLIGHT))
     await manager.connect(websocket)
 
     # Obtener estadísticas del modelo
@@ -644,160 +4074,141 @@ async def websocket_endpoint(websocket: WebSocket):
             "Niveles de confianza",
             "Afirmaciones similares",
         ],
+        "encoding": encoding,
+        "supported_encodings": list(WS_ENCODINGS),
+        "max_in_flight": max_in_flight,
     }
-    await manager.send_personal_message(json.dumps(welcome_message), websocket)
-
-    try:
-        while True:
-            # Recibir mensaje del cliente React
-            data = await websocket.receive_text()
+    # La bienvenida siempre va en JSON; después se usa la codificación negociada
+    await manager.send_message(welcome_message, websocket)
+    manager.set_encoding(websocket, encoding)
 
-            try:
-                # Parsear el mensaje JSON
-                message = json.loads(data)
-
-                if message.get("type") == "predict":
-                    statement = message.get("statement", "").strip()
-
-                    if not statement:
-                        error_response = {
-                            "type": "error",
-                            "message": "La afirmación no puede estar vacía",
-                        }
-                        await manager.send_personal_message(
-                            json.dumps(error_response), websocket
-                        )
-                        continue
+    # Cada mensaje con `id` ocupa un hueco hasta que se envía su respuesta;
+    # sin huecos libres espera en `parked` mientras se sigue leyendo el
+    # socket, para atender cancelaciones y detectar la desconexión
+    in_flight: Dict = {}
+    parked: Dict = {}
+    # Los mensajes sin `id` se atienden en orden en una tarea aparte para que
+    # el bucle de lectura detecte la desconexión aunque haya trabajo en curso
+    sequential: asyncio.Queue = asyncio.Queue(maxsize=WS_MAX_PENDING)
+    sequential_busy = False
 
-                    # Enviar mensaje de procesamiento
-                    processing_response = {
-                        "type": "processing",
-                        "message": f"Analizando: '{statement}'",
-                        "model_status": (
-                            "entrenado" if truth_detector.is_trained else "no entrenado"
-                        ),
-                    }
-                    await manager.send_personal_message(
-                        json.dumps(processing_response), websocket
-                    )
+    def start_parked():
+        while parked and len(in_flight) < max_in_flight:
+            request_id = next(iter(parked))
+            message, arrived = parked.pop(request_id)
+            in_flight[request_id] = asyncio.create_task(run_pipelined(request_id, message, arrived))
 
-                    # Realizar la predicción
-                    result = await asyncio.to_thread(truth_detector.predict, statement)
-
-                    # Enviar resultado
-                    response = {
-                        "type": "prediction",
-                        "statement": statement,
-                        "result": result,
-                        "timestamp": asyncio.get_event_loop().time(),
-                        "model_info": {
-                            "total_training_data": result.get("total_training_data", 0),
-                            "model_status": result.get("model_status", "desconocido"),
-                        },
-                    }
-                    await manager.send_personal_message(json.dumps(response), websocket)
+    async def run_pipelined(request_id, message: Dict, arrived: float):
+        try:
+            await handle_ws_message(websocket, message, processing, arrived)
+        finally:
+            if in_flight.get(request_id) is asyncio.current_task():
+                del in_flight[request_id]
+            start_parked()
 
-                elif message.get("type") == "predict_batch":
-                    statements = message.get("statements", [])
+    async def run_sequential():
+        nonlocal sequential_busy
+        while True:
+            message, arrived = await sequential.get()
+            sequential_busy = True
+            try:
+                await handle_ws_message(websocket, message, processing, arrived)
+            finally:
+                sequential_busy = False
 
-                    if not statements:
-                        error_response = {
-                            "type": "error",
-                            "message": "La lista de afirmaciones no puede estar vacía",
-                        }
-                        await manager.send_personal_message(
-                            json.dumps(error_response), websocket
-                        )
-                        continue
+    sequential_worker = asyncio.create_task(run_sequential())
 
-                    # Enviar mensaje de procesamiento
-                    processing_response = {
-                        "type": "processing_batch",
-                        "message": f"Analizando {len(statements)} afirmaciones en lote",
-                        "total_statements": len(statements),
-                    }
-                    await manager.send_personal_message(
-                        json.dumps(processing_response), websocket
-                    )
+    try:
+        while True:
+            # Recibir mensaje del cliente React (texto JSON o binario msgpack)
+            frame = await manager.receive_frame(websocket)
+            arrived = time.time()
 
-                    # Procesar en lotes
-                    batch_results = []
-                    for statement in statements:
-                        result = await asyncio.to_thread(
-                            truth_detector.predict, statement
-                        )
-                        batch_results.append({"statement": statement, "result": result})
-
-                    # Enviar resultados por lotes
-                    batch_response = {
-                        "type": "batch_prediction",
-                        "total_statements": len(statements),
-                        "results": batch_results,
-                        "timestamp": asyncio.get_event_loop().time(),
-                    }
-                    await manager.send_personal_message(
-                        json.dumps(batch_response), websocket
-                    )
+            try:
+                # Decodificar el mensaje
+                message = decode_ws_message(frame)
+            except InvalidMessageError:
+                # Error al parsear JSON
+                error_response = {
+                    "type": "error",
+                    "message": "Formato JSON inválido. Usa: {'type': 'predict', 'statement': 'tu afirmación'}",
+                }
+                await manager.send_message(error_response, websocket)
+                continue
 
-                elif message.get("type") == "get_statistics":
-                    # Enviar estadísticas del modelo
-                    stats_response = {
-                        "type": "statistics",
-                        "model_statistics": truth_detector.get_statistics(),
-                        "active_connections": len(manager.active_connections),
-                    }
-                    await manager.send_personal_message(
-                        json.dumps(stats_response), websocket
-                    )
+            request_id = message.get("id")
+            if request_id is None and message.get("type") != "cancel":
+                try:
+                    sequential.put_nowait((message, arrived))
+                except asyncio.QueueFull:
+                    await manager.send_message(too_many_pending_message(None), websocket)
+                continue
 
-                elif message.get("type") == "ping":
-                    # Responder a ping con pong
-                    pong_response = {"type": "pong", "message": "Conexión activa"}
-                    await manager.send_personal_message(
-                        json.dumps(pong_response), websocket
-                    )
+            if isinstance(request_id, bool) or not isinstance(request_id, (str, int)):
+                error_response = {
+                    "type": "error",
+                    "code": "invalid_id",
+                    "message": "El id debe ser un texto o un número entero",
+                }
+                await manager.send_message(error_response, websocket)
+                continue
 
-                else:
-                    # Tipo de mensaje no reconocido
-                    error_response = {
+            if message.get("type") == "cancel":
+                # Cancelar una petición en vuelo: los bloques pendientes no
+                # llegan a ejecutarse y no se envía su respuesta
+                task = in_flight.pop(request_id, None)
+                if task is None and parked.pop(request_id, None) is not None:
+                    # Aún esperaba hueco: se descarta sin llegar a empezar
+                    manager.cancelled_by_client += 1
+                    cancel_response = {"type": "cancelled", "id": request_id}
+                elif task is None:
+                    cancel_response = {
                         "type": "error",
-                        "message": f"Tipo de mensaje no reconocido: {message.get('type')}",
-                        "supported_types": [
-                            "predict",
-                            "predict_batch",
-                            "get_statistics",
-                            "ping",
-                        ],
+                        "code": "unknown_id",
+                        "id": request_id,
+                        "message": "No hay ninguna petición en curso con ese id",
                     }
-                    await manager.send_personal_message(
-                        json.dumps(error_response), websocket
-                    )
+                else:
+                    task.cancel()
+                    manager.cancelled_by_client += 1
+                    cancel_response = {"type": "cancelled", "id": request_id}
+                    start_parked()
+                await manager.send_message(cancel_response, websocket)
+                continue
 
-            except json.JSONDecodeError:
-                # Error al parsear JSON
+            if request_id in in_flight or request_id in parked:
                 error_response = {
                     "type": "error",
-                    "message": "Formato JSON inválido. Usa: {'type': 'predict', 'statement': 'tu afirmación'}",
+                    "code": "duplicate_id",
+                    "id": request_id,
+                    "message": "Ya hay una petición en curso con ese id",
                 }
-                await manager.send_personal_message(
-                    json.dumps(error_response), websocket
-                )
+                await manager.send_message(error_response, websocket)
+                continue
 
-            except Exception as e:
-                # Error general
-                logger.error(f"Error en WebSocket: {e}")
-                error_response = {
-                    "type": "error",
-                    "message": f"Error interno: {str(e)}",
-                }
-                await manager.send_personal_message(
-                    json.dumps(error_response), websocket
-                )
+            if len(parked) >= WS_MAX_PENDING:
+                await manager.send_message(too_many_pending_message(request_id), websocket)
+                continue
+            parked[request_id] = (message, arrived)
+            start_parked()
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
         logger.info("Cliente React desconectado")
 
+    finally:
+        manager.disconnect(websocket)
+        # Liberar el trabajo pendiente de la conexión: lo que aún está en cola
+        # en el ejecutor se descarta y lo que ya se ejecuta se contabiliza
+        # como desperdiciado
+        abandoned = len(in_flight) + len(parked) + sequential.qsize() + int(sequential_busy)
+        manager.cancelled_on_disconnect += abandoned
+        tasks = [*in_flight.values(), sequential_worker]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if abandoned:
+            logger.info(f"🛑 {abandoned} peticiones canceladas al cerrar la conexión")
+
 
 # ============================================================================
 # FUNCIÓN PRINCIPAL
@@ -829,4 +4240,6 @@ if __name__ == "__main__":
         port=8000,
         reload=True,
         log_level="info",
+        ws=DeflateWebSocketProtocol or "auto",
+        ws_per_message_deflate=WS_PERMESSAGE_DEFLATE,
     )